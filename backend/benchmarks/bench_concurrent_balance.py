@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Concurrency check for account balance updates
+
+Fires many POST /api/sales in parallel against the same shop's cash
+account, then verifies the account balance moved by exactly the sum of
+the sale totals (a lost update shows up as a shortfall):
+
+    REACT_APP_BACKEND_URL=https://... python benchmarks/bench_concurrent_balance.py --sales 200 --workers 20
+"""
+import os
+import sys
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+
+
+def login(email, password):
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={"email": email, "password": password}, timeout=10)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def cash_balance(session, shop_id):
+    response = session.get(f"{BASE_URL}/api/accounts", params={"shop_id": shop_id}, timeout=10)
+    response.raise_for_status()
+    for account in response.json():
+        if account["type"] == "cash":
+            return account["balance"]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check account balances under concurrent sales")
+    parser.add_argument("--sales", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--price", type=float, default=1000)
+    parser.add_argument("--email", default="admin@startup.com")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    token = login(args.email, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+    session = requests.Session()
+    session.headers.update(headers)
+
+    products = session.get(f"{BASE_URL}/api/products", timeout=30).json()
+    if not products:
+        print("❌ No product available to sell")
+        return 1
+    sale = {
+        "items": [{"product_id": products[0]["id"], "quantity": 1, "price": args.price}],
+        "payment_method": "cash",
+    }
+
+    # One probe sale tells us which shop (and so which cash account) is hit
+    probe = session.post(f"{BASE_URL}/api/sales", json=sale, timeout=30)
+    probe.raise_for_status()
+    shop_id = probe.json()["shop_id"]
+    before = cash_balance(session, shop_id)
+    if before is None:
+        print(f"❌ Shop {shop_id} has no cash account")
+        return 1
+
+    def sell(_):
+        response = requests.post(f"{BASE_URL}/api/sales", json=sale, headers=headers, timeout=60)
+        return response.json()["total"] if response.status_code == 200 else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        totals = list(pool.map(sell, range(args.sales)))
+    elapsed = time.perf_counter() - started
+
+    failed = totals.count(None)
+    expected = before + sum(t for t in totals if t is not None)
+    after = cash_balance(session, shop_id)
+
+    print(f"POST /api/sales x{args.sales} ({args.workers} workers) in {elapsed:.2f} s "
+          f"({args.sales / elapsed:.1f} sales/s, {failed} failed)")
+    print(f"  cash balance before:   {before:,.2f}")
+    print(f"  cash balance expected: {expected:,.2f}")
+    print(f"  cash balance after:    {after:,.2f}")
+    if abs(after - expected) > 0.01:
+        print(f"❌ Lost updates: balance is off by {expected - after:,.2f}")
+        return 1
+    print("✅ Balance consistent")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Concurrent POS stress check for stock allocation
+
+Fires many POST /api/sales in parallel for the same product (more units
+than are in stock, by default), then verifies stock never went negative
+and dropped by exactly the quantity of the sales that were accepted;
+the rest must be refused with "Stock insuffisant":
+
+    REACT_APP_BACKEND_URL=https://... python benchmarks/bench_concurrent_stock.py --sales 200 --workers 20
+"""
+import os
+import sys
+import time
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+
+
+def login(email, password):
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={"email": email, "password": password}, timeout=10)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def stock_quantity(session, product_id):
+    response = session.get(f"{BASE_URL}/api/products/{product_id}", timeout=10)
+    response.raise_for_status()
+    return response.json()["stock_quantity"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check stock stays exact under concurrent sales")
+    parser.add_argument("--sales", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--quantity", type=int, default=1, help="units per sale")
+    parser.add_argument("--product-id", help="product to sell (default: the one with the most stock)")
+    parser.add_argument("--email", default="admin@startup.com")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    token = login(args.email, args.password)
+    headers = {"Authorization": f"Bearer {token}"}
+    session = requests.Session()
+    session.headers.update(headers)
+
+    product_id = args.product_id
+    if not product_id:
+        products = session.get(f"{BASE_URL}/api/products", timeout=30).json()
+        if not products:
+            print("❌ No product available to sell")
+            return 1
+        product_id = max(products, key=lambda p: p.get("stock_quantity", 0))["id"]
+    before = stock_quantity(session, product_id)
+    sale = {
+        "items": [{"product_id": product_id, "quantity": args.quantity, "price": 1}],
+        "payment_method": "cash",
+    }
+
+    def sell(_):
+        response = requests.post(f"{BASE_URL}/api/sales", json=sale, headers=headers, timeout=60)
+        return response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        statuses = list(pool.map(sell, range(args.sales)))
+    elapsed = time.perf_counter() - started
+
+    accepted = statuses.count(200)
+    refused = statuses.count(400)
+    errors = len(statuses) - accepted - refused
+    after = stock_quantity(session, product_id)
+    expected = before - accepted * args.quantity
+
+    print(f"POST /api/sales x{args.sales} ({args.workers} workers, {args.quantity} unit(s) each) in {elapsed:.2f} s "
+          f"({args.sales / elapsed:.1f} sales/s)")
+    print(f"  accepted: {accepted}, refused (stock): {refused}, errors: {errors}")
+    print(f"  stock before:   {before}")
+    print(f"  stock expected: {expected}")
+    print(f"  stock after:    {after}")
+    if after != expected or after < 0:
+        print(f"❌ Stock drifted by {expected - after}")
+        return 1
+    if errors:
+        print(f"❌ {errors} sale(s) failed with an unexpected status")
+        return 1
+    if accepted < min(args.sales, before // args.quantity):
+        print("❌ Sales were refused while stock was still available")
+        return 1
+    print("✅ Stock exact")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
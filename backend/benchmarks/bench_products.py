@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for GET /api/products
+
+Times the endpoint and reports the SQL statements and liveness pings each
+request costs, read from /api/admin/db-stats:
+
+    REACT_APP_BACKEND_URL=https://... python benchmarks/bench_products.py --requests 200
+
+With DATABASE_URL set it also runs the product read in-process on two
+pools side by side: one that pings every connection on checkout (the old
+``SELECT 1`` before each call) and the current one, which only pings
+connections that sat idle for PG_POOL_IDLE_CHECK seconds.
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+
+
+def login(email, password):
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={"email": email, "password": password}, timeout=10)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def db_stats(session):
+    response = session.get(f"{BASE_URL}/api/admin/db-stats", timeout=10)
+    return response.json() if response.status_code == 200 else None
+
+
+def round_trips(stats):
+    """Statements plus liveness pings sent so far, or None without db-stats access."""
+    if not stats:
+        return None
+    return stats.get("queries", 0) + ((stats.get("pool") or {}).get("liveness_pings") or 0)
+
+
+def bench_direct(reads):
+    """Time the product read on a ping-on-every-checkout pool and on the current pool."""
+    from database_postgres import PgConnectionPool, PgCollection, get_query_count, _get_database_url
+
+    results = []
+    for label, idle_check in (("before (ping per call)", 0), ("after", None)):
+        options = {"keepalive_interval": 0}
+        if idle_check is not None:
+            options["idle_check"] = idle_check
+        pool = PgConnectionPool(_get_database_url(), min_size=1, max_size=1, **options)
+        products = PgCollection("products", connection=pool.connection)
+        products.find({}).to_list()  # warm up the connection and the SQL cache
+        queries, pings = get_query_count(), pool.stats()["liveness_pings"]
+        samples = []
+        for _ in range(reads):
+            started = time.perf_counter()
+            products.find({}).to_list()
+            samples.append((time.perf_counter() - started) * 1000)
+        trips = (get_query_count() - queries + pool.stats()["liveness_pings"] - pings) / reads
+        pool.closeall()
+        results.append((label, samples, trips))
+
+    print(f"products.find() x{reads} in-process")
+    print(f"  {'':<22}  {'mean':>9}  {'p50':>9}  {'p95':>9}  {'round-trips':>11}")
+    for label, samples, trips in results:
+        print(f"  {label:<22}  {statistics.mean(samples):6.3f} ms  {percentile(samples, 50):6.3f} ms  "
+              f"{percentile(samples, 95):6.3f} ms  {trips:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GET /api/products latency")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--email", default="admin@startup.com")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    token = login(args.email, args.password)
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+
+    for _ in range(args.warmup):
+        session.get(f"{BASE_URL}/api/products", timeout=30)
+
+    before = db_stats(session)
+    samples = []
+    products = 0
+    for _ in range(args.requests):
+        started = time.perf_counter()
+        response = session.get(f"{BASE_URL}/api/products", timeout=30)
+        samples.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            print(f"❌ GET /api/products returned {response.status_code}: {response.text[:200]}")
+            return 1
+        products = len(response.json())
+    after = db_stats(session)
+
+    print(f"GET /api/products x{args.requests} ({products} products)")
+    print(f"  mean: {statistics.mean(samples):8.2f} ms")
+    print(f"  p50:  {percentile(samples, 50):8.2f} ms")
+    print(f"  p95:  {percentile(samples, 95):8.2f} ms")
+    print(f"  max:  {max(samples):8.2f} ms")
+
+    if after:
+        pool = after.get("pool") or {}
+        # Includes the closing db-stats call's own auth lookup, negligible over --requests
+        trips = (round_trips(after) - round_trips(before)) / args.requests
+        pings = (pool.get("liveness_pings") or 0) - ((before.get("pool") or {}).get("liveness_pings") or 0)
+        print(f"  round-trips/request: {trips:.1f} ({pings} liveness pings in total)")
+        print(f"  pool: {pool.get('checkouts')} checkouts, wait avg {pool.get('wait_avg_ms')} ms")
+
+    if os.environ.get("DATABASE_URL"):
+        print()
+        bench_direct(args.requests)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
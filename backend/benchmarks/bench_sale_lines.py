@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark for POST /api/sales by basket size
+
+Times sales of 1, 10 and 50 line items (one product per line) and reports
+latency and the number of SQL statements per sale, read from
+/api/admin/db-stats. Both should stay flat as the basket grows: products
+are resolved in one query, items inserted in one statement and stock
+allocated in one statement.
+
+The products sold are created on first run ("Bench POS 01".."Bench POS 50")
+with a large batch each, and reused afterwards:
+
+    REACT_APP_BACKEND_URL=https://... python benchmarks/bench_sale_lines.py --sales 20
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import requests
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001').rstrip('/')
+
+BENCH_PREFIX = "Bench POS "
+BENCH_STOCK = 100000
+
+
+def login(email, password):
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={"email": email, "password": password}, timeout=10)
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def query_count(session):
+    response = session.get(f"{BASE_URL}/api/admin/db-stats", timeout=10)
+    return response.json().get("queries") if response.status_code == 200 else None
+
+
+def bench_products(session, count, units_needed):
+    """ids of ``count`` benchmark products, each with at least ``units_needed`` units in stock."""
+    existing = {p["name"]: p for p in session.get(f"{BASE_URL}/api/products", timeout=30).json()
+                if p["name"].startswith(BENCH_PREFIX)}
+    ids = []
+    for n in range(1, count + 1):
+        name = f"{BENCH_PREFIX}{n:02d}"
+        product = existing.get(name)
+        if not product:
+            response = session.post(f"{BASE_URL}/api/products", json={
+                "name": name, "category": "Benchmark", "buy_price": 500, "sell_price": 1000,
+            }, timeout=10)
+            response.raise_for_status()
+            product = response.json()
+        if product.get("stock_quantity", 0) < units_needed:
+            response = session.post(f"{BASE_URL}/api/batches", json={
+                "product_id": product["id"], "lot_number": "BENCH", "quantity": BENCH_STOCK,
+            }, timeout=10)
+            response.raise_for_status()
+        ids.append(product["id"])
+    return ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark POST /api/sales latency by number of line items")
+    parser.add_argument("--sales", type=int, default=20, help="timed sales per basket size")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--lines", default="1,10,50", help="comma-separated basket sizes")
+    parser.add_argument("--email", default="admin@startup.com")
+    parser.add_argument("--password", default="admin123")
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.lines.split(",")]
+    token = login(args.email, args.password)
+    session = requests.Session()
+    session.headers["Authorization"] = f"Bearer {token}"
+    product_ids = bench_products(session, max(sizes), (args.sales + args.warmup) * len(sizes))
+
+    results = []
+    for size in sizes:
+        sale = {
+            "items": [{"product_id": product_id, "quantity": 1, "price": 1000} for product_id in product_ids[:size]],
+            "payment_method": "cash",
+        }
+        for _ in range(args.warmup):
+            session.post(f"{BASE_URL}/api/sales", json=sale, timeout=60)
+
+        samples = []
+        before = query_count(session)
+        for _ in range(args.sales):
+            started = time.perf_counter()
+            response = session.post(f"{BASE_URL}/api/sales", json=sale, timeout=60)
+            samples.append((time.perf_counter() - started) * 1000)
+            if response.status_code != 200:
+                print(f"❌ POST /api/sales ({size} lines) returned {response.status_code}: {response.text[:200]}")
+                return 1
+        after = query_count(session)
+        # The db-stats call in between issues its own statements; they are the same for every size
+        queries = (after - before) / args.sales if before is not None and after is not None else None
+        results.append((size, samples, queries))
+
+    print(f"POST /api/sales x{args.sales} per basket size")
+    print(f"  {'lines':>5}  {'mean':>9}  {'p50':>9}  {'p95':>9}  {'queries/sale':>12}")
+    for size, samples, queries in results:
+        print(f"  {size:>5}  {statistics.mean(samples):6.2f} ms  {percentile(samples, 50):6.2f} ms  "
+              f"{percentile(samples, 95):6.2f} ms  {queries if queries is None else round(queries, 1):>12}")
+
+    counts = {queries for _, _, queries in results if queries is not None}
+    if len(counts) > 1 and max(counts) - min(counts) >= 1:
+        print("❌ Statements per sale grow with the number of lines")
+        return 1
+    print("✅ Statements per sale independent of basket size")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,7 +11,14 @@ ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # Import AFTER load_dotenv so DATABASE_URL is available
-from database_postgres import init_pg_database, get_pg_collection
+from database_postgres import (
+    init_pg_database, get_pg_collection, get_pool_stats, get_sql_cache_stats, get_query_count, close_pool,
+    INDEX_MANIFEST, transaction
+)
+from database_postgres import InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany  # bulk_write operations
+from database_async import (
+    init_async_pool, close_async_pool, get_async_pg_collection, get_async_pool_stats, async_transaction
+)
 
 _initialized = False
 
@@ -34,14 +41,42 @@ def get_collection(name: str):
     return get_pg_collection(name)
 
 
+def get_async_collection(name: str):
+    """Get an AsyncPgCollection (awaitable API) for use in async route handlers."""
+    global _initialized
+    if not _initialized:
+        get_database()
+    return get_async_pg_collection(name)
+
+
+async def init_async_database():
+    """Create the asyncpg pool used by get_async_collection()."""
+    await init_async_pool()
+
+
 def init_indexes():
-    """Indexes are created during table initialization - this is a no-op."""
-    logging.info("Database indexes created")
+    """Expression indexes from INDEX_MANIFEST are built by init_tables(); just log them."""
+    count = sum(len(fields) for fields in INDEX_MANIFEST.values())
+    logging.info(f"Database indexes ready ({count} expression indexes across {len(INDEX_MANIFEST)} collections)")
+
+
+def get_database_stats():
+    """Connection pool, SQL cache and query count statistics for monitoring/sizing."""
+    return {
+        "pool": get_pool_stats(),
+        "async_pool": get_async_pool_stats(),
+        "sql_cache": get_sql_cache_stats(),
+        "queries": get_query_count(),
+    }
 
 
 def close_connection():
-    """Close PostgreSQL connection."""
-    from database_postgres import _conn
-    if _conn and not _conn.closed:
-        _conn.close()
-        logging.info("PostgreSQL connection closed")
+    """Close all pooled PostgreSQL connections."""
+    close_pool()
+    logging.info("PostgreSQL connection pool closed")
+
+
+async def close_async_connection():
+    """Close the asyncpg pool."""
+    await close_async_pool()
+    logging.info("asyncpg connection pool closed")
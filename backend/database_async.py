@@ -0,0 +1,353 @@
+"""
+Asyncio PostgreSQL layer for StartupManager Pro
+asyncpg-backed twin of database_postgres.PgCollection: same tables, same
+Mongo-like API and the same SQL builders, but every call is awaitable so
+async route handlers no longer block the event loop while Postgres works.
+"""
+import io
+import csv
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager, nullcontext
+import asyncpg
+from database_postgres import (
+    _get_database_url, _row_to_doc, _select_sql, _count_sql, _insert_sql, _insert_many_sql,
+    _prepare_doc, _update_sql, _update_result, _delete_sql, _bulk_write_sql, _bulk_write_result,
+    _index_sql, _index_fields, _decode_after, _encode_after, _next_after, _aggregate_sql, _aggregate_docs, _result, _pg_params,
+    _query_counter,
+    POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_IDLE_CHECK, BULK_COPY_THRESHOLD, CURSOR_BATCH_SIZE,
+    SQL_CACHE_SIZE, PREPARED_STATEMENTS
+)
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+# Errors meaning the connection itself is gone (safe to retry an idempotent read)
+_CONNECTION_ERRORS = (asyncpg.ConnectionDoesNotExistError, asyncpg.InterfaceError, ConnectionError)
+
+
+def _encode_json(value):
+    # The shared builders already serialise documents with json.dumps
+    return value if isinstance(value, str) else json.dumps(value, default=str)
+
+
+def _count_query(record):
+    _query_counter.add()
+
+
+async def _init_connection(conn):
+    await conn.set_type_codec("jsonb", encoder=_encode_json, decoder=json.loads, schema="pg_catalog")
+    # Statements count towards the same total as the psycopg2 pool (see get_query_count)
+    conn.add_query_logger(_count_query)
+
+
+async def init_async_pool():
+    """Create the asyncpg pool (call once from the app's startup event)."""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                _get_database_url(),
+                min_size=POOL_MIN_SIZE,
+                max_size=POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=max(POOL_IDLE_CHECK * 10, 300),
+                init=_init_connection,
+                # asyncpg prepares every statement and caches it per connection by SQL text;
+                # the shape-keyed SQL cache keeps that text stable across filter values
+                statement_cache_size=SQL_CACHE_SIZE if PREPARED_STATEMENTS else 0,
+            )
+            logger.info("asyncpg pool ready (min=%s, max=%s)", POOL_MIN_SIZE, POOL_MAX_SIZE)
+    return _pool
+
+
+async def get_async_pool():
+    return _pool if _pool is not None else await init_async_pool()
+
+
+async def close_async_pool():
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+
+def get_async_pool_stats():
+    """asyncpg pool statistics, or None when the pool has not been created yet."""
+    if _pool is None:
+        return None
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "size": size,
+        "in_use": size - idle,
+        "idle": idle,
+    }
+
+
+@asynccontextmanager
+async def get_async_connection():
+    """Acquire a pooled asyncpg connection for the duration of the ``async with`` block."""
+    pool = await get_async_pool()
+    async with pool.acquire(timeout=POOL_TIMEOUT) as conn:
+        yield conn
+
+
+async def _run_read(fn, connection=get_async_connection):
+    """Await an idempotent read ``fn(conn)``, retrying once if the connection dropped."""
+    for attempt in range(2):
+        try:
+            async with connection() as conn:
+                return await fn(conn)
+        except _CONNECTION_ERRORS:
+            if attempt:
+                raise
+            logger.warning("PostgreSQL connection lost during async read, retrying on a new connection")
+
+
+class AsyncPgCollection:
+    """An asyncpg-backed collection with the same Mongo-like API as PgCollection, but awaitable."""
+
+    def __init__(self, table_name, connection=get_async_connection):
+        self.table_name = table_name
+        # Async context manager yielding the connection to run on (a transaction binds its own)
+        self._connection = connection
+
+    async def find_one(self, filter_dict=None, projection=None):
+        query, values = _select_sql(self.table_name, filter_dict or {}, limit=1, projection=projection)
+
+        async def read(conn):
+            return await conn.fetchrow(_pg_params(query), *values)
+
+        return _row_to_doc(await _run_read(read, self._connection))
+
+    def find(self, filter_dict=None, projection=None):
+        return AsyncPgCursor(self.table_name, filter_dict or {}, projection, connection=self._connection)
+
+    async def find_by_ids(self, ids, projection=None):
+        """Fetch many documents by id in one query: {id: doc}, unknown ids left out."""
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+        if not ids:
+            return {}
+        return {doc["id"]: doc for doc in await self.find({"id": {"$in": ids}}, projection).to_list()}
+
+    async def insert_one(self, document):
+        query, values, doc_id = _insert_sql(self.table_name, document)
+        async with self._connection() as conn:
+            await conn.execute(_pg_params(query), *values)
+        return _result("InsertResult", inserted_id=doc_id)
+
+    async def insert_many(self, documents):
+        """Insert a batch in one round-trip (COPY above BULK_COPY_THRESHOLD documents)."""
+        documents = list(documents)
+        if not documents:
+            return _result("InsertManyResult", inserted_ids=[])
+        async with self._connection() as conn:
+            if len(documents) >= BULK_COPY_THRESHOLD:
+                # asyncpg has no binary jsonb encoder for COPY, so stream CSV like the sync path
+                rows = [_prepare_doc(doc) for doc in documents]
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                await conn.copy_to_table(self.table_name, source=io.BytesIO(buffer.getvalue().encode()),
+                                         columns=["id", "data"], format="csv")
+                inserted_ids = [doc_id for doc_id, _ in rows]
+            else:
+                query, values, inserted_ids = _insert_many_sql(self.table_name, documents)
+                await conn.execute(_pg_params(query), *values)
+        return _result("InsertManyResult", inserted_ids=inserted_ids)
+
+    async def bulk_write(self, operations):
+        """Run mixed InsertOne/UpdateOne/UpdateMany/DeleteOne/DeleteMany operations in one statement."""
+        operations = list(operations)
+        if not operations:
+            return _bulk_write_result([])
+        query, values = _bulk_write_sql(self.table_name, operations)
+        async with self._connection() as conn:
+            rows = await conn.fetch(_pg_params(query), *values)
+        return _bulk_write_result(rows)
+
+    async def update_one(self, filter_dict, update_dict, upsert=False):
+        return await self._update(filter_dict, update_dict, many=False, upsert=upsert)
+
+    async def update_many(self, filter_dict, update_dict):
+        return await self._update(filter_dict, update_dict, many=True)
+
+    async def _update(self, filter_dict, update_dict, many, upsert=False):
+        query, values = _update_sql(self.table_name, filter_dict, update_dict, many=many, upsert=upsert)
+        async with self._connection() as conn:
+            row = await conn.fetchrow(_pg_params(query), *values)
+        return _update_result(row)
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        """Build an expression btree index on the given JSONB field(s)."""
+        fields = _index_fields(keys)
+        name, query = _index_sql(self.table_name, fields, unique)
+        try:
+            async with self._connection() as conn:
+                await conn.execute(query)
+        except asyncpg.PostgresError as e:
+            logger.warning(f"Could not create index on {self.table_name}({', '.join(fields)}): {e}")
+            return None
+        return name
+
+    async def delete_one(self, filter_dict):
+        return await self._delete(filter_dict, many=False)
+
+    async def delete_many(self, filter_dict):
+        return await self._delete(filter_dict, many=True)
+
+    async def _delete(self, filter_dict, many):
+        query, values = _delete_sql(self.table_name, filter_dict, many)
+        async with self._connection() as conn:
+            status = await conn.execute(_pg_params(query), *values)
+        return _result("DeleteResult", deleted_count=int(status.split()[-1]))
+
+    async def count_documents(self, filter_dict=None):
+        query, values = _count_sql(self.table_name, filter_dict or {})
+
+        async def read(conn):
+            return await conn.fetchval(_pg_params(query), *values)
+
+        return await _run_read(read, self._connection)
+
+    async def aggregate(self, pipeline):
+        """Run an aggregation pipeline server-side and return the documents."""
+        query, values = _aggregate_sql(self.table_name, pipeline)
+
+        async def read(conn):
+            return await conn.fetch(_pg_params(query), *values)
+
+        return _aggregate_docs(await _run_read(read, self._connection))
+
+
+class AsyncPgCursor:
+    """Awaitable counterpart of PgCursor: ``await cursor.to_list()`` or ``async for doc in cursor`` (streamed)."""
+
+    def __init__(self, table_name, filter_dict=None, projection=None, connection=get_async_connection):
+        self.table_name = table_name
+        self.filter_dict = filter_dict or {}
+        self.projection = projection
+        self._connection = connection
+        self._sort_field = None
+        self._sort_direction = 1
+        self._limit_val = None
+        self._skip_val = None
+        self._after = None
+        self._lookups = []
+        self._batch_size = CURSOR_BATCH_SIZE
+        self.next_after = None
+
+    def sort(self, field, direction=1):
+        self._sort_field = field
+        self._sort_direction = direction
+        return self
+
+    def limit(self, n):
+        self._limit_val = n
+        return self
+
+    def skip(self, n):
+        self._skip_val = n
+        return self
+
+    def after(self, token):
+        """Resume after the row a previous page's ``next_after`` token points at (keyset pagination)."""
+        if token:
+            _decode_after(token, self._sort_field)
+        self._after = token
+        return self
+
+    def lookup(self, spec):
+        """Embed related rows in each document, like a $lookup stage (see PgCursor.lookup)."""
+        self._lookups.append(spec)
+        return self
+
+    def batch_size(self, n):
+        self._batch_size = max(1, int(n))
+        return self
+
+    def _sql(self, **page):
+        """SELECT for this cursor; ``page`` overrides its limit/skip/after."""
+        page = {"limit": self._limit_val, "skip": self._skip_val, "after": self._after, **page}
+        return _select_sql(self.table_name, self.filter_dict, self._sort_field,
+                           self._sort_direction, page["limit"], self.projection,
+                           page["skip"], page["after"], self._lookups)
+
+    async def _fetch(self, **page):
+        query, values = self._sql(**page)
+
+        async def read(conn):
+            return await conn.fetch(_pg_params(query), *values)
+
+        return await _run_read(read, self._connection)
+
+    async def to_list(self, length=None):
+        """Fetch all matching documents (at most ``length`` when given)."""
+        if length:
+            self._limit_val = min(self._limit_val or length, length)
+        rows = await self._fetch()
+        self.next_after = _next_after(rows[-1] if rows else None, len(rows), self._limit_val, self._sort_field)
+        return [_row_to_doc(row) for row in rows]
+
+    async def __aiter__(self):
+        if self._limit_val and self._limit_val <= self._batch_size:
+            for doc in await self.to_list():
+                yield doc
+            return
+        # One plain query for the first batch; only a full batch opens a server-side cursor
+        rows = await self._fetch(limit=self._batch_size)
+        for row in rows:
+            yield _row_to_doc(row)
+        if len(rows) < self._batch_size:
+            self.next_after = None
+            return
+        limit = self._limit_val - len(rows) if self._limit_val else None
+        query, values = self._sql(limit=limit, skip=None,
+                                  after=_encode_after(self._sort_field, rows[-1][3], rows[-1][0]))
+        async with self._connection() as conn:
+            # Cursors need a transaction; inside transaction() reuse the caller's
+            async with (nullcontext() if conn.is_in_transaction() else conn.transaction(readonly=True)):
+                count, last = 0, None
+                async for row in conn.cursor(_pg_params(query), *values, prefetch=self._batch_size):
+                    count, last = count + 1, row
+                    yield _row_to_doc(row)
+        self.next_after = _next_after(last, count, limit, self._sort_field)
+
+
+class AsyncPgTransaction:
+    """Awaitable collections bound to one connection inside an ``async_transaction()`` block."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    @asynccontextmanager
+    async def _connection(self):
+        yield self.conn
+
+    def __getitem__(self, name):
+        return AsyncPgCollection(name, connection=self._connection)
+
+
+@asynccontextmanager
+async def async_transaction():
+    """Run several awaitable collection calls as one atomic commit::
+
+        async with async_transaction() as tx:
+            await tx["sales"].insert_one(sale)
+            await tx["accounts"].update_one({"id": account_id}, {"$inc": {"balance": total}})
+
+    Commits when the block exits normally, rolls back if it raises.
+    """
+    async with get_async_connection() as conn:
+        async with conn.transaction():
+            yield AsyncPgTransaction(conn)
+
+
+def get_async_pg_collection(name):
+    """Get an AsyncPgCollection instance for the given collection name."""
+    return AsyncPgCollection(name)
@@ -2,18 +2,46 @@
 PostgreSQL Database Layer for StartupManager Pro
 Uses JSONB columns with a MongoDB-compatible interface for seamless migration.
 """
+import io
 import os
+import base64
+import csv
 import json
+import time
 import logging
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.extras
-from datetime import datetime, timezone
+from decimal import Decimal
+from datetime import datetime, date, time as dt_time, timezone
 
 logger = logging.getLogger(__name__)
 
 DATABASE_URL = None
 
-_conn = None
+# Connection pool sizing (override via environment for peak hours)
+POOL_MIN_SIZE = int(os.environ.get("PG_POOL_MIN_SIZE", "2"))
+POOL_MAX_SIZE = int(os.environ.get("PG_POOL_MAX_SIZE", "20"))
+POOL_TIMEOUT = float(os.environ.get("PG_POOL_TIMEOUT", "10"))
+# Only re-validate a pooled connection on checkout after it sat idle this long (seconds)
+POOL_IDLE_CHECK = float(os.environ.get("PG_POOL_IDLE_CHECK", "30"))
+# Background keepalive ping interval for idle connections (seconds, 0 disables)
+POOL_KEEPALIVE_INTERVAL = float(os.environ.get("PG_POOL_KEEPALIVE_INTERVAL", "60"))
+# Rows fetched per round-trip when a cursor is iterated (server-side cursor)
+CURSOR_BATCH_SIZE = int(os.environ.get("PG_CURSOR_BATCH_SIZE", "2000"))
+# insert_many switches from a multi-row INSERT to COPY at this batch size
+BULK_COPY_THRESHOLD = int(os.environ.get("PG_BULK_COPY_THRESHOLD", "1000"))
+# Generated read SQL kept per query shape, and the per-connection prepared statement cap
+SQL_CACHE_SIZE = int(os.environ.get("PG_SQL_CACHE_SIZE", "512"))
+# Set to 0 behind a transaction-pooling proxy (pgbouncer), where server sessions are shared
+PREPARED_STATEMENTS = os.environ.get("PG_PREPARED_STATEMENTS", "1") != "0"
+# Time zone whose calendar days the sales_daily rollup is keyed on (rebuild it after changing this)
+REPORT_TIMEZONE = os.environ.get("REPORT_TIMEZONE", "Africa/Conakry")
+
+_pool = None
+_pool_lock = threading.Lock()
 
 COLLECTIONS = [
     "users", "shops", "products", "batches", "sales", "sale_items",
@@ -21,9 +49,212 @@ COLLECTIONS = [
     "authorized_users", "payments", "whatsapp_messages",
     "otp_codes", "incidents",
     "whitelist", "blocked_users", "access_attempts", "sessions", "audit_log",
-    "returns", "subscription_plans", "stock_requests", "activity_log"
+    "returns", "subscription_plans", "stock_requests", "activity_log",
+    "sales_daily"
 ]
 
+# Expression btree indexes on hot JSONB keys, built by init_tables. GIN jsonb_ops
+# cannot serve ``data->>'key' = %s``, so without these every filter is a seq scan.
+# Entries are a field name or a tuple of field names for a composite index.
+INDEX_MANIFEST = {
+    "users": ["email", "role", "shop_id"],
+    "shops": ["owner_id"],
+    "products": ["shop_id"],
+    "batches": ["product_id"],
+    # (shop_id, created_at, _row_id) serves the keyset-paginated, newest-first sales list
+    "sales": ["shop_id", "user_id", "created_at", ("shop_id", "created_at", "_row_id")],
+    "sale_items": ["sale_id", "product_id"],
+    "employees": ["shop_id"],
+    "documents": ["shop_id", "employee_id"],
+    "accounts": [("shop_id", "type")],
+    "access_requests": ["email", "status"],
+    "authorized_users": ["email"],
+    "payments": ["transaction_id"],
+    "sessions": ["token", "user_email"],
+    "access_attempts": ["email", "status"],
+    "audit_log": ["timestamp", "user_email"],
+    "returns": ["shop_id"],
+    "stock_requests": ["shop_id"],
+    "activity_log": ["shop_id", "created_at"],
+    "sales_daily": [("shop_id", "day"), ("user_id", "day")],
+}
+
+
+# timestamptz expression indexes (``iso_ts(data->>'field')``) for typed date-range filters
+TIMESTAMP_INDEXES = {
+    "sales": ["created_at"],
+    "returns": ["created_at"],
+    "activity_log": ["created_at"],
+    "authorized_users": ["expires_at"],
+}
+
+# ISO-8601 text -> timestamptz. Values without an offset are read as UTC rather
+# than in the session TimeZone, which is what makes it safe to declare IMMUTABLE
+# (and so usable in an index); anything that is not a valid ISO date (including
+# "2026-13-45") becomes NULL instead of failing every query on the index.
+ISO_TS_FUNCTION = r"""
+    CREATE OR REPLACE FUNCTION iso_ts(text) RETURNS timestamptz
+    LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE RETURNS NULL ON NULL INPUT AS $$
+    BEGIN
+        IF $1 !~ '^\d{4}-\d{2}-\d{2}' THEN
+            RETURN NULL;
+        ELSIF $1 ~ '[T ]\d{2}:\d{2}.*(Z|[+-]\d{2}(:?\d{2})?)$' THEN
+            RETURN $1::timestamptz;
+        END IF;
+        RETURN $1::timestamp AT TIME ZONE 'UTC';
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END
+    $$;
+"""
+
+# products.data.stock_quantity = SUM(batches.quantity), kept current by the batch
+# write itself (same transaction), so product listings never re-sum batches.
+# inventory.py check/rebuild verifies and repairs the totals.
+STOCK_TRIGGER = r"""
+    CREATE OR REPLACE FUNCTION adjust_product_stock(product_id text, delta numeric) RETURNS void
+    LANGUAGE sql AS $$
+        UPDATE products
+        SET data = jsonb_set(data, '{stock_quantity}', to_jsonb(COALESCE((data->>'stock_quantity')::numeric, 0) + delta))
+        WHERE id = product_id AND delta <> 0
+    $$;
+
+    CREATE OR REPLACE FUNCTION sync_product_stock() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.data->>'product_id' IS NOT DISTINCT FROM NEW.data->>'product_id' THEN
+            PERFORM adjust_product_stock(NEW.data->>'product_id',
+                COALESCE((NEW.data->>'quantity')::numeric, 0) - COALESCE((OLD.data->>'quantity')::numeric, 0));
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM adjust_product_stock(OLD.data->>'product_id', -COALESCE((OLD.data->>'quantity')::numeric, 0));
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM adjust_product_stock(NEW.data->>'product_id', COALESCE((NEW.data->>'quantity')::numeric, 0));
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+
+    DROP TRIGGER IF EXISTS batches_stock_sync ON batches;
+    CREATE TRIGGER batches_stock_sync AFTER INSERT OR DELETE ON batches
+        FOR EACH ROW EXECUTE FUNCTION sync_product_stock();
+    DROP TRIGGER IF EXISTS batches_stock_sync_update ON batches;
+    CREATE TRIGGER batches_stock_sync_update AFTER UPDATE ON batches
+        FOR EACH ROW WHEN (OLD.data->'quantity' IS DISTINCT FROM NEW.data->'quantity'
+                           OR OLD.data->'product_id' IS DISTINCT FROM NEW.data->'product_id')
+        EXECUTE FUNCTION sync_product_stock();
+
+    -- Backfill products created before the trigger existed
+    UPDATE products p
+    SET data = jsonb_set(p.data, '{stock_quantity}', to_jsonb(COALESCE(
+        (SELECT SUM((b.data->>'quantity')::numeric) FROM batches b WHERE b.data->>'product_id' = p.id), 0)))
+    WHERE NOT p.data ? 'stock_quantity';
+"""
+
+
+# sales_daily: one document per (shop_id, local day, payment_method, user_id) holding
+# sales_count/revenue/profit and returns_count/returns_amount, kept current by
+# triggers on sales and returns so each write updates its rollup row in the same
+# transaction. Days are calendar days in REPORT_TIMEZONE. Returns only count once
+# approved (the status update books them; rejecting or reopening one backs it
+# out), on the day they were recorded, under the payment method and seller of
+# their sale.
+SALES_ROLLUP_TRIGGER = r"""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sales_daily_id_unique ON sales_daily (id);
+
+    CREATE OR REPLACE FUNCTION sales_day(ts text) RETURNS text
+    LANGUAGE sql STABLE AS $$
+        SELECT COALESCE(to_char(iso_ts(ts) AT TIME ZONE '{timezone}', 'YYYY-MM-DD'), '')
+    $$;
+
+    CREATE OR REPLACE FUNCTION sale_rollup(sale jsonb) RETURNS jsonb
+    LANGUAGE sql STABLE AS $$
+        SELECT jsonb_build_object(
+            'shop_id', COALESCE(sale->>'shop_id', ''), 'day', sales_day(sale->>'created_at'),
+            'payment_method', COALESCE(sale->>'payment_method', ''), 'user_id', COALESCE(sale->>'user_id', ''),
+            'sales_count', 1, 'revenue', COALESCE((sale->>'total')::numeric, 0),
+            'profit', COALESCE((sale->>'profit')::numeric, 0), 'returns_count', 0, 'returns_amount', 0)
+    $$;
+
+    CREATE OR REPLACE FUNCTION return_rollup(ret jsonb) RETURNS jsonb
+    LANGUAGE sql STABLE AS $$
+        SELECT jsonb_build_object(
+            'shop_id', COALESCE(s.data->>'shop_id', NULLIF(ret->>'shop_id', ''), ''), 'day', sales_day(ret->>'created_at'),
+            'payment_method', COALESCE(s.data->>'payment_method', ''), 'user_id', COALESCE(s.data->>'user_id', ''),
+            'sales_count', 0, 'revenue', 0, 'profit', 0,
+            'returns_count', CASE WHEN ret->>'status' = 'approved' THEN 1 ELSE 0 END,
+            'returns_amount', CASE WHEN ret->>'status' = 'approved' THEN COALESCE((ret->>'amount')::numeric, 0) ELSE 0 END)
+        FROM (SELECT 1) one
+        LEFT JOIN LATERAL (SELECT data FROM sales WHERE id = ret->>'sale_id' LIMIT 1) s ON TRUE
+    $$;
+
+    CREATE OR REPLACE FUNCTION bump_sales_daily(delta jsonb, sign numeric) RETURNS void
+    LANGUAGE sql AS $$
+        INSERT INTO sales_daily (id, data)
+        SELECT concat_ws('|', delta->>'shop_id', delta->>'day', delta->>'payment_method', delta->>'user_id'),
+               delta || (SELECT jsonb_object_agg(k, sign * (delta->>k)::numeric)
+                         FROM unnest(ARRAY['sales_count', 'revenue', 'profit', 'returns_count', 'returns_amount']) k)
+        ON CONFLICT (id) DO UPDATE SET data = sales_daily.data || (
+            SELECT jsonb_object_agg(k, COALESCE((sales_daily.data->>k)::numeric, 0) + (EXCLUDED.data->>k)::numeric)
+            FROM unnest(ARRAY['sales_count', 'revenue', 'profit', 'returns_count', 'returns_amount']) k)
+    $$;
+
+    CREATE OR REPLACE FUNCTION sync_sales_daily() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM bump_sales_daily(CASE WHEN TG_TABLE_NAME = 'sales' THEN sale_rollup(OLD.data)
+                                          ELSE return_rollup(OLD.data) END, -1);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM bump_sales_daily(CASE WHEN TG_TABLE_NAME = 'sales' THEN sale_rollup(NEW.data)
+                                          ELSE return_rollup(NEW.data) END, 1);
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+
+    DROP TRIGGER IF EXISTS sales_daily_sync ON sales;
+    CREATE TRIGGER sales_daily_sync AFTER INSERT OR DELETE OR UPDATE OF data ON sales
+        FOR EACH ROW EXECUTE FUNCTION sync_sales_daily();
+    DROP TRIGGER IF EXISTS returns_daily_sync ON returns;
+    CREATE TRIGGER returns_daily_sync AFTER INSERT OR DELETE OR UPDATE OF data ON returns
+        FOR EACH ROW EXECUTE FUNCTION sync_sales_daily();
+
+    -- The rollup recomputed from scratch (used by the backfill and by reporting.py rebuild/check)
+    CREATE OR REPLACE FUNCTION sales_daily_rows() RETURNS TABLE (key text, totals jsonb)
+    LANGUAGE sql STABLE AS $$
+        SELECT concat_ws('|', r->>'shop_id', r->>'day', r->>'payment_method', r->>'user_id'),
+               jsonb_build_object(
+                   'shop_id', r->>'shop_id', 'day', r->>'day',
+                   'payment_method', r->>'payment_method', 'user_id', r->>'user_id',
+                   'sales_count', SUM((r->>'sales_count')::numeric), 'revenue', SUM((r->>'revenue')::numeric),
+                   'profit', SUM((r->>'profit')::numeric), 'returns_count', SUM((r->>'returns_count')::numeric),
+                   'returns_amount', SUM((r->>'returns_amount')::numeric))
+        FROM (SELECT sale_rollup(data) AS r FROM sales
+              UNION ALL
+              SELECT return_rollup(data) FROM returns) src
+        GROUP BY r->>'shop_id', r->>'day', r->>'payment_method', r->>'user_id'
+    $$;
+
+    -- Rollups built under an older definition (v1 booked pending and rejected
+    -- returns) are emptied here and refilled by the backfill below
+    DO $$
+    BEGIN
+        IF obj_description('sales_daily'::regclass, 'pg_class') IS DISTINCT FROM 'sales_daily v2' THEN
+            DELETE FROM sales_daily;
+            COMMENT ON TABLE sales_daily IS 'sales_daily v2';
+        END IF;
+    END
+    $$;
+
+    -- Backfill sales recorded before the rollup existed
+    INSERT INTO sales_daily (id, data)
+    SELECT key, totals FROM sales_daily_rows() WHERE NOT EXISTS (SELECT 1 FROM sales_daily);
+"""
+
 
 def _get_database_url():
     global DATABASE_URL
@@ -32,43 +263,371 @@ def _get_database_url():
     return DATABASE_URL
 
 
-def get_connection():
-    global _conn
-    try:
-        if _conn is not None and not _conn.closed:
-            # Test if connection is still alive
-            _conn.cursor().execute("SELECT 1")
-            return _conn
-    except Exception:
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out before the timeout."""
+    pass
+
+
+class _QueryCounter:
+    """Process-wide count of statements sent to PostgreSQL (both drivers), for N+1 detection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n=1):
+        with self._lock:
+            self.count += n
+
+
+_query_counter = _QueryCounter()
+
+
+def get_query_count():
+    """Statements executed since startup (sync and async pools)."""
+    return _query_counter.count
+
+
+class _CountingCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        _query_counter.add()
+        return super().execute(query, vars)
+
+    def copy_expert(self, sql, file, size=8192):
+        _query_counter.add()
+        return super().copy_expert(sql, file, size)
+
+
+class _PgConnection(psycopg2.extensions.connection):
+    """psycopg2 connection that remembers which statements are PREPAREd on its session."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = {}  # SQL text -> prepared statement name
+        self.cursor_factory = _CountingCursor
+
+
+class _PoolEntry:
+    """Health bookkeeping for one pooled connection."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.checkouts = 0
+        self.errors = 0
+        self.suspect = False  # set when a sibling connection was found dead
+
+
+class PgConnectionPool:
+    """A bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to ``max_size``; callers wait up to
+    ``timeout`` seconds for one to be returned before ``PoolTimeout`` is raised.
+    """
+
+    def __init__(self, dsn, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 idle_check=POOL_IDLE_CHECK, keepalive_interval=POOL_KEEPALIVE_INTERVAL):
+        self.dsn = dsn
+        self.max_size = max(1, max_size)
+        self.min_size = max(0, min(min_size, self.max_size))
+        self.timeout = timeout
+        self.idle_check = idle_check
+        self.keepalive_interval = keepalive_interval
+        self._idle = deque()
+        self._entries = {}
+        self._size = 0  # open + opening connections
+        self._cond = threading.Condition()
+        self._closed = False
+        # Stats
+        self._checkouts = 0
+        self._timeouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._created = 0
+        self._discarded = 0
+        self._pings = 0
+        for _ in range(self.min_size):
+            self._size += 1
+            self._idle.append(self._open_entry())
+        if self.keepalive_interval > 0:
+            threading.Thread(target=self._keepalive_loop, name="pg-pool-keepalive", daemon=True).start()
+
+    def _connect(self):
+        # Retry connection up to 5 times with delay (handles PostgreSQL cold starts)
+        last_err = None
+        for attempt in range(5):
+            try:
+                # TCP keepalives let the kernel notice dead peers between our own pings
+                conn = psycopg2.connect(self.dsn, connection_factory=_PgConnection, keepalives=1,
+                                        keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+                conn.autocommit = True
+                psycopg2.extras.register_default_jsonb(conn_or_curs=conn, loads=json.loads)
+                return conn
+            except psycopg2.OperationalError as e:
+                last_err = e
+                logger.warning(f"PostgreSQL connection attempt {attempt+1}/5 failed, retrying in 3s...")
+                time.sleep(3)
+        raise last_err
+
+    def _open_entry(self):
+        """Open a connection for a slot already counted in ``_size``."""
         try:
-            _conn.close()
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        entry = _PoolEntry(conn)
+        with self._cond:
+            self._entries[conn] = entry
+            self._created += 1
+        return entry
+
+    def _discard(self, entry):
+        """Close a connection and free its slot. Caller holds the lock."""
+        if self._entries.pop(entry.conn, None) is not None:
+            self._size -= 1
+            self._discarded += 1
+        try:
+            entry.conn.close()
         except Exception:
             pass
-        _conn = None
-    
-    db_url = _get_database_url()
-    
-    # Retry connection up to 5 times with delay (handles PostgreSQL cold starts)
-    import time
-    last_err = None
-    for attempt in range(5):
+
+    def _is_alive(self, entry, force=False):
+        """Ping the connection, but only if it has been idle for ``idle_check`` seconds.
+
+        Recently used connections are trusted; a connection that died in the
+        meantime is caught by ``_run_read`` retrying on another one.
+        """
+        if entry.conn.closed:
+            return False
+        if not force and not entry.suspect and time.monotonic() - entry.last_used < self.idle_check:
+            return True
+        entry.suspect = False
         try:
-            _conn = psycopg2.connect(db_url)
-            _conn.autocommit = True
-            psycopg2.extras.register_default_jsonb(conn_or_curs=_conn, loads=json.loads)
-            return _conn
-        except psycopg2.OperationalError as e:
-            last_err = e
-            logger.warning(f"PostgreSQL connection attempt {attempt+1}/5 failed, retrying in 3s...")
-            time.sleep(3)
-    
-    raise last_err
+            cur = entry.conn.cursor(cursor_factory=psycopg2.extensions.cursor)  # pings are not app queries
+            cur.execute("SELECT 1")
+            cur.close()
+            self._pings += 1
+            return True
+        except Exception:
+            return False
+
+    def _keepalive_loop(self):
+        """Ping idle connections periodically so firewalls/NAT don't silently drop them."""
+        while True:
+            time.sleep(self.keepalive_interval)
+            with self._cond:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                stale = [e for e in self._idle if now - e.last_used >= self.keepalive_interval]
+                for entry in stale:
+                    self._idle.remove(entry)
+            for entry in stale:
+                alive = self._is_alive(entry, force=True)
+                with self._cond:
+                    if alive and not self._closed:
+                        entry.last_used = time.monotonic()
+                        self._idle.appendleft(entry)
+                    else:
+                        self._discard(entry)
+                    self._cond.notify()
+
+    def getconn(self, timeout=None):
+        """Check out a connection, waiting up to ``timeout`` seconds for a free slot."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"No PostgreSQL connection available after {timeout}s (max_size={self.max_size})")
+                waited = True
+                self._cond.wait(remaining)
+        if entry is not None and not self._is_alive(entry):
+            with self._cond:
+                self._discard(entry)
+                self._size += 1
+            entry = None
+        if entry is None:
+            entry = self._open_entry()
+        wait = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+            entry.checkouts += 1
+            entry.last_used = time.monotonic()
+        return entry.conn
+
+    def putconn(self, conn, discard=False):
+        """Return a connection; broken connections are closed instead of reused."""
+        with self._cond:
+            entry = self._entries.get(conn)
+            if entry is None:
+                return
+            entry.last_used = time.monotonic()
+            if not discard and not conn.closed:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        discard = True
+                if not conn.autocommit:
+                    try:
+                        conn.autocommit = True
+                    except Exception:
+                        discard = True
+            if discard or conn.closed or self._closed:
+                if conn.closed:
+                    # A dead connection usually means a server restart or network
+                    # drop: make the siblings prove they are alive before reuse.
+                    for other in self._idle:
+                        other.suspect = True
+                self._discard(entry)
+            else:
+                self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a connection for a ``with`` block and always return it."""
+        conn = self.getconn(timeout)
+        discard = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # Query-level errors (e.g. statement timeout) leave the connection usable
+            discard = bool(conn.closed)
+            self._record_error(conn)
+            raise
+        except Exception:
+            self._record_error(conn)
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    def _record_error(self, conn):
+        with self._cond:
+            entry = self._entries.get(conn)
+            if entry is not None:
+                entry.errors += 1
+
+    def stats(self):
+        """Snapshot of pool usage, wait times and per-connection health."""
+        with self._cond:
+            now = time.monotonic()
+            idle = len(self._idle)
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "in_use": self._size - idle,
+                "idle": idle,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "connections_created": self._created,
+                "connections_discarded": self._discarded,
+                "liveness_pings": self._pings,
+                "connections": [
+                    {
+                        "age_s": round(now - e.created_at, 1),
+                        "idle_s": round(now - e.last_used, 1),
+                        "checkouts": e.checkouts,
+                        "errors": e.errors,
+                    }
+                    for e in self._entries.values()
+                ],
+            }
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for entry in list(self._entries.values()):
+                self._discard(entry)
+            self._idle.clear()
+            self._cond.notify_all()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PgConnectionPool(_get_database_url())
+    return _pool
+
+
+def get_pool_stats():
+    """Pool statistics, or None when the pool has not been created yet."""
+    return _pool.stats() if _pool is not None else None
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def get_connection():
+    """Check out a pooled connection for the duration of the ``with`` block."""
+    with get_pool().connection() as conn:
+        yield conn
+
+
+def _run_read(fn, connection=get_connection):
+    """Run an idempotent read ``fn(conn)``, retrying once if the connection dropped.
+
+    Writes are never retried here: a lost connection during a write may or may
+    not have committed, so that error is surfaced to the caller instead.
+    """
+    for attempt in range(2):
+        conn = None
+        try:
+            with connection() as conn:
+                return fn(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if attempt or conn is None or not conn.closed:
+                raise
+            logger.warning("PostgreSQL connection lost during read, retrying on a new connection")
 
 
 def init_tables():
     """Create all tables if they don't exist."""
-    conn = get_connection()
-    cur = conn.cursor()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        _create_tables(cur)
+        cur.close()
+    logger.info("PostgreSQL tables initialized")
+
+
+def _create_tables(cur):
+    cur.execute(ISO_TS_FUNCTION)
     for col_name in COLLECTIONS:
         cur.execute(f"""
             CREATE TABLE IF NOT EXISTS {col_name} (
@@ -80,8 +639,74 @@ def init_tables():
         # Create index on the 'id' field and GIN index on data
         cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{col_name}_id ON {col_name}(id);")
         cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{col_name}_data ON {col_name} USING GIN(data);")
-    cur.close()
-    logger.info("PostgreSQL tables initialized")
+        for fields in INDEX_MANIFEST.get(col_name, []):
+            cur.execute(_index_sql(col_name, fields)[1])
+        for field in TIMESTAMP_INDEXES.get(col_name, []):
+            cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{col_name}_{field}_ts ON {col_name} (iso_ts(data->>'{field}'));")
+    cur.execute(STOCK_TRIGGER)
+    cur.execute(SALES_ROLLUP_TRIGGER.replace("{timezone}", REPORT_TIMEZONE.replace("'", "''")))
+
+
+def _index_sql(table_name, fields, unique=False):
+    """(index_name, CREATE INDEX statement) on ``data->>'field'`` expressions."""
+    if isinstance(fields, str):
+        fields = (fields,)
+    name = f"idx_{table_name}_{'_'.join(fields)}" + ("_unique" if unique else "")
+    columns = ", ".join(f if f in ("id", "_row_id") else f"(data->>'{f}')" for f in fields)
+    return name, f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table_name} ({columns});"
+
+
+def _index_fields(keys):
+    """Normalize a pymongo-style index spec ('field' or [('field', 1), ...]) to field names."""
+    if isinstance(keys, str):
+        return (keys,)
+    return tuple(k[0] if isinstance(k, (list, tuple)) else k for k in keys)
+
+
+_RANGE_OPS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _field_sql(key):
+    """SQL expression for a document field: the id column, ``data->>'k'`` or ``data#>>'{a,b}'``."""
+    if key == "id":
+        return "id"
+    if "." in key:
+        return f"data#>>'{{{','.join(key.split('.'))}}}'"
+    return f"data->>'{key}'"
+
+
+def _scalar_sql(value):
+    """Text form of an equality operand as ``->>`` renders it (JSON booleans are lowercase)."""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _range_operand(value):
+    """Normalise a range operand: (kind, operand) with kind "ts", "num" or "text"."""
+    if isinstance(value, (datetime, date)):
+        if not isinstance(value, datetime):
+            value = datetime.combine(value, dt_time.min)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return "ts", value
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return "num", value
+    return "text", _scalar_sql(value)
+
+
+def _range_sql(field, op, value):
+    """Typed range comparison: the cast follows the operand's Python type so it can use an index.
+
+    datetime/date operands compare as timestamptz through ``iso_ts()`` (see
+    TIMESTAMP_INDEXES), numbers as numeric, anything else as text.
+    """
+    kind, operand = _range_operand(value)
+    if kind == "ts":
+        return f"iso_ts({field}) {op} %s::timestamptz", operand
+    if kind == "num":
+        return f"({field})::numeric {op} %s::numeric", operand
+    return f"{field} {op} %s", operand
 
 
 def _match_filter(filter_dict):
@@ -93,224 +718,884 @@ def _match_filter(filter_dict):
     values = []
     
     for key, value in filter_dict.items():
-        if key == "id":
-            conditions.append("id = %s")
-            values.append(str(value))
-        elif isinstance(value, dict):
+        field = _field_sql(key)
+        if isinstance(value, dict):
             # Handle MongoDB operators like $gte, $lte, $in, etc.
             for op, op_val in value.items():
-                if op == "$gte":
-                    conditions.append(f"(data->>'{key}')::float >= %s")
-                    values.append(float(op_val))
-                elif op == "$lte":
-                    conditions.append(f"(data->>'{key}')::float <= %s")
-                    values.append(float(op_val))
-                elif op == "$gt":
-                    conditions.append(f"(data->>'{key}')::float > %s")
-                    values.append(float(op_val))
-                elif op == "$lt":
-                    conditions.append(f"(data->>'{key}')::float < %s")
-                    values.append(float(op_val))
-                elif op == "$in":
-                    placeholders = ",".join(["%s"] * len(op_val))
-                    conditions.append(f"data->>'{key}' IN ({placeholders})")
-                    values.extend([str(v) for v in op_val])
+                if op in _RANGE_OPS:
+                    condition, operand = _range_sql(field, _RANGE_OPS[op], op_val)
+                    conditions.append(condition)
+                    values.append(operand)
+                elif op in ("$in", "$nin"):
+                    if not op_val:
+                        conditions.append("FALSE" if op == "$in" else "TRUE")
+                        continue
+                    # One array parameter keeps the SQL text the same whatever the list length
+                    conditions.append(f"{field} = ANY(%s::text[])" if op == "$in" else f"{field} <> ALL(%s::text[])")
+                    values.append([_scalar_sql(v) for v in op_val])
+                elif op in ("$eq", "$ne") and op_val is None:
+                    # Like Mongo, null matches a missing key as well as an explicit null
+                    conditions.append(f"{field} IS {'NOT ' if op == '$ne' else ''}NULL")
+                elif op == "$eq":
+                    conditions.append(f"{field} = %s")
+                    values.append(_scalar_sql(op_val))
                 elif op == "$ne":
-                    conditions.append(f"data->>'{key}' != %s")
-                    values.append(str(op_val))
+                    conditions.append(f"{field} IS DISTINCT FROM %s")
+                    values.append(_scalar_sql(op_val))
+                elif op == "$exists":
+                    conditions.append(f"{field} IS {'NOT ' if op_val else ''}NULL")
+                else:
+                    raise ValueError(f"Unsupported filter operator: {op}")
+        elif value is None:
+            conditions.append(f"{field} IS NULL")
         else:
-            conditions.append(f"data->>'{key}' = %s")
-            values.append(str(value))
+            conditions.append(f"{field} = %s")
+            values.append(_scalar_sql(value))
     
     return " AND ".join(conditions), values
 
 
+def _filter_shape(filter_dict):
+    """Hashable shape of a filter: everything _match_filter's SQL text depends on, minus the values."""
+    shape = []
+    for key, value in (filter_dict or {}).items():
+        if isinstance(value, dict):
+            ops = []
+            for op, op_val in value.items():
+                if op in _RANGE_OPS:
+                    ops.append((op, _range_operand(op_val)[0]))
+                elif op in ("$in", "$nin"):
+                    ops.append((op, bool(op_val)))
+                elif op == "$exists":
+                    ops.append((op, bool(op_val)))
+                elif op in ("$eq", "$ne"):
+                    ops.append((op, op_val is None))
+                else:
+                    ops.append((op, None))
+            shape.append((key, tuple(ops)))
+        else:
+            shape.append((key, value is None))
+    return tuple(shape)
+
+
+def _filter_values(filter_dict):
+    """The parameters _match_filter would bind for ``filter_dict``, in placeholder order."""
+    values = []
+    for value in (filter_dict or {}).values():
+        if isinstance(value, dict):
+            for op, op_val in value.items():
+                if op in _RANGE_OPS:
+                    values.append(_range_operand(op_val)[1])
+                elif op in ("$in", "$nin"):
+                    if op_val:
+                        values.append([_scalar_sql(v) for v in op_val])
+                elif op in ("$eq", "$ne") and op_val is not None:
+                    values.append(_scalar_sql(op_val))
+        elif value is not None:
+            values.append(_scalar_sql(value))
+    return values
+
+
+# ========================
+# SQL builders (shared by PgCollection and the asyncio AsyncPgCollection)
+# ========================
+
+class _SqlCache:
+    """Thread-safe LRU of generated SQL keyed on query shape, with hit/miss counters.
+
+    Filters that differ only in their values (``{"shop_id": a}`` vs
+    ``{"shop_id": b}``) share one SQL text, so the string is built once and
+    the server-side prepared statement for it is reused (see _execute_prepared).
+    """
+
+    def __init__(self, size=SQL_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prepares = 0
+        self.executions = 0
+
+    def get(self, key, build):
+        with self._lock:
+            query = self._entries.get(key)
+            if query is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return query
+        query = build()
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = query
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return query
+
+    def record(self, prepared):
+        with self._lock:
+            self.executions += 1
+            if prepared:
+                self.prepares += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "prepared_statements": PREPARED_STATEMENTS,
+                "prepares": self.prepares,
+                "prepared_executions": self.executions,
+            }
+
+
+_sql_cache = _SqlCache()
+
+
+def get_sql_cache_stats():
+    """Hit/miss counters of the shape-keyed SQL cache and prepared statement usage."""
+    return _sql_cache.stats()
+
+
+def _pg_params(query):
+    """Rewrite psycopg2 '%s' placeholders to Postgres' positional '$n' form."""
+    parts = query.split("%s")
+    out = parts[0]
+    for i, part in enumerate(parts[1:], 1):
+        out += f"${i}{part}"
+    return out
+
+
+def _execute_prepared(cur, query, values):
+    """Execute a cached read through a prepared statement on the cursor's connection.
+
+    The statement is PREPAREd the first time a connection sees this SQL text
+    and EXECUTEd afterwards, so Postgres parses and plans each shape once per
+    session instead of on every call.
+    """
+    prepared = getattr(cur.connection, "prepared", None)
+    if not PREPARED_STATEMENTS or prepared is None:
+        cur.execute(query, values)
+        return
+    name = prepared.get(query)
+    if name is None:
+        # Session housekeeping, not counted as application queries (see get_query_count)
+        setup = cur.connection.cursor(cursor_factory=psycopg2.extensions.cursor)
+        if len(prepared) >= SQL_CACHE_SIZE:
+            setup.execute("DEALLOCATE ALL")
+            prepared.clear()
+        name = f"pgq_{len(prepared) + 1}"
+        setup.execute(f"PREPARE {name} AS {_pg_params(query)}")
+        setup.close()
+        prepared[query] = name
+        _sql_cache.record(prepared=True)
+    else:
+        _sql_cache.record(prepared=False)
+    if values:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(values))})", values)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def _row_to_doc(row):
+    """Convert a (_row_id, id, data) row to a document dict (like MongoDB doc without _id)."""
+    if row is None:
+        return None
+    data = row[2] if isinstance(row[2], dict) else json.loads(row[2])
+    data["id"] = row[1]
+    return data
+
+
+def _projection_sql(projection):
+    """Compile a Mongo projection into a server-side ``data`` expression.
+
+    Inclusion (``{"name": 1, "price": 1}`` or a list of names) keeps only those
+    of the listed keys the document has, so like Mongo a missing key stays
+    missing (and ``.get(key, default)`` still applies) instead of coming back
+    as null; exclusion (``{"qr_code": 0}``) strips
+    keys with ``data - ARRAY[...]``. ``id`` lives in its own column and is always
+    returned; ``_id`` is ignored.
+    """
+    if not projection:
+        return "data"
+    if not isinstance(projection, dict):
+        projection = {field: 1 for field in projection}
+    fields = {k: bool(v) for k, v in projection.items() if k not in ("id", "_id")}
+    if not fields:
+        return "'{}'::jsonb" if any(projection.values()) else "data"
+    if all(fields.values()):
+        keys = ", ".join(f"'{k}'" for k in fields)
+        return f"COALESCE((SELECT jsonb_object_agg(key, value) FROM jsonb_each(data) WHERE key IN ({keys})), '{{}}'::jsonb)"
+    if not any(fields.values()):
+        keys = ", ".join(f"'{k}'" for k in fields)
+        return f"data - ARRAY[{keys}]"
+    raise ValueError("Projection cannot mix inclusion and exclusion")
+
+
+def _projection_key(projection):
+    if not projection:
+        return None
+    if isinstance(projection, dict):
+        return tuple((k, bool(v)) for k, v in projection.items())
+    return tuple(projection)
+
+
+def _encode_after(sort_field, sort_value, row_id):
+    """Opaque keyset continuation token for the row at (sort_value, _row_id)."""
+    raw = json.dumps([sort_field, sort_value, row_id], default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_after(token, sort_field):
+    """Decode a continuation token, raising ValueError if it is malformed or for another sort."""
+    try:
+        field, sort_value, row_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        row_id = int(row_id)
+    except Exception:
+        raise ValueError("Invalid pagination token")
+    if field != sort_field:
+        raise ValueError("Pagination token does not match the cursor sort")
+    return sort_value, row_id
+
+
+def _seek_sql(sort_expr, descending, sort_value, row_id):
+    """WHERE condition selecting the rows after (sort_value, row_id) in ``ORDER BY sort, _row_id``.
+
+    Postgres sorts NULLs last ascending and first descending, so a missing
+    sort key needs its own branch; the common case is a single row comparison
+    that an index on (sort expression, _row_id) can serve.
+    """
+    op = "<" if descending else ">"
+    if sort_expr is None:
+        return f"_row_id {op} %s", [row_id]
+    if sort_value is None:
+        if descending:
+            return f"(({sort_expr}) IS NULL AND _row_id < %s OR ({sort_expr}) IS NOT NULL)", [row_id]
+        return f"(({sort_expr}) IS NULL AND _row_id > %s)", [row_id]
+    if descending:
+        return f"({sort_expr}, _row_id) < (%s, %s)", [sort_value, row_id]
+    return f"(({sort_expr}, _row_id) > (%s, %s) OR ({sort_expr}) IS NULL)", [sort_value, row_id]
+
+
+def _select_sql(table_name, filter_dict, sort_field=None, sort_direction=1, limit=None, projection=None,
+                skip=None, after=None, lookups=()):
+    """SELECT for a cursor. Rows are (_row_id, id, data, sort_key).
+
+    Sorted results are tie-broken on ``_row_id`` so keyset pagination with an
+    ``after`` token (see _encode_after) is stable; unsorted results that are
+    paged come back in ``_row_id`` order. ``lookups`` ($lookup specs) embed the
+    matching rows of another table into each document, evaluated only for the
+    rows of the page. The SQL text is cached per query shape; only the bound
+    values are rebuilt on each call.
+    """
+    sort_expr = _field_sql(sort_field) if sort_field else None
+    descending = bool(sort_field) and sort_direction != 1
+    seek = _decode_after(after, sort_field) if after else None
+    
+    def build():
+        data_sql = _projection_sql(projection)
+        if lookups:
+            data_sql = " || ".join([f"({data_sql})"] + [_lookup_sql(table_name, spec) for spec in lookups])
+        query = f"SELECT _row_id, id, {data_sql}, {sort_expr or 'NULL'} FROM {table_name}"
+        where_clause, _ = _match_filter(filter_dict)
+        if seek:
+            where_clause = f"{where_clause} AND {_seek_sql(sort_expr, descending, *seek)[0]}"
+        query += f" WHERE {where_clause}"
+        if sort_field:
+            direction = "DESC" if descending else "ASC"
+            query += f" ORDER BY {sort_expr} {direction}, _row_id {direction}"
+        elif limit or skip or after:
+            query += " ORDER BY _row_id"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        if skip:
+            query += f" OFFSET {int(skip)}"
+        return query
+    
+    key = ("select", table_name, _filter_shape(filter_dict), sort_field, descending, limit, skip,
+           _projection_key(projection), seek and seek[0] is None,
+           tuple((l["from"], l["localField"], l["foreignField"], l["as"]) for l in lookups))
+    values = _filter_values(filter_dict)
+    if seek:
+        values += _seek_sql(sort_expr, descending, *seek)[1]
+    return _sql_cache.get(key, build), values
+
+
+def _next_after(last_row, count, limit, sort_field):
+    """Continuation token after a page of ``count`` rows, or None when there is no further page."""
+    if not limit or count < limit:
+        return None
+    return _encode_after(sort_field, last_row[3], last_row[0])
+
+
+def _count_sql(table_name, filter_dict):
+    def build():
+        return f"SELECT COUNT(*) FROM {table_name} WHERE {_match_filter(filter_dict)[0]}"
+    
+    key = ("count", table_name, _filter_shape(filter_dict))
+    return _sql_cache.get(key, build), _filter_values(filter_dict)
+
+
+def _prepare_doc(document):
+    doc = dict(document)
+    doc_id = doc.pop("id", None) or str(__import__("uuid").uuid4())
+    # Remove _id if present (MongoDB artifact)
+    doc.pop("_id", None)
+    doc["id"] = doc_id
+    return doc_id, json.dumps(doc, default=str)
+
+
+def _insert_sql(table_name, document):
+    doc_id, data = _prepare_doc(document)
+    return f"INSERT INTO {table_name} (id, data) VALUES (%s, %s)", [doc_id, data], doc_id
+
+
+def _insert_many_sql(table_name, documents):
+    """One multi-row INSERT for a batch of documents: (query, values, inserted_ids)."""
+    rows = [_prepare_doc(doc) for doc in documents]
+    query = f"INSERT INTO {table_name} (id, data) VALUES " + ", ".join(["(%s, %s::jsonb)"] * len(rows))
+    return query, [v for row in rows for v in row], [doc_id for doc_id, _ in rows]
+
+
+def _delete_sql(table_name, filter_dict, many=False):
+    where_clause, values = _match_filter(filter_dict)
+    if many:
+        return f"DELETE FROM {table_name} WHERE {where_clause}", values
+    return (
+        f"DELETE FROM {table_name} WHERE _row_id IN (SELECT _row_id FROM {table_name} WHERE {where_clause} LIMIT 1)",
+        values,
+    )
+
+
+# Numeric update operators: SQL over the current value (NULL when the field is missing)
+_NUMERIC_UPDATE_OPS = {
+    "$inc": "COALESCE({cur}, 0) + {val}",
+    "$mul": "COALESCE({cur}, 0) * {val}",
+    "$min": "LEAST({cur}, {val})",  # LEAST/GREATEST ignore NULL, so a missing field takes the value
+    "$max": "GREATEST({cur}, {val})",
+}
+
+
+def _update_statement(table_name, filter_dict, update_dict, many=False):
+    """Compile a Mongo-style update into ``UPDATE ... RETURNING 1`` (no read-modify-write).
+
+    ``$set`` fields are merged with ``data || patch``; ``$inc``/``$mul``/``$min``/
+    ``$max`` become ``jsonb_set`` arithmetic on the row's current value, so
+    concurrent increments of the same counter serialize on the row lock
+    instead of overwriting each other. Without ``many`` only the first
+    matching row is updated, and it is locked with ``FOR UPDATE``.
+    """
+    if not any(k.startswith("$") for k in update_dict):
+        update_dict = {"$set": update_dict}
+    unsupported = set(update_dict) - {"$set"} - set(_NUMERIC_UPDATE_OPS)
+    if unsupported:
+        raise ValueError(f"Unsupported update operator(s): {', '.join(sorted(unsupported))}")
+    
+    set_data = update_dict.get("$set", {})
+    expr = "data"
+    values = []
+    if set_data:
+        expr = "data || %s::jsonb"
+        values.append(json.dumps(set_data, default=str))
+    for op, template in _NUMERIC_UPDATE_OPS.items():
+        for key, val in update_dict.get(op, {}).items():
+            new_value = template.format(cur=f"(data->>'{key}')::numeric", val="%s::numeric")
+            expr = f"jsonb_set({expr}, %s::text[], to_jsonb({new_value}))"
+            values += [[key], val]
+    
+    where_clause, where_values = _match_filter(filter_dict)
+    assignments = [f"data = {expr}"]
+    if "id" in set_data:
+        assignments.append("id = %s")
+        values.append(str(set_data["id"]))
+    if many:
+        target = where_clause
+    else:
+        target = f"_row_id IN (SELECT _row_id FROM {table_name} WHERE {where_clause} LIMIT 1 FOR UPDATE)"
+    return f"UPDATE {table_name} SET {', '.join(assignments)} WHERE {target} RETURNING 1", values + where_values
+
+
+def _upsert_statement(table_name, filter_dict, update_dict, matched_cte):
+    """INSERT for an upsert that only runs when the ``matched_cte`` update touched nothing."""
+    if not any(k.startswith("$") for k in update_dict):
+        update_dict = {"$set": update_dict}
+    doc = _upsert_doc(filter_dict, {
+        **{k: 0 for k in update_dict.get("$mul", {})},
+        **update_dict.get("$inc", {}),
+        **update_dict.get("$min", {}),
+        **update_dict.get("$max", {}),
+        **update_dict.get("$set", {}),
+    })
+    return (
+        f"INSERT INTO {table_name} (id, data) SELECT %s, %s::jsonb"
+        f" WHERE NOT EXISTS (SELECT 1 FROM {matched_cte}) RETURNING id",
+        [doc["id"], json.dumps(doc, default=str)],
+    )
+
+
+def _update_sql(table_name, filter_dict, update_dict, many=False, upsert=False):
+    """Single-statement update; with ``upsert`` the insert rides in the same statement.
+
+    The statement returns ``(matched_count, upserted_id)``.
+    """
+    update, values = _update_statement(table_name, filter_dict, update_dict, many)
+    query = f"WITH upd AS ({update})"
+    if upsert:
+        insert, insert_values = _upsert_statement(table_name, filter_dict, update_dict, "upd")
+        query += f", ins AS ({insert}) SELECT (SELECT COUNT(*) FROM upd), (SELECT id FROM ins)"
+        values += insert_values
+    else:
+        query += " SELECT COUNT(*), NULL FROM upd"
+    return query, values
+
+
+def _update_result(row):
+    matched, upserted_id = row
+    if upserted_id is not None:
+        return _result("UpdateResult", matched_count=0, modified_count=0, upserted_id=upserted_id)
+    return _result("UpdateResult", matched_count=matched, modified_count=matched, upserted_id=None)
+
+
+def _upsert_doc(filter_dict, set_data):
+    """Build the document inserted by an upsert: $set fields plus the filter's equality fields."""
+    doc = dict(set_data)
+    for k, v in filter_dict.items():
+        if not isinstance(v, dict):
+            doc[k] = v
+    doc["id"] = doc.get("id") or str(__import__("uuid").uuid4())
+    return doc
+
+
+class InsertOne:
+    """bulk_write operation: insert ``document``."""
+    
+    def __init__(self, document):
+        self.document = document
+
+
+class UpdateOne:
+    """bulk_write operation: update the first document matching ``filter``."""
+    
+    def __init__(self, filter, update, upsert=False):
+        self.filter = filter
+        self.update = update
+        self.upsert = upsert
+
+
+class UpdateMany:
+    """bulk_write operation: update every document matching ``filter``."""
+    
+    def __init__(self, filter, update):
+        self.filter = filter
+        self.update = update
+
+
+class DeleteOne:
+    """bulk_write operation: delete the first document matching ``filter``."""
+    
+    def __init__(self, filter):
+        self.filter = filter
+
+
+class DeleteMany:
+    """bulk_write operation: delete every document matching ``filter``."""
+    
+    def __init__(self, filter):
+        self.filter = filter
+
+
+def _bulk_write_sql(table_name, operations):
+    """Compile bulk_write operations into one statement of data-modifying CTEs.
+
+    Each operation becomes ``opN AS (... RETURNING ...)`` and the final SELECT
+    returns one row per operation: ``(kind, count, upserted_id)``. All CTEs
+    run against the same snapshot, so an operation does not see rows
+    inserted or changed by another operation of the same call; do not
+    target the same document twice in one bulk_write.
+    """
+    ctes, selects, values = [], [], []
+    for i, op in enumerate(operations):
+        name = f"op{i}"
+        if isinstance(op, InsertOne):
+            doc_id, data = _prepare_doc(op.document)
+            ctes.append(f"{name} AS (INSERT INTO {table_name} (id, data) VALUES (%s, %s::jsonb) RETURNING 1)")
+            values += [doc_id, data]
+            selects.append(f"SELECT {i}, 'insert', (SELECT COUNT(*) FROM {name}), NULL")
+        elif isinstance(op, (UpdateOne, UpdateMany)):
+            update, update_values = _update_statement(table_name, op.filter, op.update,
+                                                      many=isinstance(op, UpdateMany))
+            ctes.append(f"{name} AS ({update})")
+            values += update_values
+            upserted = "NULL"
+            if getattr(op, "upsert", False):
+                insert, insert_values = _upsert_statement(table_name, op.filter, op.update, name)
+                ctes.append(f"{name}_ins AS ({insert})")
+                values += insert_values
+                upserted = f"(SELECT id FROM {name}_ins)"
+            selects.append(f"SELECT {i}, 'update', (SELECT COUNT(*) FROM {name}), {upserted}")
+        elif isinstance(op, (DeleteOne, DeleteMany)):
+            delete, delete_values = _delete_sql(table_name, op.filter, many=isinstance(op, DeleteMany))
+            ctes.append(f"{name} AS ({delete} RETURNING 1)")
+            values += delete_values
+            selects.append(f"SELECT {i}, 'delete', (SELECT COUNT(*) FROM {name}), NULL")
+        else:
+            raise TypeError(f"Unsupported bulk_write operation: {op!r}")
+    query = "WITH " + ", ".join(ctes) + " " + " UNION ALL ".join(selects) + " ORDER BY 1"
+    return query, values
+
+
+def _bulk_write_result(rows):
+    counts = {"insert": 0, "update": 0, "delete": 0}
+    upserted_ids = {}
+    for index, kind, count, upserted_id in rows:
+        if upserted_id is not None:
+            upserted_ids[index] = upserted_id
+        else:
+            counts[kind] += count
+    return _result(
+        "BulkWriteResult",
+        inserted_count=counts["insert"],
+        matched_count=counts["update"],
+        modified_count=counts["update"],
+        deleted_count=counts["delete"],
+        upserted_count=len(upserted_ids),
+        upserted_ids=upserted_ids,
+    )
+
+
+# ========================
+# Aggregation pipeline (compiled to one SQL statement)
+# ========================
+
+def _field_ref(ref):
+    """Field name from a ``"$field"`` pipeline reference."""
+    if not isinstance(ref, str) or not ref.startswith("$"):
+        raise ValueError(f"Expected a '$field' reference, got {ref!r}")
+    return ref[1:]
+
+
+def _json_field_sql(key):
+    """jsonb-typed counterpart of _field_sql (keeps numbers numeric for sorting and grouping)."""
+    if "." in key:
+        return f"data#>'{{{','.join(key.split('.'))}}}'"
+    return f"data->'{key}'"
+
+
+def _accumulator_sql(spec):
+    """SQL aggregate for one $group accumulator (``{"$sum": "$total"}``, ``{"$sum": 1}``, ...)."""
+    (op, arg), = spec.items()
+    if op == "$sum" and isinstance(arg, (int, float)) and not isinstance(arg, bool):
+        return f"COUNT(*) * {arg!r}"
+    if op == "$first":
+        return f"(array_agg({_json_field_sql(_field_ref(arg))}))[1]"
+    numeric = f"({_field_sql(_field_ref(arg))})::numeric"
+    if op == "$sum":
+        return f"COALESCE(SUM({numeric}), 0)"
+    if op in ("$avg", "$min", "$max"):
+        return f"{op[1:].upper()}({numeric})"
+    raise ValueError(f"Unsupported $group accumulator: {op}")
+
+
+def _group_stage(source, spec):
+    key = spec.get("_id")
+    if key is None:
+        key_sql = "'null'::jsonb"
+    elif isinstance(key, dict):
+        key_sql = "jsonb_build_object(" + ", ".join(
+            f"'{name}', {_json_field_sql(_field_ref(ref))}" for name, ref in key.items()) + ")"
+    else:
+        key_sql = _json_field_sql(_field_ref(key))
+    fields = [f"'_id', {key_sql}"] + [
+        f"'{name}', {_accumulator_sql(acc)}" for name, acc in spec.items() if name != "_id"
+    ]
+    return (f"SELECT ({key_sql}) #>> '{{}}' AS id, jsonb_build_object({', '.join(fields)}) AS data "
+            f"FROM ({source}) s GROUP BY {key_sql}")
+
+
+def _project_stage(source, spec):
+    excluded = [k for k, v in spec.items() if v in (0, False)]
+    if excluded:
+        if len(excluded) != len(spec):
+            raise ValueError("$project cannot mix inclusion and exclusion")
+        return f"SELECT id, data - '{{{','.join(excluded)}}}'::text[] AS data FROM ({source}) s"
+    # Like find() projections, id is kept on inclusion
+    pairs = ", ".join(
+        f"'{name}', {_json_field_sql(_field_ref(v) if isinstance(v, str) else name)}"
+        for name, v in {"id": 1, **spec}.items()
+    )
+    return f"SELECT id, jsonb_build_object({pairs}) AS data FROM ({source}) s"
+
+
+def _lookup_sql(outer, spec):
+    """``jsonb_build_object(as, [matching foreign docs])`` correlated on ``outer``'s localField.
+
+    The foreign rows come back in insertion order, with their id, through the
+    foreign table's index on foreignField.
+    """
+    return (
+        f"jsonb_build_object('{spec['as']}', COALESCE(("
+        f"SELECT jsonb_agg(f.data || jsonb_build_object('id', f.id) ORDER BY f._row_id) FROM {spec['from']} f "
+        f"WHERE f.{_field_sql(spec['foreignField'])} = {outer}.{_field_sql(spec['localField'])}), '[]'::jsonb))"
+    )
+
+
+def _lookup_stage(source, spec):
+    return f"SELECT s.id, s.data || {_lookup_sql('s', spec)} AS data FROM ({source}) s"
+
+
+def _unwind_stage(source, spec):
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    field = _field_ref(spec["path"])
+    if spec.get("preserveNullAndEmptyArrays"):
+        return (
+            f"SELECT s.id, CASE WHEN e.value IS NULL THEN s.data - '{field}' "
+            f"ELSE s.data || jsonb_build_object('{field}', e.value) END AS data FROM ({source}) s "
+            f"LEFT JOIN LATERAL jsonb_array_elements(CASE WHEN jsonb_typeof(s.data->'{field}') = 'array' "
+            f"THEN s.data->'{field}' ELSE '[]'::jsonb END) e ON TRUE"
+        )
+    return (
+        f"SELECT s.id, s.data || jsonb_build_object('{field}', e.value) AS data FROM ({source}) s "
+        f"CROSS JOIN LATERAL jsonb_array_elements(CASE WHEN jsonb_typeof(s.data->'{field}') = 'array' "
+        f"THEN s.data->'{field}' ELSE '[]'::jsonb END) e"
+    )
+
+
+def _aggregate_sql(table_name, pipeline):
+    """Compile a Mongo-style aggregation pipeline into one SELECT returning ``data`` rows.
+
+    Each stage wraps the previous one as a subquery of ``(id, data)`` rows:
+    $match (same filters as find), $group (accumulators $sum/$avg/$min/$max
+    over numeric casts, $first), $sort (on jsonb values, so numbers sort
+    numerically), $skip, $limit, $project, $lookup (a correlated subquery,
+    served by the foreign table's index) and $unwind. Leading $match stages
+    become the WHERE of the base SELECT on the table's own ``data`` column,
+    so the same expression indexes as find() serve them; the id column is
+    only merged into ``data`` in that SELECT's output.
+    """
+    stages = list(pipeline)
+    where, values = [], []
+    while stages and "$match" in stages[0]:
+        where_clause, where_values = _match_filter(stages.pop(0)["$match"])
+        where.append(where_clause)
+        values += where_values
+    query = f"SELECT id, data || jsonb_build_object('id', id) AS data FROM {table_name}"
+    if where:
+        query += f" WHERE {' AND '.join(where)}"
+    for stage in stages:
+        (op, spec), = stage.items()
+        if op == "$match":
+            where_clause, where_values = _match_filter(spec)
+            query = f"SELECT id, data FROM ({query}) s WHERE {where_clause}"
+            values += where_values
+        elif op == "$group":
+            query = _group_stage(query, spec)
+        elif op == "$sort":
+            order = ", ".join(f"{_json_field_sql(k)} {'ASC' if d == 1 else 'DESC'}" for k, d in spec.items())
+            query = f"SELECT id, data FROM ({query}) s ORDER BY {order}"
+        elif op == "$limit":
+            query = f"SELECT id, data FROM ({query}) s LIMIT {int(spec)}"
+        elif op == "$skip":
+            query = f"SELECT id, data FROM ({query}) s OFFSET {int(spec)}"
+        elif op == "$project":
+            query = _project_stage(query, spec)
+        elif op == "$lookup":
+            query = _lookup_stage(query, spec)
+        elif op == "$unwind":
+            query = _unwind_stage(query, spec)
+        else:
+            raise ValueError(f"Unsupported aggregation stage: {op}")
+    return f"SELECT data FROM ({query}) s", values
+
+
+def _aggregate_docs(rows):
+    return [row[0] if isinstance(row[0], dict) else json.loads(row[0]) for row in rows]
+
+
+def _result(name, **fields):
+    return type(name, (), fields)()
+
+
 class PgCollection:
     """A PostgreSQL-backed collection that mimics PyMongo's Collection interface."""
     
-    def __init__(self, table_name):
+    def __init__(self, table_name, connection=get_connection):
         self.table_name = table_name
+        # Context manager yielding the connection to run on (a transaction binds its own)
+        self._connection = connection
     
     def _row_to_doc(self, row):
         """Convert a DB row to a document dict (like MongoDB doc without _id)."""
-        if row is None:
-            return None
-        data = row[2] if isinstance(row[2], dict) else json.loads(row[2])
-        data["id"] = row[1]
-        return data
+        return _row_to_doc(row)
     
     def find_one(self, filter_dict=None, projection=None):
-        filter_dict = filter_dict or {}
-        where_clause, values = _match_filter(filter_dict)
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"SELECT _row_id, id, data FROM {self.table_name} WHERE {where_clause} LIMIT 1",
-            values
-        )
-        row = cur.fetchone()
-        cur.close()
-        return self._row_to_doc(row)
+        query, values = _select_sql(self.table_name, filter_dict or {}, limit=1, projection=projection)
+        
+        def read(conn):
+            cur = conn.cursor()
+            _execute_prepared(cur, query, values)
+            row = cur.fetchone()
+            cur.close()
+            return row
+        
+        return self._row_to_doc(_run_read(read, self._connection))
     
     def find(self, filter_dict=None, projection=None):
         filter_dict = filter_dict or {}
-        return PgCursor(self.table_name, filter_dict)
+        return PgCursor(self.table_name, filter_dict, projection, connection=self._connection)
     
-    def insert_one(self, document):
-        doc = dict(document)
-        doc_id = doc.pop("id", None) or str(__import__("uuid").uuid4())
-        # Remove _id if present (MongoDB artifact)
-        doc.pop("_id", None)
-        doc["id"] = doc_id
-        
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"INSERT INTO {self.table_name} (id, data) VALUES (%s, %s)",
-            (doc_id, json.dumps(doc, default=str))
-        )
-        cur.close()
-        return type("InsertResult", (), {"inserted_id": doc_id})()
+    def find_by_ids(self, ids, projection=None):
+        """Fetch many documents by id in one ``id = ANY(...)`` query: {id: doc}, unknown ids left out.
+
+        Resolves foreign keys for a whole page at once instead of one
+        find_one per row.
+        """
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+        if not ids:
+            return {}
+        return {doc["id"]: doc for doc in self.find({"id": {"$in": ids}}, projection).to_list()}
     
-    def update_one(self, filter_dict, update_dict, upsert=False):
-        where_clause, values = _match_filter(filter_dict)
-        
-        if "$set" in update_dict:
-            set_data = update_dict["$set"]
-        elif "$inc" in update_dict:
-            # Handle $inc operator
-            conn = get_connection()
+    def insert_one(self, document):
+        query, values, doc_id = _insert_sql(self.table_name, document)
+        with self._connection() as conn:
             cur = conn.cursor()
-            cur.execute(
-                f"SELECT _row_id, id, data FROM {self.table_name} WHERE {where_clause} LIMIT 1",
-                values
-            )
-            row = cur.fetchone()
-            if row:
-                data = row[2] if isinstance(row[2], dict) else json.loads(row[2])
-                for key, inc_val in update_dict["$inc"].items():
-                    current = data.get(key, 0)
-                    if isinstance(current, (int, float)):
-                        data[key] = current + inc_val
-                    else:
-                        try:
-                            data[key] = float(current) + inc_val
-                        except (ValueError, TypeError):
-                            data[key] = inc_val
-                cur.execute(
-                    f"UPDATE {self.table_name} SET data = %s WHERE _row_id = %s",
-                    (json.dumps(data, default=str), row[0])
-                )
+            cur.execute(query, values)
             cur.close()
-            return type("UpdateResult", (), {"modified_count": 1 if row else 0})()
-        else:
-            set_data = update_dict
-        
-        # Build JSONB merge for $set
-        conn = get_connection()
-        cur = conn.cursor()
-        # First get the current document
-        cur.execute(
-            f"SELECT _row_id, id, data FROM {self.table_name} WHERE {where_clause} LIMIT 1",
-            values
-        )
-        row = cur.fetchone()
-        if row:
-            data = row[2] if isinstance(row[2], dict) else json.loads(row[2])
-            data.update(set_data)
-            new_id = data.get("id", row[1])
-            cur.execute(
-                f"UPDATE {self.table_name} SET data = %s, id = %s WHERE _row_id = %s",
-                (json.dumps(data, default=str), new_id, row[0])
-            )
+        return _result("InsertResult", inserted_id=doc_id)
+    
+    def insert_many(self, documents):
+        """Insert a batch in one round-trip (COPY above BULK_COPY_THRESHOLD documents)."""
+        documents = list(documents)
+        if not documents:
+            return _result("InsertManyResult", inserted_ids=[])
+        with self._connection() as conn:
+            cur = conn.cursor()
+            if len(documents) >= BULK_COPY_THRESHOLD:
+                rows = [_prepare_doc(doc) for doc in documents]
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                buffer.seek(0)
+                cur.copy_expert(f"COPY {self.table_name} (id, data) FROM STDIN WITH (FORMAT csv)", buffer)
+                inserted_ids = [doc_id for doc_id, _ in rows]
+            else:
+                query, values, inserted_ids = _insert_many_sql(self.table_name, documents)
+                cur.execute(query, values)
             cur.close()
-            return type("UpdateResult", (), {"modified_count": 1})()
-        elif upsert:
-            # Insert new document
-            doc = dict(set_data)
-            # Merge filter fields into the document
-            for k, v in filter_dict.items():
-                if not isinstance(v, dict):
-                    doc[k] = v
-            doc_id = doc.get("id") or str(__import__("uuid").uuid4())
-            doc["id"] = doc_id
-            cur.execute(
-                f"INSERT INTO {self.table_name} (id, data) VALUES (%s, %s)",
-                (doc_id, json.dumps(doc, default=str))
-            )
+        return _result("InsertManyResult", inserted_ids=inserted_ids)
+    
+    def bulk_write(self, operations):
+        """Run mixed InsertOne/UpdateOne/UpdateMany/DeleteOne/DeleteMany operations in one statement."""
+        operations = list(operations)
+        if not operations:
+            return _bulk_write_result([])
+        query, values = _bulk_write_sql(self.table_name, operations)
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, values)
+            rows = cur.fetchall()
             cur.close()
-            return type("UpdateResult", (), {"modified_count": 0, "upserted_id": doc_id})()
-        cur.close()
-        return type("UpdateResult", (), {"modified_count": 0})()
+        return _bulk_write_result(rows)
+    
+    def update_one(self, filter_dict, update_dict, upsert=False):
+        return self._update(filter_dict, update_dict, many=False, upsert=upsert)
     
     def update_many(self, filter_dict, update_dict):
-        where_clause, values = _match_filter(filter_dict)
-        set_data = update_dict.get("$set", update_dict)
-        
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"SELECT _row_id, id, data FROM {self.table_name} WHERE {where_clause}",
-            values
-        )
-        rows = cur.fetchall()
-        count = 0
-        for row in rows:
-            data = row[2] if isinstance(row[2], dict) else json.loads(row[2])
-            data.update(set_data)
-            cur.execute(
-                f"UPDATE {self.table_name} SET data = %s WHERE _row_id = %s",
-                (json.dumps(data, default=str), row[0])
-            )
-            count += 1
-        cur.close()
-        return type("UpdateResult", (), {"modified_count": count})()
+        return self._update(filter_dict, update_dict, many=True)
     
-    def create_index(self, field, **kwargs):
-        """No-op: indexes are created in init_tables."""
-        pass
+    def _update(self, filter_dict, update_dict, many, upsert=False):
+        query, values = _update_sql(self.table_name, filter_dict, update_dict, many=many, upsert=upsert)
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, values)
+            row = cur.fetchone()
+            cur.close()
+        return _update_result(row)
+    
+    def create_index(self, keys, unique=False, **kwargs):
+        """Build an expression btree index on the given JSONB field(s)."""
+        fields = _index_fields(keys)
+        name, query = _index_sql(self.table_name, fields, unique)
+        try:
+            with self._connection() as conn:
+                cur = conn.cursor()
+                cur.execute(query)
+                cur.close()
+        except psycopg2.Error as e:
+            # e.g. a unique index over data that already holds duplicates
+            logger.warning(f"Could not create index on {self.table_name}({', '.join(fields)}): {e}")
+            return None
+        return name
     
     def delete_one(self, filter_dict):
-        where_clause, values = _match_filter(filter_dict)
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            f"DELETE FROM {self.table_name} WHERE _row_id IN (SELECT _row_id FROM {self.table_name} WHERE {where_clause} LIMIT 1)",
-            values
-        )
-        deleted = cur.rowcount
-        cur.close()
-        return type("DeleteResult", (), {"deleted_count": deleted})()
+        return self._delete(filter_dict, many=False)
     
     def delete_many(self, filter_dict):
-        where_clause, values = _match_filter(filter_dict)
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"DELETE FROM {self.table_name} WHERE {where_clause}", values)
-        deleted = cur.rowcount
-        cur.close()
-        return type("DeleteResult", (), {"deleted_count": deleted})()
+        return self._delete(filter_dict, many=True)
+    
+    def _delete(self, filter_dict, many):
+        query, values = _delete_sql(self.table_name, filter_dict, many)
+        with self._connection() as conn:
+            cur = conn.cursor()
+            cur.execute(query, values)
+            deleted = cur.rowcount
+            cur.close()
+        return _result("DeleteResult", deleted_count=deleted)
     
     def count_documents(self, filter_dict=None):
-        filter_dict = filter_dict or {}
-        where_clause, values = _match_filter(filter_dict)
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(f"SELECT COUNT(*) FROM {self.table_name} WHERE {where_clause}", values)
-        count = cur.fetchone()[0]
-        cur.close()
-        return count
+        query, values = _count_sql(self.table_name, filter_dict or {})
+        
+        def read(conn):
+            cur = conn.cursor()
+            _execute_prepared(cur, query, values)
+            count = cur.fetchone()[0]
+            cur.close()
+            return count
+        
+        return _run_read(read, self._connection)
+
+
+    def aggregate(self, pipeline):
+        """Run an aggregation pipeline server-side (see _aggregate_sql) and return the documents."""
+        query, values = _aggregate_sql(self.table_name, pipeline)
+        
+        def read(conn):
+            cur = conn.cursor()
+            cur.execute(query, values)
+            rows = cur.fetchall()
+            cur.close()
+            return rows
+        
+        return _aggregate_docs(_run_read(read, self._connection))
 
 
 class PgCursor:
-    """A cursor that mimics PyMongo's Cursor with sort/limit support."""
+    """A cursor that mimics PyMongo's Cursor with sort/limit support.
+    
+    ``to_list()`` and results that fit in one batch are fetched in a single
+    query. Iterating reads the first ``batch_size`` rows the same way and only
+    when that batch comes back full streams the rest through a named
+    server-side cursor, ``batch_size`` rows per round-trip, so large scans run
+    in constant memory without taxing small ones.
+    """
     
-    def __init__(self, table_name, filter_dict=None):
+    def __init__(self, table_name, filter_dict=None, projection=None, connection=get_connection):
         self.table_name = table_name
         self.filter_dict = filter_dict or {}
+        self.projection = projection
+        self._connection = connection
         self._sort_field = None
         self._sort_direction = 1
         self._limit_val = None
+        self._skip_val = None
+        self._after = None
+        self._lookups = []
+        self._batch_size = CURSOR_BATCH_SIZE
+        # Token for the next page once a limited query has run (None on the last page)
+        self.next_after = None
     
     def sort(self, field, direction=1):
         self._sort_field = field
@@ -321,39 +1606,147 @@ class PgCursor:
         self._limit_val = n
         return self
     
-    def _execute(self):
-        where_clause, values = _match_filter(self.filter_dict)
-        
-        query = f"SELECT _row_id, id, data FROM {self.table_name} WHERE {where_clause}"
-        
-        if self._sort_field:
-            direction = "ASC" if self._sort_direction == 1 else "DESC"
-            if self._sort_field == "id":
-                query += f" ORDER BY id {direction}"
-            else:
-                query += f" ORDER BY data->>'{self._sort_field}' {direction}"
-        
-        if self._limit_val:
-            query += f" LIMIT {self._limit_val}"
+    def skip(self, n):
+        self._skip_val = n
+        return self
+    
+    def after(self, token):
+        """Resume after the row a previous page's ``next_after`` token points at (keyset pagination)."""
+        if token:
+            _decode_after(token, self._sort_field)
+        self._after = token
+        return self
+    
+    def lookup(self, spec):
+        """Embed related rows in each document, like a $lookup stage (same query, no N+1)::
+
+            sales.find(q).lookup({"from": "sale_items", "localField": "id",
+                                  "foreignField": "sale_id", "as": "items"})
+        """
+        self._lookups.append(spec)
+        return self
+    
+    def batch_size(self, n):
+        self._batch_size = max(1, int(n))
+        return self
+    
+    def _sql(self, **page):
+        """SELECT for this cursor; ``page`` overrides its limit/skip/after."""
+        page = {"limit": self._limit_val, "skip": self._skip_val, "after": self._after, **page}
+        return _select_sql(self.table_name, self.filter_dict, self._sort_field,
+                           self._sort_direction, page["limit"], self.projection,
+                           page["skip"], page["after"], self._lookups)
+    
+    def _fetch(self, **page):
+        query, values = self._sql(**page)
         
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(query, values)
-        rows = cur.fetchall()
-        cur.close()
+        def read(conn):
+            cur = conn.cursor()
+            _execute_prepared(cur, query, values)
+            rows = cur.fetchall()
+            cur.close()
+            return rows
         
-        results = []
+        return _run_read(read, self._connection)
+    
+    def _execute(self):
+        rows = self._fetch()
+        self.next_after = _next_after(rows[-1] if rows else None, len(rows), self._limit_val, self._sort_field)
+        return [_row_to_doc(row) for row in rows]
+    
+    def _iterate(self):
+        rows = self._fetch(limit=self._batch_size)
         for row in rows:
-            data = row[2] if isinstance(row[2], dict) else json.loads(row[2])
-            data["id"] = row[1]
-            results.append(data)
-        return results
+            yield _row_to_doc(row)
+        if len(rows) < self._batch_size:
+            self.next_after = None
+            return
+        # Full first batch: continue after its last row on a server-side cursor
+        remaining = self._limit_val - len(rows) if self._limit_val else None
+        last = rows[-1]
+        yield from self._stream(limit=remaining, skip=None, after=_encode_after(self._sort_field, last[3], last[0]))
     
-    def __iter__(self):
-        return iter(self._execute())
+    def _stream(self, **page):
+        limit = page.get("limit", self._limit_val)
+        query, values = self._sql(**page)
+        with self._connection() as conn:
+            # Named cursors only live inside a transaction; open a read-only one
+            # on pooled (autocommit) connections and end it when iteration stops.
+            own_transaction = conn.autocommit
+            if own_transaction:
+                conn.autocommit = False
+            cur = conn.cursor(name=f"pgcursor_{__import__('uuid').uuid4().hex}")
+            try:
+                cur.itersize = self._batch_size
+                cur.execute(query, values)
+                count, last = 0, None
+                for row in cur:
+                    count, last = count + 1, row
+                    yield _row_to_doc(row)
+                self.next_after = _next_after(last, count, limit, self._sort_field)
+            finally:
+                if not cur.closed and not conn.closed:
+                    cur.close()
+                if own_transaction and not conn.closed:
+                    conn.rollback()
+                    conn.autocommit = True
     
-    def __list__(self):
+    def to_list(self, length=None):
+        """Fetch all matching documents (at most ``length`` when given)."""
+        if length:
+            self._limit_val = min(self._limit_val or length, length)
         return self._execute()
+    
+    def __iter__(self):
+        if self._limit_val and self._limit_val <= self._batch_size:
+            return iter(self._execute())
+        return self._iterate()
+
+
+# ========================
+# Transactions
+# ========================
+
+class PgTransaction:
+    """Collections bound to one connection inside a ``transaction()`` block.
+
+    ``tx["sales"]`` returns a PgCollection whose reads and writes all run on
+    the transaction's connection, so they commit (or roll back) together.
+    """
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    @contextmanager
+    def _connection(self):
+        yield self.conn
+    
+    def __getitem__(self, name):
+        return PgCollection(name, connection=self._connection)
+
+
+@contextmanager
+def transaction():
+    """Run several collection calls as one atomic commit::
+
+        with transaction() as tx:
+            tx["sales"].insert_one(sale)
+            tx["accounts"].update_one({"id": account_id}, {"$inc": {"balance": total}})
+
+    Commits when the block exits normally, rolls back if it raises.
+    """
+    with get_pool().connection() as conn:
+        conn.autocommit = False
+        try:
+            yield PgTransaction(conn)
+            conn.commit()
+        except BaseException:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if not conn.closed:
+                conn.autocommit = True
 
 
 # ========================
@@ -363,7 +1756,6 @@ class PgCursor:
 def init_pg_database():
     """Initialize PostgreSQL connection and create tables."""
     try:
-        conn = get_connection()
         init_tables()
         logger.info(f"Connected to PostgreSQL database")
         return True
@@ -0,0 +1,260 @@
+"""
+Stock allocation for StartupManager Pro
+Decrements a sale's quantities across each product's batches in FIFO or
+FEFO order with one locking SQL statement, so concurrent sales of the same
+product can neither lose updates nor oversell a batch.
+
+Per-product totals (products.data.stock_quantity) are maintained by a
+trigger on batches (see database_postgres.STOCK_TRIGGER); check or repair
+them with:
+
+    python inventory.py check
+    python inventory.py rebuild
+"""
+import os
+import sys
+import logging
+import argparse
+from decimal import Decimal
+from database_postgres import _pg_params, _run_read, transaction, init_tables
+from database_async import _run_read as _run_read_async
+
+logger = logging.getLogger(__name__)
+
+# "fefo" (first expired, first out - batches without expiry_date go last) or "fifo" (by created_at)
+STOCK_ALLOCATION = os.environ.get("STOCK_ALLOCATION", "fefo").lower()
+
+_ALLOCATION_ORDER = {
+    "fifo": "received ASC NULLS LAST, _row_id",
+    "fefo": "expires ASC NULLS LAST, received ASC NULLS LAST, _row_id",
+}
+
+
+def _allocation_sql(quantities, strategy=None):
+    """One statement that locks, allocates and decrements: (sql, values).
+
+    Candidate batches are locked with FOR UPDATE in ``_row_id`` order, so two
+    sales touching the same products lock in the same order and queue behind
+    each other instead of deadlocking. SKIP LOCKED is deliberately not used:
+    a batch held by a concurrent sale may still have stock for this one once
+    that sale commits. A running SUM in allocation order tells each batch how
+    much was already taken before its turn; the UPDATE takes
+    ``LEAST(stock, still wanted)`` from it.
+
+    Rows are (product_id, requested, allocated, [{"batch_id", "quantity"}, ...]).
+    """
+    strategy = strategy or STOCK_ALLOCATION
+    if strategy not in _ALLOCATION_ORDER:
+        raise ValueError(f"Unknown stock allocation strategy: {strategy}")
+    order = _ALLOCATION_ORDER[strategy]
+    product_ids = list(quantities)
+    query = f"""
+        WITH req (product_id, wanted) AS (
+            SELECT * FROM unnest(%s::text[], %s::numeric[])
+        ), locked AS (
+            SELECT _row_id, id, data->>'product_id' AS product_id, (data->>'quantity')::numeric AS qty,
+                   iso_ts(data->>'expiry_date') AS expires, iso_ts(data->>'created_at') AS received
+            FROM batches
+            WHERE data->>'product_id' = ANY(%s::text[]) AND (data->>'quantity')::numeric > 0
+            ORDER BY _row_id
+            FOR UPDATE
+        ), ranked AS (
+            SELECT l._row_id, l.id, l.product_id, l.qty, r.wanted,
+                   SUM(l.qty) OVER w - l.qty AS taken_before,
+                   ROW_NUMBER() OVER w AS seq
+            FROM locked l JOIN req r USING (product_id)
+            WINDOW w AS (PARTITION BY l.product_id ORDER BY {order})
+        ), alloc AS (
+            SELECT _row_id, id, product_id, seq, LEAST(qty, wanted - taken_before) AS take
+            FROM ranked
+            WHERE taken_before < wanted
+        ), upd AS (
+            UPDATE batches b
+            SET data = jsonb_set(b.data, '{{quantity}}', to_jsonb((b.data->>'quantity')::numeric - a.take))
+            FROM alloc a
+            WHERE b._row_id = a._row_id
+            RETURNING b._row_id
+        )
+        SELECT r.product_id, r.wanted, COALESCE(SUM(a.take), 0),
+               COALESCE(jsonb_agg(jsonb_build_object('batch_id', a.id, 'quantity', a.take) ORDER BY a.seq)
+                        FILTER (WHERE a.id IS NOT NULL), '[]'::jsonb)
+        FROM req r LEFT JOIN alloc a USING (product_id)
+        GROUP BY r.product_id, r.wanted
+    """
+    wanted = [Decimal(str(quantities[product_id])) for product_id in product_ids]
+    return query, [product_ids, wanted, product_ids]
+
+
+def _allocation_result(rows):
+    """{product_id: {"requested", "allocated", "shortfall", "batches"}} from the allocation rows."""
+    result = {}
+    for product_id, requested, allocated, batches in rows:
+        requested, allocated = int(requested), int(allocated)
+        result[product_id] = {
+            "requested": requested,
+            "allocated": allocated,
+            "shortfall": requested - allocated,
+            "batches": [{"batch_id": b["batch_id"], "quantity": int(b["quantity"])} for b in batches],
+        }
+    return result
+
+
+def _merge_quantities(quantities):
+    """Accept {product_id: qty} or (product_id, qty) pairs; repeated products are summed."""
+    items = quantities.items() if isinstance(quantities, dict) else quantities
+    merged = {}
+    for product_id, quantity in items:
+        merged[product_id] = merged.get(product_id, 0) + quantity
+    return merged
+
+
+def allocate_stock(tx, quantities, strategy=None):
+    """Take ``quantities`` out of stock inside ``transaction()``; returns the per-product allocation.
+
+    Whatever is available is always taken: check ``shortfall`` and raise
+    inside the ``with`` block to roll the whole operation back.
+    """
+    quantities = _merge_quantities(quantities)
+    if not quantities:
+        return {}
+    query, values = _allocation_sql(quantities, strategy)
+    cur = tx.conn.cursor()
+    cur.execute(query, values)
+    rows = cur.fetchall()
+    cur.close()
+    return _allocation_result(rows)
+
+
+async def allocate_stock_async(tx, quantities, strategy=None):
+    """Awaitable allocate_stock for an ``async_transaction()`` block."""
+    quantities = _merge_quantities(quantities)
+    if not quantities:
+        return {}
+    query, values = _allocation_sql(quantities, strategy)
+    rows = await tx.conn.fetch(_pg_params(query), *values)
+    return _allocation_result(rows)
+
+
+def shortfall_message(allocation, names=None):
+    """French error detail listing the products that could not be fully served, or None."""
+    missing = [
+        f"{(names or {}).get(product_id, product_id)} ({a['allocated']} disponible(s) sur {a['requested']})"
+        for product_id, a in allocation.items() if a["shortfall"] > 0
+    ]
+    return f"Stock insuffisant: {', '.join(missing)}" if missing else None
+
+
+# ========================
+# STOCK TOTALS (consistency check / rebuild)
+# ========================
+_STOCK_TOTALS_SQL = """
+    SELECT p.id, p.data->>'name', COALESCE((p.data->>'stock_quantity')::numeric, 0) AS stored,
+           COALESCE(SUM((b.data->>'quantity')::numeric), 0) AS actual
+    FROM products p LEFT JOIN batches b ON b.data->>'product_id' = p.id
+    GROUP BY p.id, p.data
+"""
+
+
+# Served by the batches product_id index (see INDEX_MANIFEST)
+_STOCK_BY_PRODUCTS_SQL = """
+    SELECT data->>'product_id', SUM((data->>'quantity')::numeric)
+    FROM batches
+    WHERE data->>'product_id' = ANY(%s::text[])
+    GROUP BY 1
+"""
+
+
+def _stock_map(product_ids, rows):
+    stock = {product_id: 0 for product_id in product_ids}
+    stock.update({product_id: int(total or 0) for product_id, total in rows})
+    return stock
+
+
+def stock_by_products(product_ids, tx=None):
+    """{product_id: SUM(batch quantity)} for all ``product_ids`` in one GROUP BY query (0 when no batch).
+
+    Reads the batches themselves; product listings use the trigger-maintained
+    ``stock_quantity`` instead. Pass ``tx`` to read inside a ``transaction()``.
+    """
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+
+    def read(conn):
+        cur = conn.cursor()
+        cur.execute(_STOCK_BY_PRODUCTS_SQL, [product_ids])
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    return _stock_map(product_ids, read(tx.conn) if tx else _run_read(read))
+
+
+async def stock_by_products_async(product_ids, tx=None):
+    """Awaitable stock_by_products (``tx`` from ``async_transaction()``)."""
+    product_ids = list(dict.fromkeys(product_ids))
+    if not product_ids:
+        return {}
+
+    async def read(conn):
+        return await conn.fetch(_pg_params(_STOCK_BY_PRODUCTS_SQL), product_ids)
+
+    return _stock_map(product_ids, await (read(tx.conn) if tx else _run_read_async(read)))
+
+
+def check_stock_totals():
+    """Products whose stored stock_quantity differs from the sum of their batches (two queries)."""
+    with transaction() as tx:
+        # Both reads see the same snapshot, so sales running meanwhile cannot show up as drift
+        cur = tx.conn.cursor()
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.close()
+        products = tx["products"].find({}, {"name": 1, "stock_quantity": 1}).to_list()
+        actual = stock_by_products((p["id"] for p in products), tx)
+    mismatches = []
+    for p in products:
+        stored = int(p.get("stock_quantity") or 0)
+        if stored != actual[p["id"]]:
+            mismatches.append({"product_id": p["id"], "name": p.get("name"), "stored": stored, "actual": actual[p["id"]]})
+    return mismatches
+
+
+def rebuild_stock_totals():
+    """Recompute every product's stock_quantity from its batches; returns how many were corrected."""
+    with transaction() as tx:
+        cur = tx.conn.cursor()
+        # Hold batch writes (sales, restocks) off while the sums are taken and written back
+        cur.execute("LOCK TABLE batches IN SHARE MODE")
+        cur.execute(f"""
+            UPDATE products p
+            SET data = jsonb_set(p.data, '{{stock_quantity}}', to_jsonb(t.actual))
+            FROM ({_STOCK_TOTALS_SQL}) t
+            WHERE p.id = t.id AND (t.stored <> t.actual OR NOT p.data ? 'stock_quantity')
+        """)
+        corrected = cur.rowcount
+        cur.close()
+    return corrected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or rebuild the per-product stock totals")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    init_tables()
+
+    if args.command == "rebuild":
+        print(f"✅ {rebuild_stock_totals()} product total(s) corrected")
+        return 0
+    mismatches = check_stock_totals()
+    for m in mismatches:
+        print(f"  {m['product_id']} {m['name']}: stored {m['stored']}, batches {m['actual']}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} product(s) out of sync - run: python inventory.py rebuild")
+        return 1
+    print("✅ Stock totals consistent")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
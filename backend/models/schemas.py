@@ -142,6 +142,7 @@ class ShopCreate(BaseModel):
     logo_url: Optional[str] = None
     orange_money_number: Optional[str] = None
     bank_account: Optional[str] = None
+    timezone: Optional[str] = None  # IANA zone for reports (e.g. "Africa/Conakry"); default REPORT_TIMEZONE
 
 class ShopUpdate(BaseModel):
     name: Optional[str] = None
@@ -151,6 +152,7 @@ class ShopUpdate(BaseModel):
     is_active: Optional[bool] = None
     orange_money_number: Optional[str] = None
     bank_account: Optional[str] = None
+    timezone: Optional[str] = None
 
 class ShopResponse(BaseModel):
     id: str
@@ -160,6 +162,7 @@ class ShopResponse(BaseModel):
     logo_url: Optional[str] = None
     orange_money_number: Optional[str] = None
     bank_account: Optional[str] = None
+    timezone: Optional[str] = None
     is_active: bool = True
     owner_id: Optional[str] = None
     tenant_id: Optional[str] = None
@@ -215,6 +218,7 @@ class BatchCreate(BaseModel):
     size: str = ""
     color: str = ""
     quantity: int = 0
+    expiry_date: Optional[str] = None  # ISO date; sales draw from the earliest-expiring batch first
 
 class BatchResponse(BaseModel):
     id: str
@@ -224,6 +228,7 @@ class BatchResponse(BaseModel):
     size: str = ""
     color: str = ""
     quantity: int = 0
+    expiry_date: Optional[str] = None
     qr_code: Optional[str] = None
     created_at: str = ""
 
@@ -231,6 +236,7 @@ class BatchUpdate(BaseModel):
     quantity: Optional[int] = None
     size: Optional[str] = None
     color: Optional[str] = None
+    expiry_date: Optional[str] = None
 
 
 # ========================
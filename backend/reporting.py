@@ -0,0 +1,511 @@
+"""
+Sales reporting for StartupManager Pro
+Dashboards and owner reports read the sales_daily rollup - one row per shop,
+local day, payment method and seller, kept current by triggers on sales and
+returns (see database_postgres.SALES_ROLLUP_TRIGGER) - so their cost depends
+on the number of days reported, not on the number of sales. Check or repair
+the rollup with:
+
+    python reporting.py check
+    python reporting.py rebuild
+
+Bucketed reports over arbitrary date ranges and time zones (sales_report)
+and downsampled chart series (sales_timeseries) are computed by one grouped
+query each; only the per-bucket totals reach Python.
+"""
+import sys
+import json
+import base64
+import logging
+import argparse
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from database_postgres import (
+    _match_filter, _field_sql, _pg_params, _run_read, transaction, init_tables, REPORT_TIMEZONE
+)
+from database_async import _run_read as _run_read_async
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_METRICS = ("sales_count", "revenue", "profit", "returns_count", "returns_amount")
+_COUNT_METRICS = ("sales_count", "returns_count")
+
+
+def local_day(period="today", now=None):
+    """First day (YYYY-MM-DD in REPORT_TIMEZONE) of the "today" or "month" period."""
+    day = (now or datetime.now(timezone.utc)).astimezone(ZoneInfo(REPORT_TIMEZONE)).date()
+    return (day.replace(day=1) if period == "month" else day).isoformat()
+
+
+def _summary_sql(match, since, by):
+    """One GROUP BY over sales_daily, filtered on the raw columns so the (shop_id, day) and
+    (user_id, day) indexes serve it; ``since`` compares as text, like the indexed day strings."""
+    match = dict(match or {})
+    if since:
+        match["day"] = {"$gte": since}
+    where_clause, values = _match_filter(match)
+    sums = ", ".join(f"COALESCE(SUM((data->>'{metric}')::numeric), 0)" for metric in ROLLUP_METRICS)
+    key = _field_sql(by) if by else "NULL"
+    return f"SELECT {key}, {sums} FROM sales_daily WHERE {where_clause} GROUP BY 1", values
+
+
+def _summary(rows):
+    return {
+        row[0]: {m: int(v) if m in _COUNT_METRICS else float(v) for m, v in zip(ROLLUP_METRICS, row[1:])}
+        for row in rows
+    }
+
+
+def combine(totals):
+    """Sum several totals dicts (from sales_summary) into one; all zeros when there are none."""
+    combined = dict.fromkeys(ROLLUP_METRICS, 0)
+    for t in totals:
+        for metric in ROLLUP_METRICS:
+            combined[metric] += t[metric]
+    return combined
+
+
+def sales_summary(match=None, since=None, by=None):
+    """Rollup totals from local day ``since`` (inclusive) for rows matching ``match``.
+
+    ``match`` filters on shop_id, user_id or payment_method. Returns
+    {value of ``by``: {"sales_count", "revenue", "profit", "returns_count",
+    "returns_amount"}}, with a single ``None`` key when ``by`` is not given
+    (empty when nothing matched). ``by`` may also be "day".
+    """
+    return _summary(_fetch(*_summary_sql(match, since, by)))
+
+
+async def sales_summary_async(match=None, since=None, by=None):
+    """Awaitable sales_summary."""
+    return _summary(await _fetch_async(*_summary_sql(match, since, by)))
+
+
+# ========================
+# BUCKETED REPORTS (custom ranges, any time zone)
+# ========================
+REPORT_BUCKETS = ("hour", "day", "week", "month")
+# Longest series one report may return (e.g. ~7 months of hourly buckets)
+MAX_REPORT_BUCKETS = 5000
+
+# Time series steps, finest first: a series uses the finest one (from the requested
+# interval up) that fits its point budget, so long ranges are downsampled server-side
+SERIES_INTERVALS = {
+    "15m": timedelta(minutes=15),
+    "1h": timedelta(hours=1),
+    "3h": timedelta(hours=3),
+    "6h": timedelta(hours=6),
+    "12h": timedelta(hours=12),
+    "1d": timedelta(days=1),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+    "90d": timedelta(days=90),
+    "365d": timedelta(days=365),
+}
+# Metric -> column of the bucketed rows
+SERIES_METRICS = {"count": 1, "revenue": 2, "profit": 3}
+DEFAULT_SERIES_POINTS = 200
+MAX_SERIES_POINTS = 1000
+
+
+def _local_range(date_from, date_to, tz):
+    """(date_from, date_to, tz) with defaults filled in (current month so far in REPORT_TIMEZONE)."""
+    tz = tz or REPORT_TIMEZONE
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Fuseau horaire inconnu: {tz}")
+    today = datetime.now(zone).date()
+    date_to = date_to or today
+    date_from = date_from or min(today.replace(day=1), date_to)
+    if date_from > date_to:
+        raise ValueError("La date de début doit précéder la date de fin")
+    return date_from, date_to, tz
+
+
+def report_period(date_from=None, date_to=None, tz=None, bucket="day"):
+    """Validate and complete a report request: {"from", "to", "timezone", "bucket"}.
+
+    ``date_from``/``date_to`` are local calendar days in ``tz`` (both included),
+    defaulting to the current month so far; ``tz`` defaults to REPORT_TIMEZONE.
+    Raises ValueError with a user-facing (French) message when invalid.
+    """
+    if bucket not in REPORT_BUCKETS:
+        raise ValueError(f"Regroupement invalide: {bucket} (attendu: {', '.join(REPORT_BUCKETS)})")
+    date_from, date_to, tz = _local_range(date_from, date_to, tz)
+    days = (date_to - date_from).days + 1
+    approx_buckets = {"hour": days * 24, "day": days, "week": days / 7, "month": days / 28}[bucket]
+    if approx_buckets > MAX_REPORT_BUCKETS:
+        raise ValueError("Plage trop longue pour ce regroupement, choisissez un regroupement plus large")
+    return {"from": date_from, "to": date_to, "timezone": tz, "bucket": bucket}
+
+
+def _bucketed_sql(match, period, bucket_sql, series_sql, whole_days):
+    """(sql, values) returning one (bucket_start, sales_count, revenue, profit) row per bucket, gaps included.
+
+    ``bucket_sql`` maps the local timestamp ``{ts}`` to its bucket start and
+    ``series_sql`` generates every bucket start between the two ``%s`` bounds
+    (local start and end of the range). Whole-day buckets in the rollup's own
+    time zone are summed from sales_daily; anything finer, or another zone,
+    groups the sales in the range, found through the created_at timestamp
+    index. Buckets are computed on local wall-clock time, so they follow the
+    requested zone.
+    """
+    first = datetime.combine(period["from"], time.min)
+    last = datetime.combine(period["to"], time.max)
+    if whole_days and period["timezone"] == REPORT_TIMEZONE:
+        where_clause, where_values = _match_filter(
+            {**match, "day": {"$gte": period["from"].isoformat(), "$lte": period["to"].isoformat()}})
+        totals = f"""
+            SELECT {bucket_sql.replace("{ts}", "(data->>'day')::timestamp")} AS bucket,
+                   SUM((data->>'sales_count')::numeric) AS sales_count,
+                   SUM((data->>'revenue')::numeric) AS revenue, SUM((data->>'profit')::numeric) AS profit
+            FROM sales_daily WHERE {where_clause} GROUP BY 1
+        """
+        totals_values = where_values
+    else:
+        zone = ZoneInfo(period["timezone"])
+        where_clause, where_values = _match_filter({**match, "created_at": {
+            "$gte": first.replace(tzinfo=zone),
+            "$lt": datetime.combine(period["to"] + timedelta(days=1), time.min, tzinfo=zone),
+        }})
+        totals = f"""
+            SELECT {bucket_sql.replace("{ts}", "(iso_ts(data->>'created_at') AT TIME ZONE %s)")} AS bucket,
+                   COUNT(*) AS sales_count,
+                   SUM((data->>'total')::numeric) AS revenue, SUM((data->>'profit')::numeric) AS profit
+            FROM sales WHERE {where_clause} GROUP BY 1
+        """
+        totals_values = [period["timezone"]] + where_values
+    query = f"""
+        WITH totals AS ({totals})
+        SELECT b, COALESCE(t.sales_count, 0), COALESCE(t.revenue, 0), COALESCE(t.profit, 0)
+        FROM {series_sql} b
+        LEFT JOIN totals t ON t.bucket = b
+        ORDER BY b
+    """
+    return query, totals_values + [first, last]
+
+
+def _report_sql(match, period):
+    bucket = period["bucket"]
+    return _bucketed_sql(
+        match, period,
+        f"date_trunc('{bucket}', {{ts}})",
+        f"generate_series(date_trunc('{bucket}', %s::timestamp), %s::timestamp, interval '1 {bucket}')",
+        whole_days=bucket != "hour",
+    )
+
+
+def _fetch(query, values):
+    def read(conn):
+        cur = conn.cursor()
+        cur.execute(query, values)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    return _run_read(read)
+
+
+async def _fetch_async(query, values):
+    async def read(conn):
+        return await conn.fetch(_pg_params(query), *values)
+
+    return await _run_read_async(read)
+
+
+def _report(period, rows):
+    series = [
+        {"start": start.isoformat(), "sales_count": int(count), "revenue": float(revenue), "profit": float(profit)}
+        for start, count, revenue, profit in rows
+    ]
+    totals = {metric: sum(b[metric] for b in series) for metric in ("sales_count", "revenue", "profit")}
+    return {
+        "from": period["from"].isoformat(),
+        "to": period["to"].isoformat(),
+        "timezone": period["timezone"],
+        "bucket": period["bucket"],
+        "totals": totals,
+        "series": series,
+    }
+
+
+def sales_report(match, period):
+    """Sales count, revenue and profit per bucket of ``period`` (from report_period) for sales matching ``match``.
+
+    ``series`` lists every bucket of the range in order, empty ones at zero;
+    ``start`` is the bucket's local start time in the report's time zone.
+    """
+    return _report(period, _fetch(*_report_sql(match, period)))
+
+
+async def sales_report_async(match, period):
+    """Awaitable sales_report."""
+    return _report(period, await _fetch_async(*_report_sql(match, period)))
+
+
+# ========================
+# TIME SERIES (downsampled for charts)
+# ========================
+def series_period(date_from=None, date_to=None, tz=None, metrics=("revenue",), interval=None,
+                  max_points=DEFAULT_SERIES_POINTS):
+    """Validate and complete a time series request, choosing the step.
+
+    The step is the requested ``interval`` (default: the finest one), widened
+    along SERIES_INTERVALS until the range fits in ``max_points`` points.
+    Raises ValueError with a user-facing (French) message when invalid.
+    """
+    metrics = list(dict.fromkeys(metrics))
+    unknown = [m for m in metrics if m not in SERIES_METRICS]
+    if unknown or not metrics:
+        raise ValueError(f"Métrique invalide: {', '.join(unknown)} (attendu: {', '.join(SERIES_METRICS)})")
+    names = list(SERIES_INTERVALS)
+    if interval and interval not in SERIES_INTERVALS:
+        raise ValueError(f"Intervalle invalide: {interval} (attendu: {', '.join(names)})")
+    if not 1 <= max_points <= MAX_SERIES_POINTS:
+        raise ValueError(f"Le nombre de points doit être compris entre 1 et {MAX_SERIES_POINTS}")
+    date_from, date_to, tz = _local_range(date_from, date_to, tz)
+    span = timedelta(days=(date_to - date_from).days + 1)
+    candidates = names[names.index(interval):] if interval else names
+    # The coarsest step is used even if it still exceeds max_points (decades of data)
+    chosen = next((name for name in candidates if span / SERIES_INTERVALS[name] <= max_points), candidates[-1])
+    return {"from": date_from, "to": date_to, "timezone": tz, "metrics": metrics,
+            "interval": chosen, "requested_interval": interval, "max_points": max_points}
+
+
+def _series_sql(match, period):
+    step = SERIES_INTERVALS[period["interval"]]
+    seconds = int(step.total_seconds())
+    origin = datetime.combine(period["from"], time.min)
+    # date_bin buckets from the start of the range, so any fixed step lines up with it
+    return _bucketed_sql(
+        match, period,
+        f"date_bin(interval '{seconds} seconds', {{ts}}, TIMESTAMP '{origin:%Y-%m-%d %H:%M:%S}')",
+        f"generate_series(%s::timestamp, %s::timestamp, interval '{seconds} seconds')",
+        whole_days=step % timedelta(days=1) == timedelta(0),
+    )
+
+
+def _series(period, rows):
+    return {
+        "from": period["from"].isoformat(),
+        "to": period["to"].isoformat(),
+        "timezone": period["timezone"],
+        "interval": period["interval"],
+        "downsampled": period["interval"] != (period["requested_interval"] or next(iter(SERIES_INTERVALS))),
+        # [[local bucket start, value], ...] per metric: compact enough for multi-year charts
+        "series": {
+            metric: [
+                [row[0].isoformat(), int(row[1]) if metric == "count" else float(row[SERIES_METRICS[metric]])]
+                for row in rows
+            ]
+            for metric in period["metrics"]
+        },
+    }
+
+
+def sales_timeseries(match, period):
+    """Downsampled series (at most about ``max_points`` points) of the metrics in ``period`` (from series_period)."""
+    return _series(period, _fetch(*_series_sql(match, period)))
+
+
+async def sales_timeseries_async(match, period):
+    """Awaitable sales_timeseries."""
+    return _series(period, await _fetch_async(*_series_sql(match, period)))
+
+
+# ========================
+# BREAKDOWNS (per product, per seller)
+# ========================
+SALES_BY_PRODUCT_SORTS = ("revenue", "quantity", "profit")
+
+
+def created_at_range(date_from=None, date_to=None, tz=None):
+    """created_at filter for local days ``date_from``..``date_to`` (both included) in ``tz``; {} when unbounded."""
+    tz = tz or REPORT_TIMEZONE
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Fuseau horaire inconnu: {tz}")
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("La date de début doit précéder la date de fin")
+    created_at = {}
+    if date_from:
+        created_at["$gte"] = datetime.combine(date_from, time.min, tzinfo=zone)
+    if date_to:
+        created_at["$lt"] = datetime.combine(date_to + timedelta(days=1), time.min, tzinfo=zone)
+    return created_at
+
+
+def _sales_by_product_sql(match, sort, limit):
+    """Items of the sales matching ``match``, grouped per product: one join on the sale_items sale_id index."""
+    if sort not in SALES_BY_PRODUCT_SORTS:
+        raise ValueError(f"Tri invalide: {sort} (attendu: {', '.join(SALES_BY_PRODUCT_SORTS)})")
+    where_clause, values = _match_filter(match)
+    query = f"""
+        SELECT i.data->>'product_id', MAX(i.data->>'product_name'),
+               SUM((i.data->>'quantity')::numeric) AS quantity,
+               SUM(COALESCE((i.data->>'total')::numeric,
+                            (i.data->>'quantity')::numeric * (i.data->>'price')::numeric)) AS revenue,
+               SUM(COALESCE((i.data->>'profit')::numeric, 0)) AS profit
+        FROM (SELECT id FROM sales WHERE {where_clause}) s
+        JOIN sale_items i ON i.data->>'sale_id' = s.id
+        GROUP BY 1
+        ORDER BY {sort} DESC, 1
+    """
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return query, values
+
+
+def _by_product(rows):
+    return [
+        {"product_id": product_id, "name": name or "", "quantity_sold": int(quantity),
+         "revenue": float(revenue), "profit": float(profit)}
+        for product_id, name, quantity, revenue, profit in rows
+    ]
+
+
+def sales_by_product(match, sort="revenue", limit=None):
+    """Quantity sold, revenue (item totals) and profit per product over the sales matching ``match``.
+
+    Sorted by ``sort`` (revenue, quantity or profit) descending, the first
+    ``limit`` products only when given. Raises ValueError for an unknown sort.
+    """
+    return _by_product(_fetch(*_sales_by_product_sql(match, sort, limit)))
+
+
+async def sales_by_product_async(match, sort="revenue", limit=None):
+    """Awaitable sales_by_product."""
+    return _by_product(await _fetch_async(*_sales_by_product_sql(match, sort, limit)))
+
+
+def _encode_seller_after(total, user_id):
+    raw = json.dumps(["seller", str(total), user_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_seller_after(token):
+    try:
+        kind, total, user_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        float(total)
+    except Exception:
+        raise ValueError("Invalid pagination token")
+    if kind != "seller":
+        raise ValueError("Invalid pagination token")
+    return total, user_id
+
+
+def _sales_by_seller_sql(match, limit, after):
+    """Sales matching ``match`` grouped per seller, then one lookup per group on users.id for the name.
+
+    Ordered by total descending (user_id breaks ties) so pages continue with
+    a keyset condition on (total, user_id) rather than an OFFSET.
+    """
+    where_clause, values = _match_filter(match)
+    query = f"""
+        SELECT g.user_id, COALESCE(NULLIF(g.seller_name, ''), u.name, 'Inconnu'), g.count, g.total, g.profit
+        FROM (
+            SELECT COALESCE(data->>'user_id', '') AS user_id, MAX(data->>'seller_name') AS seller_name,
+                   COUNT(*) AS count, COALESCE(SUM((data->>'total')::numeric), 0) AS total,
+                   COALESCE(SUM((data->>'profit')::numeric), 0) AS profit
+            FROM sales WHERE {where_clause}
+            GROUP BY 1
+        ) g
+        LEFT JOIN LATERAL (SELECT data->>'name' AS name FROM users WHERE id = g.user_id LIMIT 1) u ON TRUE
+    """
+    if after:
+        total, user_id = _decode_seller_after(after)
+        query += " WHERE (g.total, g.user_id) < (%s::numeric, %s)"
+        values = values + [total, user_id]
+    query += " ORDER BY g.total DESC, g.user_id DESC"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return query, values
+
+
+def _by_seller(rows, limit):
+    sellers = [
+        {"user_id": user_id, "name": name, "count": int(count), "total": float(total), "profit": float(profit)}
+        for user_id, name, count, total, profit in rows
+    ]
+    last = rows[-1] if limit and len(rows) == limit else None
+    return sellers, _encode_seller_after(last[3], last[0]) if last else None
+
+
+def sales_by_seller(match, limit=None, after=None):
+    """Sales count, total and profit per seller over the sales matching ``match``, best sellers first.
+
+    Returns (sellers, next_after): ``next_after`` continues after a full page
+    of ``limit`` sellers (None on the last page). Raises ValueError for a
+    malformed ``after`` token.
+    """
+    query, values = _sales_by_seller_sql(match, limit, after)
+    return _by_seller(_fetch(query, values), limit)
+
+
+async def sales_by_seller_async(match, limit=None, after=None):
+    """Awaitable sales_by_seller."""
+    query, values = _sales_by_seller_sql(match, limit, after)
+    return _by_seller(await _fetch_async(query, values), limit)
+
+
+# ========================
+# ROLLUP CONSISTENCY (check / rebuild)
+# ========================
+_ROLLUP_DIFF_SQL = """
+    SELECT COALESCE(d.id, r.key), d.data, r.totals
+    FROM sales_daily d FULL JOIN sales_daily_rows() r ON r.key = d.id
+    WHERE d.data IS DISTINCT FROM r.totals
+      -- rows whose sales were all deleted are left at zero by the trigger
+      AND NOT (r.key IS NULL AND (SELECT bool_and((d.data->>m)::numeric = 0) FROM unnest(%s::text[]) m))
+"""
+
+
+def check_sales_rollup():
+    """sales_daily rows that differ from a recomputation over sales and returns."""
+    with transaction() as tx:
+        cur = tx.conn.cursor()
+        # The rollup and its recomputation are read from the same snapshot
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        cur.execute(_ROLLUP_DIFF_SQL, [list(ROLLUP_METRICS)])
+        rows = cur.fetchall()
+        cur.close()
+    return [{"key": key, "stored": stored, "actual": actual} for key, stored, actual in rows]
+
+
+def rebuild_sales_rollup():
+    """Recompute sales_daily from every sale and return; returns the number of rows written."""
+    with transaction() as tx:
+        cur = tx.conn.cursor()
+        # Hold sales and returns off while the rollup is replaced
+        cur.execute("LOCK TABLE sales, returns IN SHARE MODE")
+        cur.execute("DELETE FROM sales_daily")
+        cur.execute("INSERT INTO sales_daily (id, data) SELECT key, totals FROM sales_daily_rows()")
+        written = cur.rowcount
+        cur.close()
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or rebuild the sales_daily rollup")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    init_tables()
+
+    if args.command == "rebuild":
+        print(f"✅ sales_daily rebuilt: {rebuild_sales_rollup()} row(s) ({REPORT_TIMEZONE} days)")
+        return 0
+    mismatches = check_sales_rollup()
+    for m in mismatches:
+        print(f"  {m['key']}: stored {m['stored']}, actual {m['actual']}")
+    if mismatches:
+        print(f"❌ {len(mismatches)} rollup row(s) out of sync - run: python reporting.py rebuild")
+        return 1
+    print("✅ sales_daily consistent")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends, Query
 from fastapi.responses import StreamingResponse, HTMLResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
@@ -8,7 +8,7 @@ import logging
 from pathlib import Path
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import qrcode
 from io import BytesIO
 import base64
@@ -17,7 +17,10 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.units import cm
 import asyncio
 import resend
-from database import get_database, get_collection, init_indexes
+from database import (
+    get_database, get_collection, init_indexes, get_database_stats, close_connection,
+    init_async_database, close_async_connection, transaction, async_transaction
+)
 from security import (
     SUPER_ADMIN_EMAIL, ROLE_PERMISSIONS, get_role_permissions, check_permission,
     is_super_admin, add_to_whitelist, remove_from_whitelist, is_whitelisted,
@@ -43,6 +46,12 @@ from models.schemas import (
     ProductReturnCreate, ProductReturnResponse,
     StockRequestCreate, StockRequestResponse
 )
+from inventory import allocate_stock, allocate_stock_async, shortfall_message
+from reporting import (
+    local_day, combine, sales_summary, sales_summary_async, report_period, sales_report, sales_report_async,
+    series_period, sales_timeseries_async, DEFAULT_SERIES_POINTS, created_at_range, sales_by_product_async,
+    sales_by_seller_async
+)
 from utils import (
     pwd_context, ADMIN_EMAIL, otp_storage, generate_otp, store_otp, verify_otp,
     users_col, shops_col, products_col, batches_col, sales_col, sale_items_col,
@@ -51,7 +60,10 @@ from utils import (
     returns_col, subscription_plans_col, stock_requests_col, activity_log_col,
     serialize_doc, serialize_docs, create_access_token, verify_token,
     get_current_user, get_shop_filter, is_admin_role, generate_ai_content,
-    security, EMERGENT_API_KEY, log_activity
+    security, EMERGENT_API_KEY, log_activity, log_activity_async, activity_entry,
+    async_users_col, async_shops_col, async_products_col, async_batches_col,
+    async_sales_col, async_sale_items_col, async_employees_col, async_accounts_col,
+    pagination, paginate, set_next_page, date_range, shop_timezone
 )
 
 ROOT_DIR = Path(__file__).parent
@@ -93,12 +105,11 @@ def init_demo_data():
     
     # Init default subscription plans
     if subscription_plans_col().count_documents({}) == 0:
-        for plan in [
+        subscription_plans_col().insert_many([
             {"id": str(uuid.uuid4()), "name": "Gratuit", "price": 0, "duration_days": 0, "features": ["5 produits", "1 employé", "Ventes de base"], "max_products": 5, "max_employees": 1, "is_active": True},
             {"id": str(uuid.uuid4()), "name": "Professionnel", "price": 50000, "duration_days": 30, "features": ["100 produits", "10 employés", "Rapports avancés", "Support prioritaire"], "max_products": 100, "max_employees": 10, "is_active": True},
             {"id": str(uuid.uuid4()), "name": "Premium", "price": 150000, "duration_days": 30, "features": ["Produits illimités", "Employés illimités", "IA intégrée", "Support 24/7", "Multi-boutiques"], "max_products": 9999, "max_employees": 9999, "is_active": True},
-        ]:
-            subscription_plans_col().insert_one(plan)
+        ])
         logging.info("Default subscription plans created")
     
     # Check if demo data already exists
@@ -133,14 +144,12 @@ def init_demo_data():
     })
     
     # Create demo accounts for the shop
-    for acc_type in ["cash", "orange_money", "bank"]:
-        acc_id = str(uuid.uuid4())
-        accounts_col().insert_one({
-            "id": acc_id,
-            "shop_id": demo_shop_id,
-            "type": acc_type,
-            "balance": 500000 if acc_type == "cash" else (750000 if acc_type == "orange_money" else 2500000)
-        })
+    accounts_col().insert_many([{
+        "id": str(uuid.uuid4()),
+        "shop_id": demo_shop_id,
+        "type": acc_type,
+        "balance": 500000 if acc_type == "cash" else (750000 if acc_type == "orange_money" else 2500000)
+    } for acc_type in ["cash", "orange_money", "bank"]])
     
     # Create demo products
     products_data = [
@@ -154,9 +163,10 @@ def init_demo_data():
         ("Montre Classic", "Accessoires", 55000),
     ]
     
+    products, batches = [], []
     for name, category, price in products_data:
         prod_id = str(uuid.uuid4())
-        products_col().insert_one({
+        products.append({
             "id": prod_id,
             "shop_id": demo_shop_id,
             "name": name,
@@ -164,13 +174,13 @@ def init_demo_data():
             "price": price,
             "description": f"Description de {name}",
             "image_url": None,
+            "stock_quantity": 0,  # raised by the batches trigger
             "created_at": datetime.now(timezone.utc).isoformat()
         })
         
         # Create demo batch for each product
-        batch_id = str(uuid.uuid4())
-        batches_col().insert_one({
-            "id": batch_id,
+        batches.append({
+            "id": str(uuid.uuid4()),
             "product_id": prod_id,
             "lot_number": f"LOT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}",
             "size": "M",
@@ -179,6 +189,8 @@ def init_demo_data():
             "qr_code": None,
             "created_at": datetime.now(timezone.utc).isoformat()
         })
+    products_col().insert_many(products)
+    batches_col().insert_many(batches)
     
     # Create demo employees
     employees_data = [
@@ -188,16 +200,14 @@ def init_demo_data():
         ("Ibrahima Sow", "Vendeur", 180000, "Stage"),
     ]
     
-    for name, position, salary, contract_type in employees_data:
-        emp_id = str(uuid.uuid4())
-        employees_col().insert_one({
-            "id": emp_id,
-            "shop_id": demo_shop_id,
-            "name": name,
-            "position": position,
-            "salary": salary,
-            "contract_type": contract_type
-        })
+    employees_col().insert_many([{
+        "id": str(uuid.uuid4()),
+        "shop_id": demo_shop_id,
+        "name": name,
+        "position": position,
+        "salary": salary,
+        "contract_type": contract_type
+    } for name, position, salary, contract_type in employees_data])
     
     # Auto-authorize the demo admin account
     authorized_users_col().insert_one({
@@ -514,19 +524,20 @@ async def check_access(email: str):
     return {"authorized": False}
 
 @api_router.get("/access/requests")
-async def get_access_requests():
+async def get_access_requests(response: Response, page: dict = Depends(pagination)):
     """Get all access requests (Admin only)"""
-    requests = list(access_requests_col().find())
+    cursor = paginate(access_requests_col().find(), page)
+    requests = cursor.to_list()
+    set_next_page(response, cursor)
     return serialize_docs(requests)
 
 @api_router.get("/access/authorized")
 async def get_authorized_users():
     """Get all authorized users (Admin only)"""
     # Clean expired temporary accesses
-    now = datetime.now(timezone.utc).isoformat()
     authorized_users_col().delete_many({
         "access_type": "temporary",
-        "expires_at": {"$lt": now}
+        "expires_at": {"$lt": datetime.now(timezone.utc)}
     })
     
     users = list(authorized_users_col().find())
@@ -1039,43 +1050,44 @@ async def verify_registration(data: OTPVerify):
     shop_id = str(uuid.uuid4())
     hashed_password = pwd_context.hash(reg_data["password"])
     
-    # Create the user with tenant_id and shop_id
-    users_col().insert_one({
-        "id": user_id,
-        "name": reg_data["owner_name"],
-        "email": reg_data["email"],
-        "password": hashed_password,
-        "role": "owner",
-        "company_name": reg_data["company_name"],
-        "phone": reg_data.get("phone"),
-        "tenant_id": tenant_id,
-        "shop_id": shop_id,
-        "is_verified": True,
-        "subscription_plan": "trial",
-        "trial_ends_at": (datetime.now(timezone.utc) + timedelta(days=14)).isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    # Create a default shop for the new owner
-    shops_col().insert_one({
-        "id": shop_id,
-        "name": reg_data["company_name"],
-        "address": "",
-        "phone": reg_data.get("phone", ""),
-        "owner_id": user_id,
-        "tenant_id": tenant_id,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
-    
-    # Create default financial accounts for the shop
-    for acc_type in ["cash", "orange_money", "bank"]:
-        accounts_col().insert_one({
+    # User, shop and accounts are created in one commit
+    with transaction() as tx:
+        # Create the user with tenant_id and shop_id
+        tx["users"].insert_one({
+            "id": user_id,
+            "name": reg_data["owner_name"],
+            "email": reg_data["email"],
+            "password": hashed_password,
+            "role": "owner",
+            "company_name": reg_data["company_name"],
+            "phone": reg_data.get("phone"),
+            "tenant_id": tenant_id,
+            "shop_id": shop_id,
+            "is_verified": True,
+            "subscription_plan": "trial",
+            "trial_ends_at": (datetime.now(timezone.utc) + timedelta(days=14)).isoformat(),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        
+        # Create a default shop for the new owner
+        tx["shops"].insert_one({
+            "id": shop_id,
+            "name": reg_data["company_name"],
+            "address": "",
+            "phone": reg_data.get("phone", ""),
+            "owner_id": user_id,
+            "tenant_id": tenant_id,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        
+        # Create default financial accounts for the shop
+        tx["accounts"].insert_many([{
             "id": str(uuid.uuid4()),
             "shop_id": shop_id,
             "tenant_id": tenant_id,
             "type": acc_type,
             "balance": 0
-        })
+        } for acc_type in ["cash", "orange_money", "bank"]])
     
     token = create_access_token({"user_id": user_id, "role": "owner"})
     
@@ -1227,13 +1239,12 @@ async def create_shop(shop: ShopCreate, current_user: dict = Depends(get_current
     shops_col().insert_one(shop_data)
     
     # Create accounts for the new shop
-    for acc_type in ["cash", "orange_money", "bank"]:
-        accounts_col().insert_one({
-            "id": str(uuid.uuid4()),
-            "shop_id": shop_id,
-            "type": acc_type,
-            "balance": 0
-        })
+    accounts_col().insert_many([{
+        "id": str(uuid.uuid4()),
+        "shop_id": shop_id,
+        "type": acc_type,
+        "balance": 0
+    } for acc_type in ["cash", "orange_money", "bank"]])
     
     return ShopResponse(**shop_data)
 
@@ -1249,18 +1260,21 @@ async def get_shop(shop_id: str):
 # ========================
 
 @api_router.get("/products", response_model=List[ProductResponse])
-async def get_products(shop_id: Optional[str] = None, category: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_products(response: Response, shop_id: Optional[str] = None, category: Optional[str] = None,
+                       page: dict = Depends(pagination), current_user: dict = Depends(get_current_user)):
     query = get_shop_filter(current_user)
     if shop_id:
         query["shop_id"] = shop_id
     if category:
         query["category"] = category
     
-    products = list(products_col().find(query))
+    cursor = paginate(async_products_col().find(query), page)
+    products = await cursor.to_list()
+    set_next_page(response, cursor)
     result = []
     for prod in products:
         prod = serialize_doc(prod)
-        stock = sum(int(serialize_doc(b).get("quantity", 0)) for b in batches_col().find({"product_id": prod["id"]}))
+        stock = int(prod.pop("stock_quantity", None) or 0)
         # Ensure buy_price/sell_price exist
         if "sell_price" not in prod:
             prod["sell_price"] = prod.get("price", 0)
@@ -1276,7 +1290,7 @@ async def create_product(product: ProductCreate, current_user: dict = Depends(ge
     prod_id = str(uuid.uuid4())
     user_shop_id = current_user.get("shop_id")
     if not user_shop_id:
-        shop = shops_col().find_one()
+        shop = await async_shops_col().find_one()
         user_shop_id = serialize_doc(shop)["id"] if shop else None
     
     prod_dict = product.model_dump()
@@ -1302,12 +1316,14 @@ async def create_product(product: ProductCreate, current_user: dict = Depends(ge
         "shop_id": user_shop_id,
         **prod_dict,
         "qr_code": qr_base64,
+        # Kept current by the batches trigger from the first batch on
+        "stock_quantity": 0,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    products_col().insert_one(prod_data)
+    await async_products_col().insert_one(prod_data)
     
     # Log activity
-    log_activity(
+    await log_activity_async(
         shop_id=user_shop_id or "",
         user_id=current_user["id"],
         user_name=current_user.get("name", ""),
@@ -1318,39 +1334,35 @@ async def create_product(product: ProductCreate, current_user: dict = Depends(ge
         target_id=prod_id
     )
     
-    return ProductResponse(**prod_data, stock_quantity=0)
+    return ProductResponse(**prod_data)
 
 @api_router.get("/products/{product_id}", response_model=ProductResponse)
 async def get_product(product_id: str):
-    product = products_col().find_one({"id": product_id})
+    product = await async_products_col().find_one({"id": product_id})
     if not product:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
     
-    product = serialize_doc(product)
-    stock = sum(b["quantity"] for b in batches_col().find({"product_id": product_id}))
-    return ProductResponse(**product, stock_quantity=stock)
+    return ProductResponse(**serialize_doc(product))
 
 @api_router.put("/products/{product_id}", response_model=ProductResponse)
 async def update_product(product_id: str, update: ProductUpdate):
-    product = products_col().find_one({"id": product_id})
+    product = await async_products_col().find_one({"id": product_id})
     if not product:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
     
     update_data = {k: v for k, v in update.model_dump().items() if v is not None}
     if update_data:
-        products_col().update_one({"id": product_id}, {"$set": update_data})
+        await async_products_col().update_one({"id": product_id}, {"$set": update_data})
     
-    updated = products_col().find_one({"id": product_id})
-    updated = serialize_doc(updated)
-    stock = sum(b["quantity"] for b in batches_col().find({"product_id": product_id}))
-    return ProductResponse(**updated, stock_quantity=stock)
+    updated = await async_products_col().find_one({"id": product_id})
+    return ProductResponse(**serialize_doc(updated))
 
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str):
-    result = products_col().delete_one({"id": product_id})
+    result = await async_products_col().delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
-    batches_col().delete_many({"product_id": product_id})
+    await async_batches_col().delete_many({"product_id": product_id})
     return {"message": "Produit supprimé"}
 
 # ========================
@@ -1364,17 +1376,16 @@ async def get_batches(product_id: Optional[str] = None, current_user: dict = Dep
     if product_id:
         query = {"product_id": product_id}
     elif shop_filter:
-        user_products = [serialize_doc(p)["id"] for p in products_col().find(shop_filter)]
+        user_products = [serialize_doc(p)["id"] for p in products_col().find(shop_filter, {"id": 1})]
         query = {"product_id": {"$in": user_products}} if user_products else {}
     else:
         query = {}
     
-    batches = list(batches_col().find(query))
+    batches = serialize_docs(batches_col().find(query))
+    products = products_col().find_by_ids((b["product_id"] for b in batches), {"name": 1})
     result = []
     for batch in batches:
-        batch = serialize_doc(batch)
-        product = products_col().find_one({"id": batch["product_id"]})
-        product_name = serialize_doc(product)["name"] if product else "Inconnu"
+        product_name = products.get(batch["product_id"], {}).get("name", "Inconnu")
         result.append(BatchResponse(**batch, product_name=product_name))
     return result
 
@@ -1394,6 +1405,7 @@ async def create_batch(batch: BatchCreate):
         "size": batch.size,
         "color": batch.color,
         "quantity": batch.quantity,
+        "expiry_date": batch.expiry_date,
         "qr_code": None,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
@@ -1456,26 +1468,27 @@ async def generate_qr_code(batch_id: str):
 # ========================
 
 @api_router.get("/sales", response_model=List[SaleResponse])
-async def get_sales(shop_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_sales(response: Response, shop_id: Optional[str] = None, created_at: dict = Depends(date_range),
+                    page: dict = Depends(pagination), current_user: dict = Depends(get_current_user)):
     query = get_shop_filter(current_user)
     if shop_id:
         query["shop_id"] = shop_id
+    if created_at:
+        query["created_at"] = created_at
     
-    sales = list(sales_col().find(query).sort("created_at", -1))
-    result = []
-    for sale in sales:
-        sale = serialize_doc(sale)
-        items = list(sale_items_col().find({"sale_id": sale["id"]}))
-        sale["items"] = serialize_docs(items)
-        result.append(SaleResponse(**sale))
-    return result
+    # One query per page: the sales and, through sale_items' sale_id index, their items
+    cursor = paginate(async_sales_col().find(query).sort("created_at", -1), page)
+    cursor.lookup({"from": "sale_items", "localField": "id", "foreignField": "sale_id", "as": "items"})
+    sales = await cursor.to_list()
+    set_next_page(response, cursor)
+    return [SaleResponse(**serialize_doc(sale)) for sale in sales]
 
 @api_router.post("/sales", response_model=SaleResponse)
 async def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current_user)):
     sale_id = str(uuid.uuid4())
     user_shop_id = current_user.get("shop_id")
     if not user_shop_id:
-        shop = shops_col().find_one()
+        shop = await async_shops_col().find_one()
         user_shop_id = serialize_doc(shop)["id"] if shop else None
     user_id = current_user["id"]
     seller_name = current_user.get("name", "")
@@ -1483,18 +1496,23 @@ async def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current
     total = 0
     total_profit = 0
     sale_items = []
+    product_names = {}
     
+    # The whole basket is resolved in one id = ANY(...) query
+    products = await async_products_col().find_by_ids(
+        (item.product_id for item in sale.items), {"name": 1, "buy_price": 1}
+    )
     for item in sale.items:
-        product = products_col().find_one({"id": item.product_id})
+        product = products.get(item.product_id)
         if not product:
             raise HTTPException(status_code=404, detail=f"Produit {item.product_id} non trouvé")
         
-        product = serialize_doc(product)
+        product_names[item.product_id] = product["name"]
         item_total = item.quantity * item.price
         total += item_total
         
         # Calculate profit
-        buy_price = float(product.get("buy_price", 0))
+        buy_price = float(product.get("buy_price") or 0)
         item_profit = (item.price - buy_price) * item.quantity
         total_profit += item_profit
         
@@ -1510,15 +1528,7 @@ async def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current
             "total": item_total,
             "profit": item_profit
         }
-        sale_items_col().insert_one(sale_item)
         sale_items.append(sale_item)
-        
-        # Update stock
-        batch = batches_col().find_one({"product_id": item.product_id})
-        if batch:
-            batch = serialize_doc(batch)
-            new_qty = max(0, int(batch.get("quantity", 0)) - item.quantity)
-            batches_col().update_one({"id": batch["id"]}, {"$set": {"quantity": new_qty}})
     
     sale_data = {
         "id": sale_id,
@@ -1531,27 +1541,37 @@ async def create_sale(sale: SaleCreate, current_user: dict = Depends(get_current
         "customer_phone": sale.customer_phone,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    sales_col().insert_one(sale_data)
-    
-    # Update account balance
     acc_type_map = {"cash": "cash", "orange_money": "orange_money", "card": "bank"}
     acc_type = acc_type_map.get(sale.payment_method, "cash")
-    accounts_col().update_one(
-        {"shop_id": user_shop_id, "type": acc_type},
-        {"$inc": {"balance": total}}
-    )
     
-    # Log activity
-    log_activity(
-        shop_id=user_shop_id or "",
-        user_id=user_id,
-        user_name=seller_name,
-        user_role=current_user.get("role", ""),
-        action="sale_created",
-        details=f"Vente de {total} GNF ({sale.payment_method})",
-        target_type="sale",
-        target_id=sale_id
-    )
+    # Items, stock, sale, balance and audit entry commit together (or not at all)
+    async with async_transaction() as tx:
+        # Take stock across batches (FEFO/FIFO) under row locks; a shortfall rolls everything back
+        allocation = await allocate_stock_async(tx, [(item.product_id, item.quantity) for item in sale.items])
+        shortfall = shortfall_message(allocation, product_names)
+        if shortfall:
+            raise HTTPException(status_code=400, detail=shortfall)
+        
+        await tx["sale_items"].insert_many(sale_items)
+        await tx["sales"].insert_one(sale_data)
+        
+        # Update account balance
+        await tx["accounts"].update_one(
+            {"shop_id": user_shop_id, "type": acc_type},
+            {"$inc": {"balance": total}}
+        )
+        
+        # Log activity
+        await tx["activity_log"].insert_one(activity_entry(
+            shop_id=user_shop_id or "",
+            user_id=user_id,
+            user_name=seller_name,
+            user_role=current_user.get("role", ""),
+            action="sale_created",
+            details=f"Vente de {total} GNF ({sale.payment_method})",
+            target_type="sale",
+            target_id=sale_id
+        ))
     
     return SaleResponse(**sale_data, items=serialize_docs(sale_items))
 
@@ -1718,17 +1738,20 @@ async def generate_internship_attestation(request: AIContractRequest):
     return DocumentResponse(**doc_data, employee_name=employee["name"])
 
 @api_router.get("/documents", response_model=List[DocumentResponse])
-async def get_documents(employee_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def get_documents(response: Response, employee_id: Optional[str] = None,
+                        page: dict = Depends(pagination), current_user: dict = Depends(get_current_user)):
     query = {}
     if employee_id:
         query["employee_id"] = employee_id
     
-    documents = list(documents_col().find(query).sort("created_at", -1))
+    cursor = paginate(documents_col().find(query).sort("created_at", -1), page)
+    documents = cursor.to_list()
+    set_next_page(response, cursor)
+    employees = employees_col().find_by_ids((d["employee_id"] for d in documents), {"name": 1})
     result = []
     for doc in documents:
         doc = serialize_doc(doc)
-        employee = employees_col().find_one({"id": doc["employee_id"]})
-        employee_name = serialize_doc(employee)["name"] if employee else "Inconnu"
+        employee_name = employees.get(doc["employee_id"], {}).get("name", "Inconnu")
         result.append(DocumentResponse(**doc, employee_name=employee_name))
     return result
 
@@ -1878,13 +1901,13 @@ async def get_ai_dashboard_insights():
     total_employees = employees_col().count_documents({})
     
     low_stock_products = []
-    for prod in products_col().find():
+    for prod in products_col().find({}, {"name": 1, "stock_quantity": 1}):
         prod = serialize_doc(prod)
-        stock = sum(b["quantity"] for b in batches_col().find({"product_id": prod["id"]}))
+        stock = int(prod.get("stock_quantity") or 0)
         if stock < 10:
             low_stock_products.append({"name": prod["name"], "stock": stock})
     
-    total_revenue = sum(s["total"] for s in sales_col().find())
+    total_revenue = sum(s["total"] for s in sales_col().find({}, {"total": 1}))
     
     insights = []
     
@@ -1943,9 +1966,9 @@ async def get_ai_stock_insights():
     insights = []
     recommendations = []
     
-    for prod in products_col().find():
+    for prod in products_col().find({}, {"name": 1, "stock_quantity": 1}):
         prod = serialize_doc(prod)
-        stock = sum(b["quantity"] for b in batches_col().find({"product_id": prod["id"]}))
+        stock = int(prod.get("stock_quantity") or 0)
         
         if stock == 0:
             insights.append({
@@ -1975,9 +1998,9 @@ async def get_ai_stock_insights():
 @api_router.get("/ai/insights/sales")
 async def get_ai_sales_insights():
     """Generate AI insights for sales"""
-    sales = list(sales_col().find())
+    sales_count = sales_col().count_documents({})
     
-    if not sales:
+    if not sales_count:
         return {
             "insights": [{"type": "info", "message": "Aucune vente enregistrée"}],
             "top_products": [],
@@ -1986,31 +2009,30 @@ async def get_ai_sales_insights():
         }
     
     # Calculate top products
-    product_sales = {}
-    for sale in sales:
-        sale = serialize_doc(sale)
-        for item in sale_items_col().find({"sale_id": sale["id"]}):
-            item = serialize_doc(item)
-            prod_id = item["product_id"]
-            if prod_id not in product_sales:
-                product_sales[prod_id] = {"name": item.get("product_name", "Inconnu"), "quantity": 0, "revenue": 0}
-            product_sales[prod_id]["quantity"] += item["quantity"]
-            product_sales[prod_id]["revenue"] += item["total"]
-    
-    top_products = sorted(product_sales.values(), key=lambda x: x["revenue"], reverse=True)[:5]
+    top_products = [
+        {"name": p["name"] or "Inconnu", "quantity": p["quantity"], "revenue": p["revenue"]}
+        for p in sale_items_col().aggregate([
+            {"$group": {
+                "_id": "$product_id",
+                "name": {"$first": "$product_name"},
+                "quantity": {"$sum": "$quantity"},
+                "revenue": {"$sum": "$total"},
+            }},
+            {"$sort": {"revenue": -1}},
+            {"$limit": 5},
+        ])
+    ]
     
     # Payment method breakdown
-    payment_breakdown = {}
-    for sale in sales:
-        sale = serialize_doc(sale)
-        method = sale["payment_method"]
-        if method not in payment_breakdown:
-            payment_breakdown[method] = {"count": 0, "total": 0}
-        payment_breakdown[method]["count"] += 1
-        payment_breakdown[method]["total"] += sale["total"]
+    payment_breakdown = {
+        g["_id"]: {"count": g["count"], "total": g["total"]}
+        for g in sales_col().aggregate([
+            {"$group": {"_id": "$payment_method", "count": {"$sum": 1}, "total": {"$sum": "$total"}}}
+        ])
+    }
     
     return {
-        "insights": [{"type": "success", "message": f"{len(sales)} ventes réalisées"}],
+        "insights": [{"type": "success", "message": f"{sales_count} ventes réalisées"}],
         "top_products": top_products,
         "payment_breakdown": payment_breakdown,
         "generated_at": datetime.now(timezone.utc).isoformat()
@@ -2244,39 +2266,33 @@ async def send_whatsapp_promo(phone: str, message: str):
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     shop_filter = get_shop_filter(current_user)
     
-    today = datetime.now(timezone.utc).date().isoformat()
-    today_sales = sum(
-        s["total"] for s in sales_col().find(shop_filter)
-        if serialize_doc(s)["created_at"][:10] == today
-    )
-    
-    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-    monthly_revenue = sum(
-        s["total"] for s in sales_col().find(shop_filter)
-        if serialize_doc(s)["created_at"][:7] == current_month
-    )
+    # Read from the sales_daily rollup: at most one row per day and key this month
+    by_day = await sales_summary_async(shop_filter, since=local_day("month"), by="day")
+    today = local_day("today")
+    today_sales = by_day[today]["revenue"] if today in by_day else 0
+    monthly_revenue = combine(by_day.values())["revenue"]
     
-    acc_filter = shop_filter.copy()
-    cash_balance = sum(serialize_doc(a)["balance"] for a in accounts_col().find({**acc_filter, "type": "cash"}))
-    orange_balance = sum(serialize_doc(a)["balance"] for a in accounts_col().find({**acc_filter, "type": "orange_money"}))
-    bank_balance = sum(serialize_doc(a)["balance"] for a in accounts_col().find({**acc_filter, "type": "bank"}))
+    accounts = await async_accounts_col().find(shop_filter).to_list()
+    cash_balance = sum(serialize_doc(a)["balance"] for a in accounts if a.get("type") == "cash")
+    orange_balance = sum(serialize_doc(a)["balance"] for a in accounts if a.get("type") == "orange_money")
+    bank_balance = sum(serialize_doc(a)["balance"] for a in accounts if a.get("type") == "bank")
     
-    recent_sales = list(sales_col().find(shop_filter).sort("created_at", -1).limit(5))
+    recent_sales = await async_sales_col().find(shop_filter).sort("created_at", -1).limit(5).to_list()
     
     # Shop count: owners see their own shops, admins see all
     if is_admin_role(current_user):
-        shop_count = shops_col().count_documents({})
+        shop_count = await async_shops_col().count_documents({})
     else:
-        shop_count = shops_col().count_documents({"owner_id": current_user["id"]})
+        shop_count = await async_shops_col().count_documents({"owner_id": current_user["id"]})
         if shop_count == 0:
-            shop_count = shops_col().count_documents(shop_filter)
+            shop_count = await async_shops_col().count_documents(shop_filter)
     
     return {
         "today_sales": today_sales,
         "monthly_revenue": monthly_revenue,
         "total_shops": shop_count,
-        "total_products": products_col().count_documents(shop_filter),
-        "total_employees": employees_col().count_documents(shop_filter),
+        "total_products": await async_products_col().count_documents(shop_filter),
+        "total_employees": await async_employees_col().count_documents(shop_filter),
         "cash_balance": cash_balance,
         "orange_money_balance": orange_balance,
         "bank_balance": bank_balance,
@@ -2291,7 +2307,10 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
 async def export_sales_pdf(current_user: dict = Depends(get_current_user)):
     """Export sales report as PDF"""
     shop_filter = get_shop_filter(current_user)
-    sales = list(sales_col().find(shop_filter).sort("created_at", -1))
+    # Only the 30 rows drawn are fetched; the transaction count comes from the sales_daily rollup
+    sales = sales_col().find(shop_filter, {"created_at": 1, "payment_method": 1, "total": 1}).sort("created_at", -1).limit(30)
+    summary = combine(sales_summary(shop_filter).values())
+    total_revenue = 0
     
     buffer = BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
@@ -2315,9 +2334,8 @@ async def export_sales_pdf(current_user: dict = Depends(get_current_user)):
     # Table content
     p.setFont("Helvetica", 9)
     y -= 0.7*cm
-    total_revenue = 0
     
-    for sale in sales[:30]:  # Limit to 30 sales per page
+    for sale in sales:
         sale = serialize_doc(sale)
         if y < 3*cm:
             p.showPage()
@@ -2327,15 +2345,14 @@ async def export_sales_pdf(current_user: dict = Depends(get_current_user)):
         p.drawString(5*cm, y, sale["payment_method"].upper())
         p.drawString(9*cm, y, f"{sale['total']:,.0f}")
         p.drawString(13*cm, y, sale["id"][:12])
-        
-        total_revenue += sale["total"]
         y -= 0.5*cm
+        total_revenue += sale["total"]
     
     # Summary
     y -= 1*cm
     p.setFont("Helvetica-Bold", 12)
     p.drawString(2*cm, y, f"Total des ventes: {total_revenue:,.0f} GNF")
-    p.drawString(2*cm, y - 0.5*cm, f"Nombre de transactions: {len(sales)}")
+    p.drawString(2*cm, y - 0.5*cm, f"Nombre de transactions: {summary['sales_count']}")
     
     p.save()
     buffer.seek(0)
@@ -2350,18 +2367,18 @@ async def export_sales_pdf(current_user: dict = Depends(get_current_user)):
 async def export_products_csv(current_user: dict = Depends(get_current_user)):
     """Export products as CSV"""
     shop_filter = get_shop_filter(current_user)
-    products = list(products_col().find(shop_filter))
-    
-    csv_content = "ID,Nom,Catégorie,Prix (GNF),Stock,Date Création\n"
-    for prod in products:
-        prod = serialize_doc(prod)
-        stock = sum(b["quantity"] for b in batches_col().find({"product_id": prod["id"]}))
-        csv_content += f'"{prod["id"][:8]}","{prod["name"]}","{prod["category"]}",{prod["price"]},{stock},"{prod["created_at"][:10]}"\n'
+    products = products_col().find(shop_filter, {"qr_code": 0})
     
-    buffer = BytesIO(csv_content.encode('utf-8-sig'))
+    def rows():
+        # Streamed row by row from a server-side cursor
+        yield "ID,Nom,Catégorie,Prix (GNF),Stock,Date Création\n".encode('utf-8-sig')
+        for prod in products:
+            prod = serialize_doc(prod)
+            stock = int(prod.get("stock_quantity") or 0)
+            yield f'"{prod["id"][:8]}","{prod["name"]}","{prod["category"]}",{prod["price"]},{stock},"{prod["created_at"][:10]}"\n'.encode('utf-8')
     
     return StreamingResponse(
-        buffer,
+        rows(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=produits_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
@@ -2370,17 +2387,16 @@ async def export_products_csv(current_user: dict = Depends(get_current_user)):
 async def export_employees_csv(current_user: dict = Depends(get_current_user)):
     """Export employees as CSV"""
     shop_filter = get_shop_filter(current_user)
-    employees = list(employees_col().find(shop_filter))
+    employees = employees_col().find(shop_filter)
     
-    csv_content = "ID,Nom,Poste,Salaire (GNF),Type Contrat\n"
-    for emp in employees:
-        emp = serialize_doc(emp)
-        csv_content += f'"{emp["id"][:8]}","{emp["name"]}","{emp["position"]}",{emp["salary"]},"{emp["contract_type"]}"\n'
-    
-    buffer = BytesIO(csv_content.encode('utf-8-sig'))
+    def rows():
+        yield "ID,Nom,Poste,Salaire (GNF),Type Contrat\n".encode('utf-8-sig')
+        for emp in employees:
+            emp = serialize_doc(emp)
+            yield f'"{emp["id"][:8]}","{emp["name"]}","{emp["position"]}",{emp["salary"]},"{emp["contract_type"]}"\n'.encode('utf-8')
     
     return StreamingResponse(
-        buffer,
+        rows(),
         media_type="text/csv",
         headers={"Content-Disposition": f"attachment; filename=employes_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
@@ -2612,14 +2628,13 @@ async def admin_create_user(data: AdminCreateUser, current_user: dict = Depends(
             "is_active": True,
             "created_at": datetime.now(timezone.utc).isoformat()
         })
-        for acc_type in ["cash", "orange_money", "bank"]:
-            accounts_col().insert_one({
-                "id": str(uuid.uuid4()),
-                "shop_id": shop_id,
-                "tenant_id": tenant_id,
-                "type": acc_type,
-                "balance": 0
-            })
+        accounts_col().insert_many([{
+            "id": str(uuid.uuid4()),
+            "shop_id": shop_id,
+            "tenant_id": tenant_id,
+            "type": acc_type,
+            "balance": 0
+        } for acc_type in ["cash", "orange_money", "bank"]])
     
     user_data.pop("password")
     return {"message": f"Utilisateur {data.name} créé avec succès", "user": serialize_doc(user_data)}
@@ -2785,16 +2800,21 @@ async def admin_platform_stats(current_user: dict = Depends(get_current_user)):
     total_products = products_col().count_documents({})
     total_sales = sales_col().count_documents({})
     
-    all_sales = list(sales_col().find())
-    total_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in all_sales)
-    
-    today = datetime.now(timezone.utc).date().isoformat()
-    today_sales = [s for s in all_sales if serialize_doc(s).get("created_at", "")[:10] == today]
-    today_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in today_sales)
+    # Revenue per shop: all time, today and this month (one grouped query each on the sales_daily rollup)
+    def revenue_by_shop(since=None):
+        return {
+            shop_id: {"count": t["sales_count"], "revenue": t["revenue"]}
+            for shop_id, t in sales_summary(since=since, by="shop_id").items()
+        }
     
-    current_month = datetime.now(timezone.utc).strftime("%Y-%m")
-    monthly_sales = [s for s in all_sales if serialize_doc(s).get("created_at", "")[:7] == current_month]
-    monthly_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in monthly_sales)
+    all_time_by_shop = revenue_by_shop()
+    today_by_shop = revenue_by_shop(local_day("today"))
+    monthly_by_shop = revenue_by_shop(local_day("month"))
+    total_revenue = sum(g["revenue"] for g in all_time_by_shop.values())
+    today_revenue = sum(g["revenue"] for g in today_by_shop.values())
+    today_sales_count = sum(g["count"] for g in today_by_shop.values())
+    monthly_revenue = sum(g["revenue"] for g in monthly_by_shop.values())
+    monthly_sales_count = sum(g["count"] for g in monthly_by_shop.values())
     
     # Users by role (all roles)
     owners = users_col().count_documents({"role": "owner"})
@@ -2806,37 +2826,35 @@ async def admin_platform_stats(current_user: dict = Depends(get_current_user)):
     
     # === MULTI-TENANCY MONITORING: Per-shop breakdown ===
     all_shops = list(shops_col().find())
-    all_employees = list(employees_col().find())
-    all_products = list(products_col().find())
+    employees_by_shop = {}
+    for g in employees_col().aggregate([
+        {"$group": {"_id": {"shop_id": "$shop_id", "role": "$role"}, "count": {"$sum": 1}}}
+    ]):
+        roles = employees_by_shop.setdefault(g["_id"]["shop_id"], {})
+        role = g["_id"]["role"] or "seller"
+        roles[role] = roles.get(role, 0) + g["count"]
+    products_by_shop = {
+        g["_id"]: g["count"]
+        for g in products_col().aggregate([{"$group": {"_id": "$shop_id", "count": {"$sum": 1}}}])
+    }
+    owners_by_shop = {}
+    for owner_user in users_col().find({"role": {"$in": ["owner", "ceo"]}}, {"shop_id": 1, "name": 1, "email": 1}):
+        owners_by_shop.setdefault(owner_user.get("shop_id"), owner_user)
     
     tenants = []
+    no_sales = {"count": 0, "revenue": 0}
     for shop in all_shops:
         shop_data = serialize_doc(shop)
         shop_id = shop_data.get("id", "")
         shop_name = shop_data.get("name", "Sans nom")
         
-        # Count per shop
-        shop_employees = [e for e in all_employees if serialize_doc(e).get("shop_id") == shop_id]
-        shop_products = [p for p in all_products if serialize_doc(p).get("shop_id") == shop_id]
-        shop_sales = [s for s in all_sales if serialize_doc(s).get("shop_id") == shop_id]
-        shop_today_sales = [s for s in shop_sales if serialize_doc(s).get("created_at", "")[:10] == today]
-        shop_monthly_sales = [s for s in shop_sales if serialize_doc(s).get("created_at", "")[:7] == current_month]
-        
-        shop_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in shop_sales)
-        shop_today_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in shop_today_sales)
-        shop_monthly_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in shop_monthly_sales)
-        
-        # Employees by role in this shop
-        emp_roles = {}
-        for e in shop_employees:
-            ed = serialize_doc(e)
-            r = ed.get("role", "seller")
-            emp_roles[r] = emp_roles.get(r, 0) + 1
-        
-        # Find owner user
-        owner_user = users_col().find_one({"shop_id": shop_id, "role": {"$in": ["owner", "ceo"]}})
-        owner_name = serialize_doc(owner_user).get("name", "") if owner_user else ""
-        owner_email = serialize_doc(owner_user).get("email", "") if owner_user else ""
+        emp_roles = employees_by_shop.get(shop_id, {})
+        owner_user = owners_by_shop.get(shop_id)
+        owner_name = owner_user.get("name", "") if owner_user else ""
+        owner_email = owner_user.get("email", "") if owner_user else ""
+        shop_sales = all_time_by_shop.get(shop_id, no_sales)
+        shop_today = today_by_shop.get(shop_id, no_sales)
+        shop_monthly = monthly_by_shop.get(shop_id, no_sales)
         
         tenants.append({
             "shop_id": shop_id,
@@ -2845,15 +2863,15 @@ async def admin_platform_stats(current_user: dict = Depends(get_current_user)):
             "owner_email": owner_email,
             "is_active": shop_data.get("is_active", True),
             "created_at": shop_data.get("created_at", ""),
-            "total_employees": len(shop_employees),
+            "total_employees": sum(emp_roles.values()),
             "employees_by_role": emp_roles,
-            "total_products": len(shop_products),
-            "total_sales": len(shop_sales),
-            "total_revenue": shop_revenue,
-            "today_sales": len(shop_today_sales),
-            "today_revenue": shop_today_revenue,
-            "monthly_sales": len(shop_monthly_sales),
-            "monthly_revenue": shop_monthly_revenue,
+            "total_products": products_by_shop.get(shop_id, 0),
+            "total_sales": shop_sales["count"],
+            "total_revenue": shop_sales["revenue"],
+            "today_sales": shop_today["count"],
+            "today_revenue": shop_today["revenue"],
+            "monthly_sales": shop_monthly["count"],
+            "monthly_revenue": shop_monthly["revenue"],
         })
     
     # Sort tenants by revenue (most active first)
@@ -2878,13 +2896,20 @@ async def admin_platform_stats(current_user: dict = Depends(get_current_user)):
         "total_sales": total_sales,
         "total_revenue": total_revenue,
         "today_revenue": today_revenue,
-        "today_sales_count": len(today_sales),
+        "today_sales_count": today_sales_count,
         "monthly_revenue": monthly_revenue,
-        "monthly_sales_count": len(monthly_sales),
+        "monthly_sales_count": monthly_sales_count,
         "tenants": tenants,
         "recent_activity": serialize_docs(recent_activity),
     }
 
+@api_router.get("/admin/db-stats")
+async def admin_db_stats(current_user: dict = Depends(get_current_user)):
+    """Admin: Database connection pool usage (in use, idle, wait times) and SQL cache hit rate"""
+    if not is_admin_role(current_user):
+        raise HTTPException(status_code=403, detail="Accès réservé aux administrateurs")
+    return get_database_stats()
+
 # ========================
 # OWNER - SHOP MANAGEMENT
 # ========================
@@ -2979,97 +3004,126 @@ async def owner_add_seller(data: EmployeeCreate, current_user: dict = Depends(ge
 async def owner_financial_analysis(period: str = "today", current_user: dict = Depends(get_current_user)):
     """Owner: Get financial analysis with profit calculations"""
     shop_filter = get_shop_filter(current_user)
-    all_sales = list(sales_col().find(shop_filter))
-    
-    now = datetime.now(timezone.utc)
-    today = now.date().isoformat()
-    current_month = now.strftime("%Y-%m")
-    
-    today_sales = []
-    monthly_sales = []
-    for s in all_sales:
-        s = serialize_doc(s)
-        created = s.get("created_at", "")
-        if created[:10] == today:
-            today_sales.append(s)
-        if created[:7] == current_month:
-            monthly_sales.append(s)
+    today, month_start = local_day("today"), local_day("month")
     
-    today_revenue = sum(float(s.get("total", 0)) for s in today_sales)
-    monthly_revenue = sum(float(s.get("total", 0)) for s in monthly_sales)
-    today_profit = sum(float(s.get("profit", 0)) for s in today_sales)
-    monthly_profit = sum(float(s.get("profit", 0)) for s in monthly_sales)
+    # All from the sales_daily rollup, whatever the shop's sales history
+    by_day = sales_summary(shop_filter, since=month_start, by="day")
     
     # Sales by payment method
     by_payment = {}
-    target = today_sales if period == "today" else monthly_sales
-    for s in target:
-        method = s.get("payment_method", "cash")
-        by_payment[method] = by_payment.get(method, 0) + float(s.get("total", 0))
+    target_start = today if period == "today" else month_start
+    for method, t in sales_summary(shop_filter, since=target_start, by="payment_method").items():
+        method = method or "cash"
+        by_payment[method] = by_payment.get(method, 0) + t["revenue"]
     
     return {
-        "today": {
-            "revenue": today_revenue,
-            "profit": today_profit,
-            "sales_count": len(today_sales)
-        },
-        "monthly": {
-            "revenue": monthly_revenue,
-            "profit": monthly_profit,
-            "sales_count": len(monthly_sales)
-        },
+        "today": combine(t for day, t in by_day.items() if day == today),
+        "monthly": combine(by_day.values()),
         "by_payment_method": by_payment,
-        "total_all_time": {
-            "revenue": sum(float(serialize_doc(s).get("total", 0)) for s in all_sales),
-            "profit": sum(float(serialize_doc(s).get("profit", 0)) for s in all_sales),
-            "sales_count": len(all_sales)
-        }
+        "total_all_time": combine(sales_summary(shop_filter).values())
     }
 
+# ========================
+# OWNER - SALES REPORTS (custom ranges, time zones, buckets)
+# ========================
+
+async def report_scope(tz: Optional[str] = None, shop_id: Optional[str] = None,
+                       current_user: dict = Depends(get_current_user)) -> tuple:
+    """?tz=&shop_id= as (sales filter, time zone).
+
+    ``tz`` defaults to the shop's time zone (None then means REPORT_TIMEZONE).
+    Only admins may pick another shop with ``shop_id``.
+    """
+    match = get_shop_filter(current_user)
+    if shop_id and not match:
+        match["shop_id"] = shop_id
+    return match, tz or await shop_timezone(match.get("shop_id"))
+
+async def sales_report_request(date_from: Optional[date] = Query(None, alias="from"),
+                               date_to: Optional[date] = Query(None, alias="to"),
+                               bucket: str = "day", scope: tuple = Depends(report_scope)) -> tuple:
+    """?from=&to=&bucket= (local days, both included) plus the report scope as (sales filter, report period)."""
+    match, tz = scope
+    try:
+        return match, report_period(date_from, date_to, tz, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def sales_filter_request(date_from: Optional[date] = Query(None, alias="from"),
+                               date_to: Optional[date] = Query(None, alias="to"),
+                               scope: tuple = Depends(report_scope)) -> dict:
+    """?from=&to= (local days, both included, optional) plus the report scope as a sales filter."""
+    match, tz = scope
+    try:
+        created_at = created_at_range(date_from, date_to, tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {**match, "created_at": created_at} if created_at else match
+
+@api_router.get("/owner/reports/sales")
+async def owner_sales_report(report: tuple = Depends(sales_report_request)):
+    """Owner: Sales count, revenue and profit per hour/day/week/month over any date range"""
+    match, period = report
+    return await sales_report_async(match, period)
+
+@api_router.get("/export/sales/report/csv")
+async def export_sales_report_csv(report: tuple = Depends(sales_report_request)):
+    """Export a bucketed sales report (same parameters as /owner/reports/sales) as CSV"""
+    match, period = report
+    result = await sales_report_async(match, period)
+    
+    lines = ["Période,Ventes,Chiffre d'affaires (GNF),Bénéfice (GNF)"]
+    lines += [f'"{b["start"]}",{b["sales_count"]},{b["revenue"]:.2f},{b["profit"]:.2f}' for b in result["series"]]
+    lines.append(f'"Total",{result["totals"]["sales_count"]},{result["totals"]["revenue"]:.2f},{result["totals"]["profit"]:.2f}')
+    
+    return Response(
+        content=("\n".join(lines) + "\n").encode('utf-8-sig'),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=rapport_ventes_{result['from']}_{result['to']}_{result['bucket']}.csv"}
+    )
+
+@api_router.get("/owner/timeseries")
+async def owner_timeseries(metric: str = "revenue", interval: Optional[str] = None,
+                           points: int = DEFAULT_SERIES_POINTS,
+                           date_from: Optional[date] = Query(None, alias="from"),
+                           date_to: Optional[date] = Query(None, alias="to"),
+                           scope: tuple = Depends(report_scope)):
+    """Owner: Chart series of revenue, profit and/or count (comma-separated), at most ``points`` points each.
+
+    Long ranges are downsampled server-side: the step widens from ``interval``
+    (15m, 1h, 3h, 6h, 12h, 1d, 7d, 30d, 90d, 365d) until the range fits.
+    """
+    match, tz = scope
+    try:
+        period = series_period(date_from, date_to, tz, metric.split(","), interval, points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await sales_timeseries_async(match, period)
+
 # ========================
 # OWNER - SALES BY SELLER / PRODUCT
 # ========================
 
 @api_router.get("/owner/sales-by-seller")
-async def owner_sales_by_seller(current_user: dict = Depends(get_current_user)):
-    """Owner: View sales grouped by seller"""
-    shop_filter = get_shop_filter(current_user)
-    sales = list(sales_col().find(shop_filter))
-    by_seller = {}
-    for s in sales:
-        s = serialize_doc(s)
-        seller_id = s.get("user_id", "unknown")
-        seller_name = s.get("seller_name", "")
-        if not seller_name:
-            seller_user = users_col().find_one({"id": seller_id})
-            seller_name = serialize_doc(seller_user).get("name", "Inconnu") if seller_user else "Inconnu"
-        if seller_id not in by_seller:
-            by_seller[seller_id] = {"name": seller_name, "total": 0, "count": 0, "profit": 0}
-        by_seller[seller_id]["total"] += float(s.get("total", 0))
-        by_seller[seller_id]["count"] += 1
-        by_seller[seller_id]["profit"] += float(s.get("profit", 0))
-    return list(by_seller.values())
+async def owner_sales_by_seller(response: Response, page: dict = Depends(pagination),
+                                sales_filter: dict = Depends(sales_filter_request)):
+    """Owner: Sales count, total and profit per seller, best first (?from=&to=&limit=&after=)"""
+    try:
+        sellers, next_after = await sales_by_seller_async(sales_filter, page["limit"], page["after"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Jeton de pagination invalide")
+    if next_after:
+        response.headers["X-Next-After"] = next_after
+    return sellers
 
 @api_router.get("/owner/sales-by-product")
-async def owner_sales_by_product(current_user: dict = Depends(get_current_user)):
-    """Owner: View sales grouped by product"""
-    shop_filter = get_shop_filter(current_user)
-    sale_items = list(sale_items_col().find())
-    # Filter by shop's sales
-    shop_sales = {serialize_doc(s)["id"] for s in sales_col().find(shop_filter)}
-    
-    by_product = {}
-    for item in sale_items:
-        item = serialize_doc(item)
-        if item.get("sale_id") not in shop_sales and shop_filter:
-            continue
-        pid = item.get("product_id", "unknown")
-        pname = item.get("product_name", "")
-        if pid not in by_product:
-            by_product[pid] = {"name": pname, "quantity_sold": 0, "revenue": 0}
-        by_product[pid]["quantity_sold"] += int(item.get("quantity", 0))
-        by_product[pid]["revenue"] += float(item.get("subtotal", 0))
-    return list(by_product.values())
+async def owner_sales_by_product(sort: str = "revenue", limit: Optional[int] = Query(None, ge=1, le=1000),
+                                 sales_filter: dict = Depends(sales_filter_request)):
+    """Owner: Quantity, revenue and profit per product (?from=&to=&sort=revenue|quantity|profit&limit=N)"""
+    try:
+        return await sales_by_product_async(sales_filter, sort, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # ========================
 # OWNER - STOCK ALERTS
@@ -3079,11 +3133,11 @@ async def owner_sales_by_product(current_user: dict = Depends(get_current_user))
 async def owner_stock_alerts(current_user: dict = Depends(get_current_user)):
     """Owner: Get products with low stock"""
     shop_filter = get_shop_filter(current_user)
-    products = list(products_col().find(shop_filter))
+    products = list(products_col().find(shop_filter, {"qr_code": 0}))
     alerts = []
     for p in products:
         p = serialize_doc(p)
-        stock = sum(int(serialize_doc(b).get("quantity", 0)) for b in batches_col().find({"product_id": p["id"]}))
+        stock = int(p.get("stock_quantity") or 0)
         threshold = int(p.get("low_stock_threshold", 5))
         if stock <= threshold:
             alerts.append({
@@ -3108,6 +3162,9 @@ async def create_return(data: ProductReturnCreate, current_user: dict = Depends(
     
     product = products_col().find_one({"id": data.product_id})
     product_name = serialize_doc(product).get("name", "") if product else ""
+    # Refund at the price the item was sold for (booked in the sales_daily rollup)
+    item = sale_items_col().find_one({"sale_id": data.sale_id, "product_id": data.product_id}, {"price": 1})
+    amount = float(item.get("price") or 0) * data.quantity if item else 0
     
     return_id = str(uuid.uuid4())
     return_data = {
@@ -3116,27 +3173,31 @@ async def create_return(data: ProductReturnCreate, current_user: dict = Depends(
         "product_id": data.product_id,
         "product_name": product_name,
         "quantity": data.quantity,
+        "amount": amount,
         "reason": data.reason,
         "status": "pending",
         "processed_by": current_user.get("name"),
         "shop_id": current_user.get("shop_id", ""),
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    returns_col().insert_one(return_data)
-    
-    # Re-add returned quantity to stock
-    batch = batches_col().find_one({"product_id": data.product_id})
-    if batch:
-        batch = serialize_doc(batch)
-        batches_col().update_one({"id": batch["id"]}, {"$set": {"quantity": int(batch.get("quantity", 0)) + data.quantity}})
+    # Return record and restocked quantity commit together
+    with transaction() as tx:
+        tx["returns"].insert_one(return_data)
+        
+        # Re-add returned quantity to stock
+        batch = tx["batches"].find_one({"product_id": data.product_id}, {"id": 1})
+        if batch:
+            tx["batches"].update_one({"id": batch["id"]}, {"$inc": {"quantity": data.quantity}})
     
     return {"message": "Retour enregistré", "return": return_data}
 
 @api_router.get("/returns")
-async def list_returns(current_user: dict = Depends(get_current_user)):
+async def list_returns(response: Response, page: dict = Depends(pagination), current_user: dict = Depends(get_current_user)):
     """List returns for the shop"""
     shop_filter = get_shop_filter(current_user)
-    returns = list(returns_col().find(shop_filter))
+    cursor = paginate(returns_col().find(shop_filter), page)
+    returns = cursor.to_list()
+    set_next_page(response, cursor)
     return serialize_docs(returns)
 
 @api_router.post("/returns/{return_id}/approve")
@@ -3158,24 +3219,18 @@ async def reject_return(return_id: str, current_user: dict = Depends(get_current
 @api_router.get("/seller/my-performance")
 async def seller_my_performance(current_user: dict = Depends(get_current_user)):
     """Seller: View own sales performance"""
-    user_id = current_user["id"]
-    all_sales = list(sales_col().find({"user_id": user_id}))
-    
-    now = datetime.now(timezone.utc)
-    today = now.date().isoformat()
-    
-    today_sales = [s for s in all_sales if serialize_doc(s).get("created_at", "")[:10] == today]
-    today_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in today_sales)
-    total_revenue = sum(float(serialize_doc(s).get("total", 0)) for s in all_sales)
+    seller = {"user_id": current_user["id"]}
+    today = combine(sales_summary(seller, since=local_day("today")).values())
+    all_time = combine(sales_summary(seller).values())
     
     return {
         "today": {
-            "sales_count": len(today_sales),
-            "revenue": today_revenue
+            "sales_count": today["sales_count"],
+            "revenue": today["revenue"]
         },
         "all_time": {
-            "sales_count": len(all_sales),
-            "revenue": total_revenue
+            "sales_count": all_time["sales_count"],
+            "revenue": all_time["revenue"]
         }
     }
 
@@ -3183,11 +3238,11 @@ async def seller_my_performance(current_user: dict = Depends(get_current_user)):
 async def seller_available_products(current_user: dict = Depends(get_current_user)):
     """Seller: View available products with stock levels"""
     shop_filter = get_shop_filter(current_user)
-    products = list(products_col().find(shop_filter))
+    products = list(products_col().find(shop_filter, {"qr_code": 0}))
     result = []
     for p in products:
         p = serialize_doc(p)
-        stock = sum(int(serialize_doc(b).get("quantity", 0)) for b in batches_col().find({"product_id": p["id"]}))
+        stock = int(p.get("stock_quantity") or 0)
         if stock > 0:
             result.append({
                 "id": p["id"],
@@ -3229,26 +3284,6 @@ async def owner_create_employee(data: EmployeeCreate, current_user: dict = Depen
         if existing:
             raise HTTPException(status_code=400, detail="Email deja utilise")
         seller_user_id = str(uuid.uuid4())
-        users_col().insert_one({
-            "id": seller_user_id,
-            "name": data.name,
-            "email": data.email,
-            "password": pwd_context.hash("changeme123"),
-            "role": role,
-            "shop_id": shop_id,
-            "tenant_id": tenant_id,
-            "is_active": True,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-        # Auto-authorize for access gate
-        authorized_users_col().insert_one({
-            "id": str(uuid.uuid4()),
-            "name": data.name,
-            "email": data.email,
-            "access_type": "permanent",
-            "expires_at": None,
-            "approved_at": datetime.now(timezone.utc).isoformat()
-        })
     
     emp_data = {
         "id": emp_id,
@@ -3265,10 +3300,33 @@ async def owner_create_employee(data: EmployeeCreate, current_user: dict = Depen
         **perms,
         "created_at": datetime.now(timezone.utc).isoformat()
     }
-    employees_col().insert_one(emp_data)
     
-    log_activity(shop_id, current_user["id"], current_user.get("name",""), current_user.get("role",""),
-        "employee_created", f"Employe '{data.name}' cree avec role '{role}'", "employee", emp_id)
+    # Login account, access grant, employee record and audit entry commit together
+    with transaction() as tx:
+        if seller_user_id:
+            tx["users"].insert_one({
+                "id": seller_user_id,
+                "name": data.name,
+                "email": data.email,
+                "password": pwd_context.hash("changeme123"),
+                "role": role,
+                "shop_id": shop_id,
+                "tenant_id": tenant_id,
+                "is_active": True,
+                "created_at": datetime.now(timezone.utc).isoformat()
+            })
+            # Auto-authorize for access gate
+            tx["authorized_users"].insert_one({
+                "id": str(uuid.uuid4()),
+                "name": data.name,
+                "email": data.email,
+                "access_type": "permanent",
+                "expires_at": None,
+                "approved_at": datetime.now(timezone.utc).isoformat()
+            })
+        tx["employees"].insert_one(emp_data)
+        tx["activity_log"].insert_one(activity_entry(shop_id, current_user["id"], current_user.get("name",""), current_user.get("role",""),
+            "employee_created", f"Employe '{data.name}' cree avec role '{role}'", "employee", emp_id))
     
     response = {"message": f"Employe {data.name} cree avec succes", "employee": emp_data}
     if seller_user_id:
@@ -3416,13 +3474,16 @@ async def create_stock_request(data: StockRequestCreate, current_user: dict = De
     return {"message": "Demande de modification stock creee", "request": req_data}
 
 @api_router.get("/stock-requests")
-async def list_stock_requests(status: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def list_stock_requests(response: Response, status: Optional[str] = None,
+                              page: dict = Depends(pagination), current_user: dict = Depends(get_current_user)):
     """List stock requests for the shop"""
     shop_id = current_user.get("shop_id")
     query = {"shop_id": shop_id} if shop_id else {}
     if status:
         query["status"] = status
-    requests = list(stock_requests_col().find(query).sort("created_at", -1))
+    cursor = paginate(stock_requests_col().find(query).sort("created_at", -1), page)
+    requests = cursor.to_list()
+    set_next_page(response, cursor)
     return serialize_docs(requests)
 
 @api_router.post("/stock-requests/{request_id}/approve")
@@ -3440,40 +3501,43 @@ async def approve_stock_request(request_id: str, current_user: dict = Depends(ge
     if req["status"] != "pending":
         raise HTTPException(status_code=400, detail="Demande deja traitee")
     
-    # Apply the stock modification
-    batch = batches_col().find_one({"product_id": req["product_id"]})
-    if batch:
-        batch = serialize_doc(batch)
-        current_qty = int(batch.get("quantity", 0))
-        if req["action"] == "add":
-            new_qty = current_qty + req["quantity"]
-        elif req["action"] == "remove":
-            new_qty = max(0, current_qty - req["quantity"])
-        else:  # adjust
-            new_qty = req["quantity"]
-        batches_col().update_one({"id": batch["id"]}, {"$set": {"quantity": new_qty}})
-    else:
-        # Create a batch if none exists
-        batches_col().insert_one({
-            "id": str(uuid.uuid4()),
-            "product_id": req["product_id"],
-            "lot_number": f"LOT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}",
-            "size": "",
-            "color": "",
-            "quantity": req["quantity"],
-            "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    
-    stock_requests_col().update_one({"id": request_id}, {"$set": {
-        "status": "approved",
-        "approved_by": current_user["id"],
-        "approved_by_name": current_user.get("name", ""),
-        "processed_at": datetime.now(timezone.utc).isoformat()
-    }})
-    
-    log_activity(req.get("shop_id",""), current_user["id"], current_user.get("name",""), current_user.get("role",""),
-        "stock_request_approved", f"Demande stock approuvee: {req['action']} {req['quantity']}x '{req.get('product_name','')}'",
-        "stock_request", request_id)
+    # Stock change, request status and audit entry commit together
+    with transaction() as tx:
+        # Claim the request first: the conditional UPDATE locks its row, so a concurrent
+        # approval (or rejection) waits for this one and then matches nothing
+        claimed = tx["stock_requests"].update_one({"id": request_id, "status": "pending"}, {"$set": {
+            "status": "approved",
+            "approved_by": current_user["id"],
+            "approved_by_name": current_user.get("name", ""),
+            "processed_at": datetime.now(timezone.utc).isoformat()
+        }})
+        if claimed.matched_count == 0:
+            raise HTTPException(status_code=400, detail="Demande deja traitee")
+        
+        # Apply the stock modification
+        batch = tx["batches"].find_one({"product_id": req["product_id"]}, {"id": 1})
+        if req["action"] == "remove":
+            # Spread across batches like a sale; removing more than is in stock empties it
+            allocate_stock(tx, {req["product_id"]: req["quantity"]})
+        elif batch and req["action"] == "add":
+            tx["batches"].update_one({"id": batch["id"]}, {"$inc": {"quantity": req["quantity"]}})
+        elif batch:  # adjust
+            tx["batches"].update_one({"id": batch["id"]}, {"$set": {"quantity": req["quantity"]}})
+        else:
+            # Create a batch if none exists
+            tx["batches"].insert_one({
+                "id": str(uuid.uuid4()),
+                "product_id": req["product_id"],
+                "lot_number": f"LOT-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:4].upper()}",
+                "size": "",
+                "color": "",
+                "quantity": req["quantity"],
+                "created_at": datetime.now(timezone.utc).isoformat()
+            })
+        
+        tx["activity_log"].insert_one(activity_entry(req.get("shop_id",""), current_user["id"], current_user.get("name",""), current_user.get("role",""),
+            "stock_request_approved", f"Demande stock approuvee: {req['action']} {req['quantity']}x '{req.get('product_name','')}'",
+            "stock_request", request_id))
     
     return {"message": "Demande approuvee et stock mis a jour"}
 
@@ -3489,12 +3553,14 @@ async def reject_stock_request(request_id: str, current_user: dict = Depends(get
         raise HTTPException(status_code=404, detail="Demande non trouvee")
     req = serialize_doc(req)
     
-    stock_requests_col().update_one({"id": request_id}, {"$set": {
+    rejected = stock_requests_col().update_one({"id": request_id, "status": "pending"}, {"$set": {
         "status": "rejected",
         "approved_by": current_user["id"],
         "approved_by_name": current_user.get("name", ""),
         "processed_at": datetime.now(timezone.utc).isoformat()
     }})
+    if rejected.matched_count == 0:
+        raise HTTPException(status_code=400, detail="Demande deja traitee")
     
     log_activity(req.get("shop_id",""), current_user["id"], current_user.get("name",""), current_user.get("role",""),
         "stock_request_rejected", f"Demande stock rejetee: {req['action']} {req['quantity']}x '{req.get('product_name','')}'",
@@ -3557,7 +3623,7 @@ async def scan_product_qr(product_id: str):
     if not product:
         raise HTTPException(status_code=404, detail="Produit non trouve")
     product = serialize_doc(product)
-    stock = sum(int(serialize_doc(b).get("quantity", 0)) for b in batches_col().find({"product_id": product_id}))
+    stock = int(product.get("stock_quantity") or 0)
     return {
         "product_id": product_id,
         "name": product.get("name", ""),
@@ -3585,6 +3651,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After"],
 )
 
 # Configure logging
@@ -3600,4 +3667,10 @@ async def startup_event():
     init_indexes()
     init_security()
     init_demo_data()
+    await init_async_database()
     logger.info("StartupManager Pro API started with PostgreSQL + Security")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_async_connection()
+    close_connection()
@@ -109,6 +109,25 @@ class TestProducts:
             print(f"   Sample product: {product.get('name')} - {product.get('category')} - {product.get('price')}")
         
         return len(products)
+    
+    def test_product_without_batches(self, auth_token):
+        """A new product starts at stock 0, and the stock insights cope with it before its first batch"""
+        headers = {"Authorization": f"Bearer {auth_token}"}
+        response = requests.post(f"{BASE_URL}/api/products", headers=headers, json={
+            "name": "TEST_Sans lot", "category": "Test", "buy_price": 100, "sell_price": 200
+        })
+        assert response.status_code == 200
+        product = response.json()
+        try:
+            assert product["stock_quantity"] == 0
+            for path in ("/api/ai/insights/dashboard", "/api/ai/insights/stock"):
+                insights = requests.get(f"{BASE_URL}{path}", headers=headers)
+                assert insights.status_code == 200, f"{path}: {insights.status_code}"
+            listed = requests.get(f"{BASE_URL}/api/products/{product['id']}", headers=headers).json()
+            assert listed["stock_quantity"] == 0
+        finally:
+            requests.delete(f"{BASE_URL}/api/products/{product['id']}", headers=headers)
+        print("✅ Product without batches: stock 0, insights OK")
 
 
 class TestEmployees:
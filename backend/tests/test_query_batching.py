@@ -0,0 +1,138 @@
+"""
+Query batching tests - foreign keys resolved per page, not per row
+Tests for:
+- GET /api/batches resolves product names with one query whatever the number of batches
+- GET /api/documents resolves employee names with one query whatever the page size
+- GET /api/sales embeds each sale's items in the page query (with ?from=&to= filters on the shop's local days)
+- List endpoints return every row unless ?limit= or ?after= asks for a page
+Query counts are read from /api/admin/db-stats ("queries").
+"""
+import pytest
+import requests
+import os
+from datetime import datetime, timedelta
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture
+def admin_headers():
+    """Get admin auth headers"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@startup.com",
+        "password": "admin123"
+    })
+    if response.status_code != 200:
+        pytest.skip("Admin authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def query_count(headers):
+    response = requests.get(f"{BASE_URL}/api/admin/db-stats", headers=headers)
+    assert response.status_code == 200, f"db-stats failed: {response.text}"
+    return response.json()["queries"]
+
+
+def queries_for(headers, path, params=None):
+    """Statements the server ran for one GET (the db-stats call's own auth lookups cancel out)."""
+    requests.get(f"{BASE_URL}{path}", headers=headers, params=params)  # warm-up
+    before = query_count(headers)
+    response = requests.get(f"{BASE_URL}{path}", headers=headers, params=params)
+    assert response.status_code == 200, f"{path} failed: {response.text}"
+    return query_count(headers) - before, response.json()
+
+
+class TestConstantQueryCount:
+    """Listing endpoints must not issue one lookup per row"""
+
+    def test_batches_query_count_independent_of_rows(self, admin_headers):
+        """All batches vs a single product's batches cost the same number of queries"""
+        all_count, batches = queries_for(admin_headers, "/api/batches")
+        if len(batches) < 2:
+            pytest.skip("Need at least 2 batches")
+        one_count, one = queries_for(admin_headers, "/api/batches", {"product_id": batches[0]["product_id"]})
+        assert all(b["product_name"] != "Inconnu" for b in batches)
+        assert all_count == one_count, f"{len(batches)} batches: {all_count} queries, {len(one)}: {one_count}"
+        print(f"✅ /api/batches: {all_count} queries for {len(batches)} batches, {one_count} for {len(one)}")
+
+    def test_documents_query_count_independent_of_page_size(self, admin_headers):
+        """A page of 1 document and a page of 50 cost the same number of queries"""
+        small_count, small = queries_for(admin_headers, "/api/documents", {"limit": 1})
+        large_count, large = queries_for(admin_headers, "/api/documents", {"limit": 50})
+        if len(large) < 2:
+            pytest.skip("Need at least 2 documents")
+        assert small_count == large_count, f"page of {len(small)}: {small_count} queries, {len(large)}: {large_count}"
+        print(f"✅ /api/documents: {large_count} queries for a page of {len(large)}")
+
+    def test_sales_items_embedded_in_page_query(self, admin_headers):
+        """A page of 1 sale and a page of 50 cost the same, and every sale carries its items"""
+        small_count, small = queries_for(admin_headers, "/api/sales", {"limit": 1})
+        large_count, large = queries_for(admin_headers, "/api/sales", {"limit": 50})
+        if len(large) < 2:
+            pytest.skip("Need at least 2 sales")
+        assert all(sale["items"] and all(i["sale_id"] == sale["id"] for i in sale["items"]) for sale in large)
+        assert small_count == large_count, f"page of {len(small)}: {small_count} queries, {len(large)}: {large_count}"
+        print(f"✅ /api/sales: {large_count} queries for a page of {len(large)}")
+
+    def test_sales_date_range(self, admin_headers):
+        """?from=&to= keep only sales created on those days (both included)"""
+        sales = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers, params={"limit": 1}).json()
+        if not sales:
+            pytest.skip("No sales")
+        day = sales[0]["created_at"][:10]
+        response = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers,
+                                params={"from": day, "to": day, "limit": 100})
+        assert response.status_code == 200
+        day_sales = response.json()
+        assert day_sales and all(s["created_at"].startswith(day) for s in day_sales)
+        response = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers, params={"from": day, "to": "2000-01-01"})
+        assert response.status_code == 400
+        print(f"✅ /api/sales?from={day}&to={day}: {len(day_sales)} sale(s)")
+
+    def test_sales_date_range_in_shop_time_zone(self, admin_headers):
+        """Days are the shop's local days, so /api/sales and the sales report agree on which sales a day holds"""
+        sales = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers, params={"limit": 1}).json()
+        if not sales or not sales[0].get("shop_id"):
+            pytest.skip("No shop sale")
+        shop_id = sales[0]["shop_id"]
+        created = datetime.fromisoformat(sales[0]["created_at"].replace("Z", "+00:00"))
+        # A zone where the sale falls on another day than in UTC
+        tz, offset = ("Pacific/Kiritimati", 14) if created.hour >= 10 else ("Pacific/Pago_Pago", -11)
+        local_day = (created + timedelta(hours=offset)).date().isoformat()
+        response = requests.put(f"{BASE_URL}/api/admin/shops/{shop_id}", headers=admin_headers,
+                                json={"timezone": tz})
+        assert response.status_code == 200
+        try:
+            params = {"shop_id": shop_id, "from": local_day, "to": local_day}
+            day_sales = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers, params=params).json()
+            report = requests.get(f"{BASE_URL}/api/owner/reports/sales", headers=admin_headers, params=params).json()
+        finally:
+            # The default REPORT_TIMEZONE
+            requests.put(f"{BASE_URL}/api/admin/shops/{shop_id}", headers=admin_headers,
+                         json={"timezone": "Africa/Conakry"})
+        assert sales[0]["id"] in [s["id"] for s in day_sales]
+        assert report["timezone"] == tz
+        assert report["totals"]["sales_count"] == len(day_sales)
+        print(f"✅ {local_day} in {tz}: {len(day_sales)} sale(s) on both endpoints")
+
+
+class TestOptInPaging:
+    """Pages are only cut when the client asks for them"""
+
+    def test_unpaged_list_is_complete(self, admin_headers):
+        """No ?limit= means no LIMIT and no X-Next-After; chained pages of 1 give the same sales"""
+        response = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers)
+        assert response.status_code == 200
+        assert "X-Next-After" not in response.headers
+        sales = response.json()
+        if len(sales) < 2:
+            pytest.skip("Need at least 2 sales")
+        paged, params = [], {"limit": 1}
+        while True:
+            page = requests.get(f"{BASE_URL}/api/sales", headers=admin_headers, params=params)
+            paged += page.json()
+            if "X-Next-After" not in page.headers:
+                break
+            params["after"] = page.headers["X-Next-After"]
+        assert [s["id"] for s in paged] == [s["id"] for s in sales]
+        print(f"✅ /api/sales: {len(sales)} sales unpaged, same as {len(paged)} pages of 1")
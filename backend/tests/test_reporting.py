@@ -0,0 +1,257 @@
+"""
+Sales reporting tests - dashboards and owner reports read the sales_daily rollup
+Tests for:
+- A new sale shows up at once in dashboard stats, financial analysis and seller performance
+- A return is booked in the rollup with its refund amount
+- GET /api/owner/reports/sales buckets sales by hour/day/week/month in any time zone
+- GET /api/export/sales/report/csv exports the same report
+- GET /api/owner/timeseries caps each series at ?points= and downsamples long ranges
+- GET /api/owner/sales-by-product sums item totals per product, with sort/limit/date range
+- GET /api/owner/sales-by-seller groups sales per seller with names, date range and keyset pages
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', '').rstrip('/')
+
+
+@pytest.fixture
+def admin_headers():
+    """Get admin auth headers"""
+    response = requests.post(f"{BASE_URL}/api/auth/login", json={
+        "email": "admin@startup.com",
+        "password": "admin123"
+    })
+    if response.status_code != 200:
+        pytest.skip("Admin authentication failed")
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def product(admin_headers):
+    """A product with stock to sell"""
+    products = requests.get(f"{BASE_URL}/api/products", headers=admin_headers).json()
+    in_stock = [p for p in products if p.get("stock_quantity", 0) >= 2]
+    if not in_stock:
+        pytest.skip("No product in stock")
+    return in_stock[0]
+
+
+def make_sale(headers, product, quantity=2, price=1500):
+    response = requests.post(f"{BASE_URL}/api/sales", headers=headers, json={
+        "items": [{"product_id": product["id"], "quantity": quantity, "price": price}],
+        "payment_method": "orange_money",
+    })
+    assert response.status_code == 200, f"Sale failed: {response.text}"
+    return response.json()
+
+
+def today_totals(headers):
+    return requests.get(f"{BASE_URL}/api/owner/financial-analysis", headers=headers).json()["today"]
+
+
+class TestSalesRollup:
+    """Report totals follow each sale and return in the same write"""
+
+    def test_sale_updates_dashboard_and_reports(self, admin_headers, product):
+        """today's revenue, the monthly total and the payment method breakdown all move by the sale total"""
+        dashboard = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=admin_headers).json()
+        analysis = requests.get(f"{BASE_URL}/api/owner/financial-analysis", headers=admin_headers).json()
+        performance = requests.get(f"{BASE_URL}/api/seller/my-performance", headers=admin_headers).json()
+
+        sale = make_sale(admin_headers, product)
+
+        dashboard_after = requests.get(f"{BASE_URL}/api/dashboard/stats", headers=admin_headers).json()
+        analysis_after = requests.get(f"{BASE_URL}/api/owner/financial-analysis", headers=admin_headers).json()
+        performance_after = requests.get(f"{BASE_URL}/api/seller/my-performance", headers=admin_headers).json()
+        assert dashboard_after["today_sales"] == pytest.approx(dashboard["today_sales"] + sale["total"])
+        assert dashboard_after["monthly_revenue"] == pytest.approx(dashboard["monthly_revenue"] + sale["total"])
+        assert analysis_after["today"]["sales_count"] == analysis["today"]["sales_count"] + 1
+        assert analysis_after["total_all_time"]["profit"] == pytest.approx(analysis["total_all_time"]["profit"] + sale["profit"])
+        assert analysis_after["by_payment_method"]["orange_money"] == pytest.approx(
+            analysis["by_payment_method"].get("orange_money", 0) + sale["total"])
+        assert performance_after["all_time"]["sales_count"] == performance["all_time"]["sales_count"] + 1
+        print(f"✅ Sale of {sale['total']} GNF reflected in dashboard, financial analysis and performance")
+
+    def test_return_booked_with_refund_amount(self, admin_headers, product):
+        """A return counts in today's returns_count and returns_amount (sold price x quantity) once approved"""
+        sale = make_sale(admin_headers, product, quantity=2, price=1500)
+        before = today_totals(admin_headers)
+        response = requests.post(f"{BASE_URL}/api/returns", headers=admin_headers, json={
+            "sale_id": sale["id"], "product_id": product["id"], "quantity": 1, "reason": "Défaut"
+        })
+        assert response.status_code == 200, f"Return failed: {response.text}"
+        assert response.json()["return"]["amount"] == 1500
+        return_id = response.json()["return"]["id"]
+        pending = today_totals(admin_headers)
+        assert (pending["returns_count"], pending["returns_amount"]) == (before["returns_count"], before["returns_amount"])
+
+        requests.post(f"{BASE_URL}/api/returns/{return_id}/approve", headers=admin_headers).raise_for_status()
+        approved = today_totals(admin_headers)
+        assert approved["returns_count"] == before["returns_count"] + 1
+        assert approved["returns_amount"] == pytest.approx(before["returns_amount"] + 1500)
+
+        requests.post(f"{BASE_URL}/api/returns/{return_id}/reject", headers=admin_headers).raise_for_status()
+        rejected = today_totals(admin_headers)
+        assert rejected["returns_count"] == before["returns_count"]
+        assert rejected["returns_amount"] == pytest.approx(before["returns_amount"])
+        print(f"✅ Return of 1500 GNF booked on approval, backed out on rejection")
+
+
+class TestSalesReport:
+    """Bucketed reports over custom ranges, computed in SQL"""
+
+    def report(self, headers, **params):
+        response = requests.get(f"{BASE_URL}/api/owner/reports/sales", headers=headers, params=params)
+        assert response.status_code == 200, f"Report failed: {response.text}"
+        return response.json()
+
+    def test_buckets_agree(self, admin_headers, product):
+        """Hourly (raw sales), daily (rollup) and monthly buckets give the same totals over one range"""
+        make_sale(admin_headers, product)
+        daily = self.report(admin_headers, bucket="day")
+        hourly = self.report(admin_headers, bucket="hour", **{"from": daily["from"], "to": daily["to"]})
+        monthly = self.report(admin_headers, bucket="month", **{"from": daily["from"], "to": daily["to"]})
+        assert daily["totals"]["sales_count"] >= 1
+        assert len(hourly["series"]) == 24 * len(daily["series"])
+        for report in (hourly, monthly):
+            assert report["totals"]["sales_count"] == daily["totals"]["sales_count"]
+            assert report["totals"]["revenue"] == pytest.approx(daily["totals"]["revenue"])
+        print(f"✅ {daily['totals']['sales_count']} sale(s) from {daily['from']} to {daily['to']}, "
+              f"{len(daily['series'])} daily / {len(hourly['series'])} hourly buckets")
+
+    def test_other_time_zone(self, admin_headers):
+        """Totals over a wide range do not depend on the time zone, only the bucket boundaries do"""
+        params = {"from": "2020-01-01", "bucket": "month"}
+        local = self.report(admin_headers, **params)
+        tokyo = self.report(admin_headers, tz="Asia/Tokyo", **params)
+        assert tokyo["timezone"] == "Asia/Tokyo"
+        assert tokyo["series"][0]["start"].startswith("2020-01-01")
+        assert tokyo["totals"]["sales_count"] == local["totals"]["sales_count"]
+        print(f"✅ Asia/Tokyo report: {tokyo['totals']['sales_count']} sale(s)")
+
+    def test_invalid_parameters(self, admin_headers):
+        """Unknown zone, unknown bucket, reversed or too long ranges are 400s"""
+        for params in ({"tz": "Mars/Base"}, {"bucket": "year"}, {"from": "2026-02-01", "to": "2026-01-01"},
+                       {"from": "2000-01-01", "to": "2026-01-01", "bucket": "hour"}):
+            response = requests.get(f"{BASE_URL}/api/owner/reports/sales", headers=admin_headers, params=params)
+            assert response.status_code == 400, f"{params}: {response.status_code}"
+        print("✅ Invalid report parameters rejected")
+
+    def test_csv_export(self, admin_headers):
+        """One CSV line per bucket plus a total line"""
+        report = self.report(admin_headers, bucket="week")
+        response = requests.get(f"{BASE_URL}/api/export/sales/report/csv", headers=admin_headers, params={"bucket": "week"})
+        assert response.status_code == 200
+        assert "text/csv" in response.headers["content-type"]
+        lines = response.content.decode("utf-8-sig").strip().splitlines()
+        assert len(lines) == len(report["series"]) + 2
+        assert lines[-1].startswith('"Total",' + str(report["totals"]["sales_count"]))
+        print(f"✅ CSV export: {len(report['series'])} weekly buckets")
+
+
+class TestTimeseries:
+    """Chart series are downsampled on the server"""
+
+    def test_long_range_downsampled(self, admin_headers):
+        """A multi-year range fits in the point budget and sums to the same totals as the report"""
+        params = {"from": "2020-01-01", "metric": "revenue,count", "points": 100}
+        response = requests.get(f"{BASE_URL}/api/owner/timeseries", headers=admin_headers, params=params)
+        assert response.status_code == 200, f"Timeseries failed: {response.text}"
+        series = response.json()
+        report = requests.get(f"{BASE_URL}/api/owner/reports/sales", headers=admin_headers,
+                              params={"from": "2020-01-01", "bucket": "month"}).json()
+        assert series["downsampled"] and series["interval"] in ("30d", "90d")
+        assert all(len(points) <= 100 for points in series["series"].values())
+        assert sum(v for _, v in series["series"]["count"]) == report["totals"]["sales_count"]
+        assert sum(v for _, v in series["series"]["revenue"]) == pytest.approx(report["totals"]["revenue"])
+        print(f"✅ {len(series['series']['revenue'])} points at {series['interval']}, {len(response.content)} bytes")
+
+    def test_requested_interval_kept_when_it_fits(self, admin_headers):
+        """A short range keeps the requested step"""
+        response = requests.get(f"{BASE_URL}/api/owner/timeseries", headers=admin_headers,
+                                params={"interval": "1d", "metric": "profit"})
+        assert response.status_code == 200
+        series = response.json()
+        assert series["interval"] == "1d" and not series["downsampled"]
+        assert list(series["series"]) == ["profit"]
+        print(f"✅ 1d series with {len(series['series']['profit'])} points")
+
+    def test_invalid_parameters(self, admin_headers):
+        """Unknown metric or interval and out-of-range point budgets are 400s"""
+        for params in ({"metric": "gmv"}, {"interval": "2h"}, {"points": 0}, {"points": 100000}):
+            response = requests.get(f"{BASE_URL}/api/owner/timeseries", headers=admin_headers, params=params)
+            assert response.status_code == 400, f"{params}: {response.status_code}"
+        print("✅ Invalid timeseries parameters rejected")
+
+
+class TestSalesByProduct:
+    """Per-product breakdown from one shop-scoped join"""
+
+    def test_revenue_from_item_totals(self, admin_headers, product):
+        """A sale of 2 x 1500 adds 2 units and 3000 GNF of revenue to its product"""
+        def row():
+            rows = requests.get(f"{BASE_URL}/api/owner/sales-by-product", headers=admin_headers).json()
+            return next((r for r in rows if r["product_id"] == product["id"]), {"quantity_sold": 0, "revenue": 0})
+
+        before = row()
+        make_sale(admin_headers, product, quantity=2, price=1500)
+        after = row()
+        assert after["quantity_sold"] == before["quantity_sold"] + 2
+        assert after["revenue"] == pytest.approx(before["revenue"] + 3000)
+        assert "profit" in after
+        print(f"✅ {after['name']}: {after['quantity_sold']} sold, {after['revenue']} GNF")
+
+    def test_sort_limit_and_range(self, admin_headers):
+        """?sort= orders descending, ?limit= keeps the top N, a past range is empty"""
+        rows = requests.get(f"{BASE_URL}/api/owner/sales-by-product", headers=admin_headers,
+                            params={"sort": "quantity"}).json()
+        assert [r["quantity_sold"] for r in rows] == sorted((r["quantity_sold"] for r in rows), reverse=True)
+        top = requests.get(f"{BASE_URL}/api/owner/sales-by-product", headers=admin_headers,
+                           params={"sort": "quantity", "limit": 1}).json()
+        assert top == rows[:1]
+        old = requests.get(f"{BASE_URL}/api/owner/sales-by-product", headers=admin_headers, params={"to": "2000-01-01"})
+        assert old.status_code == 200 and old.json() == []
+        bad = requests.get(f"{BASE_URL}/api/owner/sales-by-product", headers=admin_headers, params={"sort": "name"})
+        assert bad.status_code == 400
+        print(f"✅ {len(rows)} product(s), top seller: {rows[0]['name'] if rows else '-'}")
+
+
+class TestSalesBySeller:
+    """Seller leaderboard from one grouped query"""
+
+    def test_sale_counted_for_seller(self, admin_headers, product):
+        """A sale adds 1 to the seller's count and its total to the seller's revenue"""
+        def row():
+            rows = requests.get(f"{BASE_URL}/api/owner/sales-by-seller", headers=admin_headers,
+                                params={"limit": 500}).json()
+            return next((r for r in rows if r["user_id"] == sale["user_id"]), {"count": 0, "total": 0})
+
+        sale = make_sale(admin_headers, product)
+        after = row()
+        assert after["count"] >= 1 and after["name"]
+        make_sale(admin_headers, product, quantity=2, price=1500)
+        again = row()
+        assert again["count"] == after["count"] + 1
+        assert again["total"] == pytest.approx(after["total"] + 3000)
+        print(f"✅ {again['name']}: {again['count']} sale(s), {again['total']} GNF")
+
+    def test_pages_and_range(self, admin_headers):
+        """Pages of ?limit=1 chained by X-Next-After give the full list; a past range is empty"""
+        rows = requests.get(f"{BASE_URL}/api/owner/sales-by-seller", headers=admin_headers).json()
+        assert [r["total"] for r in rows] == sorted((r["total"] for r in rows), reverse=True)
+        paged, params = [], {"limit": 1}
+        while True:
+            response = requests.get(f"{BASE_URL}/api/owner/sales-by-seller", headers=admin_headers, params=params)
+            assert response.status_code == 200
+            paged += response.json()
+            if "X-Next-After" not in response.headers:
+                break
+            params["after"] = response.headers["X-Next-After"]
+        assert paged == rows
+        old = requests.get(f"{BASE_URL}/api/owner/sales-by-seller", headers=admin_headers, params={"to": "2000-01-01"})
+        assert old.status_code == 200 and old.json() == []
+        bad = requests.get(f"{BASE_URL}/api/owner/sales-by-seller", headers=admin_headers, params={"after": "junk"})
+        assert bad.status_code == 400
+        print(f"✅ {len(rows)} seller(s) over {len(paged)} page(s)")
@@ -9,11 +9,13 @@ import string
 import logging
 import jwt
 import asyncio
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 from passlib.context import CryptContext
-from fastapi import HTTPException, Depends
+from typing import Optional
+from fastapi import HTTPException, Depends, Query, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from database import get_collection
+from database import get_collection, get_async_collection
+from reporting import created_at_range
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 # JWT Configuration
@@ -33,6 +35,10 @@ otp_storage = {}
 # Security dependency
 security = HTTPBearer(auto_error=False)
 
+# List endpoint page sizes (keyset pagination)
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
 
 # ========================
 # COLLECTION ACCESSORS
@@ -92,12 +98,51 @@ def activity_log_col():
     return get_collection("activity_log")
 
 
+# ========================
+# ASYNC COLLECTION ACCESSORS (asyncpg, awaitable - for hot request paths)
+# ========================
+def async_users_col():
+    return get_async_collection("users")
+
+def async_shops_col():
+    return get_async_collection("shops")
+
+def async_products_col():
+    return get_async_collection("products")
+
+def async_batches_col():
+    return get_async_collection("batches")
+
+def async_sales_col():
+    return get_async_collection("sales")
+
+def async_sale_items_col():
+    return get_async_collection("sale_items")
+
+def async_employees_col():
+    return get_async_collection("employees")
+
+def async_accounts_col():
+    return get_async_collection("accounts")
+
+def async_activity_log_col():
+    return get_async_collection("activity_log")
+
+
 # ========================
 # AUDIT / ACTIVITY LOG
 # ========================
 def log_activity(shop_id: str, user_id: str, user_name: str, user_role: str, action: str, details: str = "", target_type: str = "", target_id: str = ""):
     """Log an activity for audit trail visible to owner"""
-    activity_log_col().insert_one({
+    activity_log_col().insert_one(activity_entry(shop_id, user_id, user_name, user_role, action, details, target_type, target_id))
+
+async def log_activity_async(shop_id: str, user_id: str, user_name: str, user_role: str, action: str, details: str = "", target_type: str = "", target_id: str = ""):
+    """Awaitable log_activity for async handlers"""
+    await async_activity_log_col().insert_one(activity_entry(shop_id, user_id, user_name, user_role, action, details, target_type, target_id))
+
+def activity_entry(shop_id: str, user_id: str, user_name: str, user_role: str, action: str, details: str = "", target_type: str = "", target_id: str = "") -> dict:
+    """Build an activity_log document"""
+    return {
         "id": str(uuid.uuid4()),
         "shop_id": shop_id,
         "user_id": user_id,
@@ -108,7 +153,7 @@ def log_activity(shop_id: str, user_id: str, user_name: str, user_role: str, act
         "target_type": target_type,
         "target_id": target_id,
         "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    }
 
 
 # ========================
@@ -155,7 +200,7 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if not credentials:
         raise HTTPException(status_code=401, detail="Non authentifié")
     payload = verify_token(credentials.credentials)
-    user = users_col().find_one({"id": payload.get("user_id")})
+    user = await async_users_col().find_one({"id": payload.get("user_id")})
     if not user:
         raise HTTPException(status_code=401, detail="Utilisateur non trouvé")
     return serialize_doc(user)
@@ -176,6 +221,52 @@ def is_admin_role(user: dict) -> bool:
     """Check if user has admin-level access (sees all data)."""
     return user.get("role") in ("super_admin", "ceo")
 
+async def shop_timezone(shop_id: Optional[str]) -> Optional[str]:
+    """The shop's time zone setting, or None (reports then use REPORT_TIMEZONE)."""
+    if not shop_id:
+        return None
+    shop = await async_shops_col().find_one({"id": shop_id}, {"timezone": 1})
+    return shop.get("timezone") if shop else None
+
+async def date_range(date_from: Optional[date] = Query(None, alias="from"),
+                     date_to: Optional[date] = Query(None, alias="to"), shop_id: Optional[str] = None,
+                     current_user: dict = Depends(get_current_user)) -> dict:
+    """?from=&to= (YYYY-MM-DD, both days included) as a created_at range filter; {} when unbounded.
+
+    Days are local to the listed shop's time zone, like the owner reports.
+    """
+    if not date_from and not date_to:
+        return {}
+    tz = await shop_timezone(shop_id or get_shop_filter(current_user).get("shop_id"))
+    try:
+        return created_at_range(date_from, date_to, tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# ========================
+# PAGINATION
+# ========================
+def pagination(limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE), after: Optional[str] = None) -> dict:
+    """?limit=&after= query parameters for keyset-paginated list endpoints.
+
+    Paging is opt-in: without either parameter the whole list is returned,
+    and ``after`` alone pages by DEFAULT_PAGE_SIZE.
+    """
+    return {"limit": limit or (DEFAULT_PAGE_SIZE if after else None), "after": after}
+
+def paginate(cursor, page: dict):
+    """Apply a page (from pagination()) to a cursor; a bad ``after`` token is a 400."""
+    try:
+        return cursor.limit(page["limit"]).after(page["after"])
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Jeton de pagination invalide")
+
+def set_next_page(response: Response, cursor):
+    """Expose the next page's token in the X-Next-After header (absent on the last page)."""
+    if cursor.next_after:
+        response.headers["X-Next-After"] = cursor.next_after
+
 
 # ========================
 # OTP FUNCTIONS